@@ -0,0 +1,586 @@
+"""
+分析のコア (Streamlit なしで使える部分)
+
+株探・Yahoo からの取得、日足の保存、指標・スコア・バックテストの計算を
+画面から切り離してまとめたもの。app_free.py はここを呼んで表示するだけにし、
+スクリプトや cron (score_universe.py) からも同じ処理をそのまま使う。
+キャッシュはプロセス内のモジュール変数と http_client / storage 側で持つ。
+銘柄ごとの個別情報と分析結果は analysis_cache でプロセス間に共有する。
+"""
+
+import datetime
+import re
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import yfinance as yf
+
+from analysis_cache import get_analysis_cache
+from backtest import (
+    DEFAULT_HOLD_DAYS,
+    DEFAULT_LOOKBACK,
+    simulate_trades,
+    summarize_trades,
+)
+from http_client import archived_call, fetch_page, fetch_with_retry, host_slot
+from indicators import IndicatorState, build_features, ensure_features
+from kabutan_parser import default_stock_info, parse_kabuka_page, parse_stock_page
+from results import AnalysisRecord, compact_factors
+from scoring import get_market_cap_category, get_target_pct_new, score_frame
+from storage import get_bar_store
+from volume_profile import load_profile
+
+
+def get_market_status():
+    jst_now = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=9)
+    current_time = jst_now.time()
+    if jst_now.weekday() >= 5:
+        return "休日(固定)", jst_now
+    if datetime.time(15, 50, 1) <= current_time or current_time < datetime.time(
+        9, 0, 1
+    ):
+        return "場前(固定)", jst_now
+    if datetime.time(9, 0, 1) <= current_time <= datetime.time(15, 50, 0):
+        return "場中(進行中)", jst_now
+    return "引け後(確定値)", jst_now
+
+
+INTRADAY_INFO_TTL = 30  # 場中の個別情報キャッシュの刻み (秒)
+
+
+def market_phase_id(status=None, now=None):
+    """
+    個別情報キャッシュ用の市場フェーズを (phase, bucket) で返す。
+    - 場中: phase は当日、bucket は INTRADAY_INFO_TTL 秒刻み
+    - それ以外: 直近の大引け日で固定 (金曜引け後〜月曜寄り前は同じフェーズ)
+    """
+    if status is None:
+        status, now = get_market_status()
+    if "進行中" in status:
+        return f"live:{now.date().isoformat()}", int(
+            now.timestamp() // INTRADAY_INFO_TTL
+        )
+    close_day = now.date()
+    if now.weekday() >= 5 or now.time() < datetime.time(15, 50, 0):
+        close_day -= datetime.timedelta(days=1)
+    while close_day.weekday() >= 5:
+        close_day -= datetime.timedelta(days=1)
+    return f"closed:{close_day.isoformat()}", 0
+
+
+def data_stamp(phase_id=None):
+    """共有キャッシュ (analysis_cache) のキーにする元データの時刻"""
+    phase, bucket = phase_id or market_phase_id()
+    return f"{phase}#{bucket}"
+
+
+def fetch_kabutan_info(code, phase_id=None):
+    """
+    株探から個別情報を取得 (月名問題・出来高正規表現・時価総額取得修正)
+    phase_id (market_phase_id の値) を渡すと、同じフェーズの取得結果を共有キャッシュから返す。
+    取得失敗時は例外を送出する。
+    """
+
+    def fetch():
+        url = f"https://kabutan.jp/stock/?code={code}"
+        res = fetch_with_retry(url)
+        res.encoding = res.apparent_encoding
+        return parse_stock_page(res.text)
+
+    if phase_id is None:
+        return fetch()
+    return get_analysis_cache().get_or_compute(
+        "info", code, data_stamp(phase_id), fetch
+    )
+
+
+def get_kabutan_info(code, on_error=None):
+    """
+    fetch_kabutan_info (現在の市場フェーズの共有キャッシュ付き) の失敗時は
+    on_error にメッセージを渡し、既定値を返す
+    """
+    try:
+        return fetch_kabutan_info(code, market_phase_id())
+    except Exception as e:
+        if on_error:
+            on_error(f"データ取得エラー ({code}): {e}")
+        return default_stock_info()
+
+
+def fetch_25day_ratio():
+    """25日騰落レシオを取得する。取得・抽出できなければ None"""
+    url = "https://nikkeiyosoku.com/up_down_ratio/"
+    res = fetch_with_retry(url)
+    res.encoding = res.apparent_encoding
+    m_ratio = re.search(r'<p class="stock-txt">([0-9\.]+)', res.text.replace("\n", ""))
+    return float(m_ratio.group(1).strip()) if m_ratio else None
+
+
+KABUKA_PAGE_TTL = 300  # 株探の時系列ページの保持秒数
+
+
+def get_kabuka_page(code):
+    """
+    株探の時系列ページを1回だけ取得・解析し、URL単位で KABUKA_PAGE_TTL 秒保持する。
+    決算日と履歴の両方がこの結果を共有する。
+    """
+    url = f"https://kabutan.jp/stock/kabuka?code={code}&ashi=day"
+    try:
+        return fetch_page(url, parse=parse_kabuka_page, ttl=KABUKA_PAGE_TTL)
+    except Exception:
+        return None, pd.DataFrame()
+
+
+def get_kabutan_recent_history(code):
+    """株探の時系列テーブルから直近の日足を取得する"""
+    return get_kabuka_page(code)[1]
+
+
+def get_kabutan_earnings_date(code):
+    """株探の時系列ページから決算日 (予定日 or 発表済の実績日) を取得する"""
+    return get_kabuka_page(code)[0]
+
+
+_volume_profile = None
+_volume_profile_lock = threading.Lock()
+
+
+def get_volume_profile():
+    """プロセス内で共有。校正済みの出来高進捗があればそれを、無ければ既定の折れ線を使う"""
+    global _volume_profile
+    with _volume_profile_lock:
+        if _volume_profile is None:
+            _volume_profile = load_profile(get_bar_store())
+        return _volume_profile
+
+
+def get_volume_weight(current_dt, market_cap, status):
+    """current_dt 時点で1日の出来高のどれだけが出ているはずか (休日・引け後は 1.0)"""
+    if "休日" in status or "引け後" in status:
+        return 1.0
+    return get_volume_profile().weight(current_dt, market_cap)
+
+
+def calculate_score_trail(df, info, vol_ratios, status, market_ratio=100.0):
+    """
+    直近 len(vol_ratios) 日分のスコアを古い順のリストで返す
+    (各要素は scoring.ScoreResult)。
+    vol_ratios は各日に適用する出来高倍率 (古い順)。判定は scoring.score_frame を参照。
+    """
+    return score_frame(df, info.get("cap", 0), vol_ratios, market_ratio)
+
+
+def calculate_score_and_logic(df, info, vol_ratio, status, market_ratio=100.0):
+    return calculate_score_trail(df, info, [vol_ratio], status, market_ratio)[-1]
+
+
+def run_backtest_precise(
+    df, market_cap, lookback=DEFAULT_LOOKBACK, hold_days=DEFAULT_HOLD_DAYS
+):
+    """
+    直近 lookback 日 (None で全期間) の勝率を検証する。
+    売買ルールと判定は backtest.simulate_trades (配列版) を参照。
+    """
+    try:
+        if len(df) < 80:
+            return "データ不足", 0.0, 0, 0.0, 0.0, 0, 0
+        category = get_market_cap_category(market_cap)
+        target_pct = get_target_pct_new(category, is_half=False)
+        trades = simulate_trades(
+            ensure_features(df), target_pct, lookback=lookback, hold_days=hold_days
+        )
+        wins, losses, max_dd_pct = summarize_trades(trades)
+        total_trades = wins + losses
+        win_rate_pct = (wins / total_trades) * 100 if total_trades > 0 else 0.0
+        bt_str_new = f"{win_rate_pct:.0f}%"
+        if total_trades == 0:
+            return "機会なし", 0.0, 0, 0.0, target_pct, 0, 0
+        return (
+            bt_str_new,
+            win_rate_pct,
+            total_trades,
+            max_dd_pct,
+            target_pct,
+            wins,
+            losses,
+        )
+    except Exception as e:
+        return f"計算エラー: {e}", 0.0, 0, 0.0, 0.0, 0, 0
+
+
+run_backtest = run_backtest_precise
+
+
+YF_CHUNK_SIZE = 50  # yf.download 1回あたりの銘柄数
+HISTORY_MONTHS = 6  # スコア計算に使う日足の期間 (月数)
+YF_THREADS = 4  # yfinance 内部のダウンロードスレッド数
+YAHOO_OVERLAP_DAYS = 10  # 差分取得で保存済みの日足と重ねる日数 (分割・併合の検出用)
+ADJUST_TOLERANCE = 0.005  # 重なった確定足の終値のずれの許容幅 (これを超えたら取り直す)
+STALE_BAR_DAYS = 7  # 最新の日足がこれより古ければ当日の行を足さずにエラーにする
+BACKFILL_SLACK_DAYS = 7  # 長期の取り直しで、保存済みの初日の遅れを許す日数
+
+
+def normalize_yahoo_frame(df):
+    """yfinance の MultiIndex 列を平坦化し、日付昇順に揃える"""
+    df = df.copy()
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = df.columns.get_level_values(0)
+    return df.sort_index()
+
+
+def split_yahoo_frame(raw, symbol):
+    """複数銘柄の一括ダウンロード結果から1銘柄分を切り出す"""
+    if raw is None or raw.empty:
+        return pd.DataFrame()
+    if isinstance(raw.columns, pd.MultiIndex):
+        if symbol in raw.columns.get_level_values(0):
+            df = raw[symbol]
+        elif symbol in raw.columns.get_level_values(1):
+            df = raw.xs(symbol, axis=1, level=1)
+        else:
+            return pd.DataFrame()
+    else:
+        df = raw
+    return normalize_yahoo_frame(df.dropna(how="all"))
+
+
+def download_yahoo_chunks(codes, interval="1d", **download_kwargs):
+    """
+    codes を YF_CHUNK_SIZE 件ずつ yf.download (interval 足) でまとめて取得し、
+    {コード: DataFrame} で返す。取得できなかった銘柄は辞書に含めない。
+    """
+    frames = {}
+    for i in range(0, len(codes), YF_CHUNK_SIZE):
+        chunk = codes[i : i + YF_CHUNK_SIZE]
+        symbols = [f"{c}.T" for c in chunk]
+
+        def download():
+            # yf.download は銘柄ごとにリクエストを送るので、予算も銘柄数分使う
+            with host_slot("finance.yahoo.com", tokens=len(symbols)):
+                return yf.download(
+                    symbols,
+                    interval=interval,
+                    progress=False,
+                    auto_adjust=False,
+                    group_by="ticker",
+                    threads=YF_THREADS,
+                    **download_kwargs,
+                )
+
+        try:
+            options = tuple(sorted(download_kwargs.items()))
+            key = ("yf.download", tuple(symbols), interval, options)
+            raw = archived_call(key, download)
+        except Exception:
+            continue
+        for code, symbol in zip(chunk, symbols):
+            df = split_yahoo_frame(raw, symbol)
+            if not df.empty:
+                frames[code] = df
+    return frames
+
+
+def _bars_adjusted(stored, fresh):
+    """
+    保存済みの日足と取り直した日足で、重なる確定足の終値がずれていれば True
+    (株式分割・併合で過去の価格が調整された)。保存済みの最終日は未確定足の場合があるので除く。
+    """
+    common = stored.index[:-1].intersection(fresh.index)
+    if common.empty:
+        return False
+    ratio = fresh.loc[common, "Close"] / stored.loc[common, "Close"]
+    return bool(((ratio - 1).abs() > ADJUST_TOLERANCE).any())
+
+
+def prefetch_yahoo_history(tickers, months=HISTORY_MONTHS):
+    """
+    ローカルの日足ストアを起点に、不足分の日足だけを Yahoo から取得して追記し、
+    直近 months か月分を {コード: DataFrame} で返す。
+    - 未保存の銘柄: months か月分をまとめて取得
+    - 保存済みの銘柄: 最終保存日の YAHOO_OVERLAP_DAYS 日前から取得し、
+      重なった日の終値がずれていれば (分割・併合) 保存済みの全期間を取り直す
+    今回の取得に失敗した銘柄は、保存済みの日足があっても返さない (呼び出し側でエラーにする)。
+    """
+    codes = list(dict.fromkeys(str(t).strip().upper() for t in tickers))
+    store = get_bar_store()
+    last_dates = store.last_dates(codes)
+
+    new_codes = [c for c in codes if c not in last_dates]
+    downloaded = download_yahoo_chunks(new_codes, period=f"{months}mo")
+
+    # 最終保存日が同じ銘柄ごとにまとめて差分を取得
+    by_start = {}
+    for code, last in last_dates.items():
+        start = last - pd.Timedelta(days=YAHOO_OVERLAP_DAYS)
+        by_start.setdefault(start, []).append(code)
+    adjusted = []
+    for start, group in by_start.items():
+        fresh = download_yahoo_chunks(group, start=start.strftime("%Y-%m-%d"))
+        for code, df in fresh.items():
+            if _bars_adjusted(store.load(code, start=start), df):
+                adjusted.append(code)
+            else:
+                downloaded[code] = df
+
+    for code, df in downloaded.items():
+        store.upsert(code, df)
+    if adjusted:
+        first, _ = store.date_range(adjusted)
+        for code, df in download_yahoo_chunks(
+            adjusted, start=first.strftime("%Y-%m-%d")
+        ).items():
+            store.replace(code, df)
+            downloaded[code] = df
+
+    today = pd.Timestamp(get_market_status()[1].date())
+    window_start = today - pd.DateOffset(months=months)
+    frames = {}
+    for code in codes:
+        if code not in downloaded:
+            continue
+        df = store.load(code, start=window_start)
+        if not df.empty:
+            frames[code] = df
+    return frames
+
+
+def backfill_yahoo_history(tickers, months):
+    """
+    保存済みの日足が直近 months か月分に満たない銘柄について、その期間を Yahoo から
+    取り直して置き換える (バックテストの長期検証用。分析時は HISTORY_MONTHS か月分だけ
+    保存される)。取り直した銘柄のコードを返す。
+    上場が期間の途中の銘柄は毎回取り直しになる。
+    """
+    codes = list(dict.fromkeys(str(t).strip().upper() for t in tickers))
+    store = get_bar_store()
+    today = pd.Timestamp(get_market_status()[1].date())
+    start = today - pd.DateOffset(months=months)
+    # 期間の初日が休場日でも取り直さないよう、少し余裕を持たせる
+    enough = start + pd.Timedelta(days=BACKFILL_SLACK_DAYS)
+    first_dates = store.first_dates(codes)
+    short = [code for code in codes if first_dates.get(code, today) > enough]
+    frames = download_yahoo_chunks(short, start=start.strftime("%Y-%m-%d"))
+    for code, df in frames.items():
+        store.replace(code, df)
+    return list(frames)
+
+
+INTRADAY_DAYS = 5  # 1分足を取得する日数 (Yahoo の1分足は直近7日分まで)
+
+
+def collect_intraday_volume(tickers, days=INTRADAY_DAYS):
+    """
+    直近 days 日分の1分足の出来高を Yahoo から取得して日足ストアに保存する
+    (volume_profile の校正用)。保存できた銘柄数を返す。
+    """
+    codes = list(dict.fromkeys(str(t).strip().upper() for t in tickers))
+    store = get_bar_store()
+    frames = download_yahoo_chunks(codes, interval="1m", period=f"{days}d")
+    for code, df in frames.items():
+        if df.index.tz is not None:
+            df = df.tz_convert("Asia/Tokyo").tz_localize(None)
+        store.upsert_intraday(code, df)
+    return len(frames)
+
+
+# 銘柄ごとの指標の途中状態 (場中の再取得で差分更新に使う。プロセス内で共有)
+# 全銘柄スキャンで膨らまないよう、最近使った INDICATOR_STATE_MAX 銘柄分だけ保持する
+INDICATOR_STATE_MAX = 300
+_indicator_states = {"states": OrderedDict(), "lock": threading.Lock()}
+
+
+def live_features(code, df):
+    """
+    最終行 (場中の現在値) だけが前回から変わった日足なら、保持している途中状態に
+    最終行を差し込んで指標列を更新する。履歴が変わっていれば build_features で作り直す。
+    """
+    if len(df) < 2:
+        return build_features(df)
+    key = (len(df), df.index[-2], df.index[-1], float(df["Close"].iloc[-2]))
+    registry = _indicator_states
+    with registry["lock"]:
+        cached = registry["states"].get(code)
+        if cached is not None and cached[0] == key:
+            registry["states"].move_to_end(code)
+            # 差し込みは数十µs なのでロックを持ったまま行う
+            cached[1].update_last(df.iloc[-1])
+            return cached[1].frame
+    df = build_features(df)
+    with registry["lock"]:
+        registry["states"][code] = (key, IndicatorState(df))
+        registry["states"].move_to_end(code)
+        while len(registry["states"]) > INDICATOR_STATE_MAX:
+            registry["states"].popitem(last=False)
+    return df
+
+
+def analyze_ticker(
+    ticker, get_info=None, yahoo_batch=None, on_error=None, use_cache=True
+):
+    """
+    1銘柄を分析して AnalysisRecord を返す (取得・解析できなければ None)。
+    get_info: コード -> 株探の個別情報 (省略時は get_kabutan_info)
+    yahoo_batch: prefetch_yahoo_history の結果を返す Future (省略時は個別に取得)
+    on_error: エラーメッセージを受け取る関数
+    use_cache: 同じ市場フェーズ (data_stamp) の分析結果が共有キャッシュにあればそれを返す。
+    他のセッション・プロセスが同じ銘柄を分析中なら、その結果を待つ
+    """
+    if not use_cache:
+        return _analyze_ticker(ticker, get_info, yahoo_batch, on_error)
+    ticker_clean = str(ticker).strip().upper()
+    return get_analysis_cache().get_or_compute(
+        "analysis",
+        ticker_clean,
+        data_stamp(),
+        lambda: _analyze_ticker(ticker_clean, get_info, yahoo_batch, on_error),
+    )
+
+
+def _analyze_ticker(ticker, get_info, yahoo_batch, on_error):
+
+    def report(message):
+        if on_error:
+            on_error(message)
+
+    if get_info is None:
+
+        def get_info(code):
+            return get_kabutan_info(code, on_error=report)
+
+    status, jst_now_local = get_market_status()
+    ticker_clean = str(ticker).strip().upper()
+    yf_ticker = f"{ticker_clean}.T"
+
+    info = get_info(ticker_clean)
+    if info.get("price") is None:
+        return None
+    # 出来高進捗の校正・バックテスト検証で区分を決めるため、時価総額を残しておく
+    get_bar_store().save_caps({ticker_clean: info.get("cap")})
+
+    # 株探から最新の決算日情報を取得
+    k_earnings_date = get_kabutan_earnings_date(ticker_clean)
+
+    try:
+        df_yf = None
+        if yahoo_batch is not None:
+            df_yf = yahoo_batch.result().get(ticker_clean)
+        if df_yf is None:
+            df_yf = prefetch_yahoo_history([ticker_clean]).get(ticker_clean)
+        if df_yf is None or df_yf.empty:
+            report(f"Yahooデータ空空 ({yf_ticker})")
+            return None
+
+        df = normalize_yahoo_frame(df_yf)
+
+        # 現在値の反映
+        today_date = pd.to_datetime(jst_now_local.date())
+        if (today_date - df.index[-1]).days > STALE_BAR_DAYS:
+            report(f"Yahooデータが古い ({yf_ticker}: {df.index[-1]:%Y-%m-%d})")
+            return None
+        if info.get("price") is not None:
+            new_row = pd.Series(
+                {
+                    "Open": info.get("open", info["price"]),
+                    "High": info.get("high", info["price"]),
+                    "Low": info.get("low", info["price"]),
+                    "Close": info["price"],
+                    "Volume": info.get("volume", 0),
+                },
+                name=today_date,
+            )
+            if today_date > df.index[-1]:
+                df = pd.concat([df, new_row.to_frame().T])
+            else:
+                for col in new_row.index:
+                    df.iloc[-1, df.columns.get_loc(col)] = new_row[col]
+
+        # --- 決算判定ロジック：多段階カラー表示と発表後3日間の維持 ---
+        earnings_day_count = None
+        earnings_disp_str = ""
+        is_earnings_soon = False
+
+        if k_earnings_date:
+            days = (k_earnings_date.date() - jst_now_local.date()).days
+            earnings_day_count = days
+            dt_str = k_earnings_date.strftime("%m/%d")
+
+            if days > 14:
+                # 14日超：グレー表示
+                earnings_disp_str = f"決算 {dt_str} (あと{days}日)"
+            elif 7 < days <= 14:
+                # 8〜14日：オレンジ表示
+                earnings_disp_str = f"決算 {dt_str} (あと{days}日)"
+            elif 0 <= days <= 7:
+                # 0〜7日：赤色表示（CSVフラグをTRUEに）
+                earnings_disp_str = f"決算 {dt_str} (あと{days}日)"
+                is_earnings_soon = True
+            elif -3 <= days < 0:
+                # 発表後3日間：グレー表示（決算発表済）
+                earnings_disp_str = f"決算発表済"
+            else:
+                # 発表から4日以上：表示を消去
+                earnings_day_count = None
+
+        # 指標・スコア計算 (指標列はここで1回だけ作り、以降はすべてこれを読む)
+        df = live_features(ticker_clean, df)
+        vol_sma5_val = df["Vol_SMA5"].iloc[-1]
+        v_weight = get_volume_weight(jst_now_local, info["cap"], status)
+        vol_ratio = (
+            info.get("volume", 0) / (vol_sma5_val * v_weight)
+            if (vol_sma5_val * v_weight) > 0
+            else 1.0
+        )
+
+        bt_res = run_backtest(df, info["cap"])
+        bt_str, bt_win_rate, _, _, _, bt_wins, bt_losses = bt_res
+
+        # 前日 (出来高倍率 1.0) と当日のスコアを1回の呼び出しでまとめて評価する
+        prev_score, today_score = calculate_score_trail(
+            df, info, [1.0, vol_ratio], status
+        )
+        p_s = prev_score.score
+        s, r = today_score.score, today_score
+
+        return AnalysisRecord(
+            code=ticker_clean,
+            name=info["name"],
+            price=info.get("price"),
+            cap_val=info["cap"],
+            per=info["per"],
+            pbr=info["pbr"],
+            rsi=r.rsi,
+            rci=r.rci,
+            vol_ratio=vol_ratio,
+            avg_volume_5d=vol_sma5_val,
+            strategy=r.strategy,
+            score=max(0, min(100, s)),
+            score_diff=s - p_s,
+            score_factors=compact_factors(r.factors),
+            buy=r.buy,
+            oshime_price=r.oshime_price,
+            p_half=r.p_half,
+            p_full=r.p_full,
+            max_dd_pct=r.max_dd_pct,
+            sl_pct=r.sl_pct,
+            sl_ma=r.sl_ma,
+            risk_reward=(
+                (r.p_full - r.buy) / (r.buy - r.sl_ma) if (r.buy - r.sl_ma) > 0 else 0.0
+            ),
+            atr_smoothed=r.atr_smoothed,
+            atr_comment=r.atr_comment,
+            momentum=r.momentum,
+            is_aoteng=r.is_aoteng,
+            backtest=bt_str,
+            win_rate_pct=bt_win_rate,
+            bt_win_count=bt_wins,
+            bt_loss_count=bt_losses,
+            is_updated_in_this_run=True,
+            earnings_date=k_earnings_date,
+            earnings_day_count=earnings_day_count,
+            earnings_disp_str=earnings_disp_str,
+            is_earnings_soon=is_earnings_soon,
+        )
+    except Exception as e:
+        report(f"Yahoo解析エラー ({ticker_clean}): {e}")
+        return None
@@ -0,0 +1,224 @@
+"""
+プロセス間で共有する分析キャッシュ (SQLite)
+
+銘柄ごとの入力 (株探の個別情報) と分析結果 (AnalysisRecord) を、
+銘柄コードと元データの時刻 (市場フェーズ。analysis.data_stamp) をキーに
+CACHE_DIR の analysis.sqlite3 に保存する。同じ時刻のデータなら、
+別のセッション・別のサーバープロセスが取得・計算した結果をそのまま使う。
+
+同じキーを複数が同時に求めた場合は、リース (leases テーブル) を取った1つだけが
+計算し、他はその結果が書き込まれるのを待つ。計算中はリースを定期的に延長し、
+プロセスが落ちて延長が止まれば LEASE_SECONDS で失効して他が引き継ぐ。
+取得に失敗した結果 (None) は保存しない。古い結果と失効したリースは
+書き込みのついでに PRUNE_INTERVAL ごとに削除する。
+SQLite の接続はスレッドごとに1つ開いて使い回す。
+"""
+
+import pickle
+import threading
+import time
+import uuid
+from contextlib import closing, contextmanager
+
+from http_client import ARCHIVE_MODE
+from storage import connect
+
+ANALYSIS_DB = "analysis.sqlite3"
+CACHE_RETENTION = 2 * 24 * 3600  # 保存から削除までの秒数
+LEASE_SECONDS = 120  # 計算中の印の有効期限
+LEASE_POLL = 0.5  # 他のプロセスの計算結果を確認する間隔 (秒)
+PRUNE_INTERVAL = 600  # 古い結果・失効したリースを削除する間隔 (秒)
+
+
+class AnalysisCache:
+    """(種類, 銘柄コード, データ時刻) をキーにした共有キャッシュ"""
+
+    def __init__(self, db_name=ANALYSIS_DB):
+        self.db_name = db_name
+        self.owner = uuid.uuid4().hex  # リースの持ち主 (プロセス内で共通)
+        self._key_locks = {}  # key -> [Lock, 待っているスレッド数]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._held = set()  # 計算中 (リースを延長する) のキー
+        self._renewer = None
+        self._pruned_at = time.time()
+        with closing(connect(self.db_name)) as conn, conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    kind TEXT NOT NULL,
+                    code TEXT NOT NULL,
+                    stamp TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    saved_at REAL NOT NULL,
+                    PRIMARY KEY (kind, code, stamp)
+                ) WITHOUT ROWID
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS leases (
+                    kind TEXT NOT NULL,
+                    code TEXT NOT NULL,
+                    stamp TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (kind, code, stamp)
+                ) WITHOUT ROWID
+                """
+            )
+            self._prune(conn, self._pruned_at)
+
+    @staticmethod
+    def _prune(conn, now):
+        """保存期間を過ぎた結果と失効したリースを削除する"""
+        conn.execute("DELETE FROM entries WHERE saved_at < ?", (now - CACHE_RETENTION,))
+        conn.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+
+    def _conn(self):
+        """このスレッド用の接続 (初回だけ開く)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.db_name)
+        return conn
+
+    def get(self, kind, code, stamp):
+        """保存済みの値 (無ければ None)"""
+        row = self._conn().execute(
+            "SELECT value FROM entries WHERE kind = ? AND code = ? AND stamp = ?",
+            (kind, code, stamp),
+        ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def put(self, kind, code, stamp, value):
+        now = time.time()
+        with self._lock:
+            prune = now - self._pruned_at >= PRUNE_INTERVAL
+            if prune:
+                self._pruned_at = now
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (kind, code, stamp, value, saved_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (kind, code, stamp, pickle.dumps(value), now),
+            )
+            if prune:
+                self._prune(conn, now)
+
+    def _claim(self, kind, code, stamp):
+        """リースを取れたら True (失効したリースは奪う)"""
+        key = (kind, code, stamp)
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "DELETE FROM leases WHERE kind = ? AND code = ? AND stamp = ? "
+                "AND expires_at < ?",
+                (*key, now),
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO leases (kind, code, stamp, owner, expires_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (*key, self.owner, now + LEASE_SECONDS),
+            )
+            (owner,) = conn.execute(
+                "SELECT owner FROM leases WHERE kind = ? AND code = ? AND stamp = ?",
+                key,
+            ).fetchone()
+        return owner == self.owner
+
+    def _release(self, kind, code, stamp):
+        with self._conn() as conn:
+            conn.execute(
+                "DELETE FROM leases WHERE kind = ? AND code = ? AND stamp = ? "
+                "AND owner = ?",
+                (kind, code, stamp, self.owner),
+            )
+
+    def _renew(self, keys):
+        """自分のリースの期限を延ばす"""
+        expires_at = time.time() + LEASE_SECONDS
+        with self._conn() as conn:
+            conn.executemany(
+                "UPDATE leases SET expires_at = ? "
+                "WHERE kind = ? AND code = ? AND stamp = ? AND owner = ?",
+                [(expires_at, *key, self.owner) for key in keys],
+            )
+
+    def _renew_loop(self):
+        """計算中のキーが無くなるまで LEASE_SECONDS の 1/3 ごとにリースを延ばす"""
+        while True:
+            time.sleep(LEASE_SECONDS / 3)
+            with self._lock:
+                keys = list(self._held)
+                if not keys:
+                    self._renewer = None
+                    return
+            self._renew(keys)
+
+    @contextmanager
+    def _hold(self, key):
+        """with の間、key のリースを延長し続ける"""
+        with self._lock:
+            self._held.add(key)
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew_loop, daemon=True)
+                self._renewer.start()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._held.discard(key)
+
+    @contextmanager
+    def _key_lock(self, key):
+        """key ごとのロック。使うスレッドがいなくなったら辞書から外す"""
+        with self._lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[key]
+
+    def get_or_compute(self, kind, code, stamp, compute):
+        """
+        保存済みならその値を、無ければ compute() を1回だけ実行して保存した値を返す。
+        外部アクセスの記録・再生中 (HTTP_ARCHIVE_MODE) は常に compute() する。
+        """
+        if ARCHIVE_MODE:
+            return compute()
+        # プロセス内の同じキーはロックで、プロセス間はリースで1つにまとめる
+        key = (kind, code, stamp)
+        with self._key_lock(key):
+            while True:
+                value = self.get(kind, code, stamp)
+                if value is not None:
+                    return value
+                if self._claim(kind, code, stamp):
+                    break
+                time.sleep(LEASE_POLL)
+            try:
+                with self._hold(key):
+                    value = compute()
+                if value is not None:
+                    self.put(kind, code, stamp, value)
+                return value
+            finally:
+                self._release(kind, code, stamp)
+
+
+_analysis_cache = None
+_analysis_cache_lock = threading.Lock()
+
+
+def get_analysis_cache():
+    """プロセス内で共有する AnalysisCache を返す"""
+    global _analysis_cache
+    with _analysis_cache_lock:
+        if _analysis_cache is None:
+            _analysis_cache = AnalysisCache()
+        return _analysis_cache
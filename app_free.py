@@ -2,17 +2,29 @@ import streamlit as st
 import pandas as pd
 from google import genai
 import datetime
-import time
 import requests
 
 # import io
 import re
 import numpy as np
-import random
 import hashlib
 import os
 import base64
-import yfinance as yf  # 追加
+import threading
+import uuid
+from functools import partial
+from analysis import (
+    fetch_25day_ratio,
+    fetch_kabutan_info,
+    get_market_status,
+    market_phase_id,
+)
+from http_client import archived_call, host_slot, is_replay
+from background import JobRunner, StaleWhileRevalidate
+from checkpoint import ScanCheckpoint
+from kabutan_parser import default_stock_info
+from results import ResultTable
+from scheduler import SOURCE_LABELS, UniverseScan, estimate_seconds
 
 # --- アイコン設定（オリジナル画像） ---
 ICON_URL = "https://raw.githubusercontent.com/soutori296/stock-analysis/main/aisan.png"
@@ -25,20 +37,6 @@ st.set_page_config(page_title=PAGE_TITLE, page_icon=ICON_URL, layout="wide")
 
 
 # --- 時間管理 (JST) ---
-def get_market_status():
-    jst_now = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=9)
-    current_time = jst_now.time()
-    if jst_now.weekday() >= 5:
-        return "休日(固定)", jst_now
-    if datetime.time(15, 50, 1) <= current_time or current_time < datetime.time(
-        9, 0, 1
-    ):
-        return "場前(固定)", jst_now
-    if datetime.time(9, 0, 1) <= current_time <= datetime.time(15, 50, 0):
-        return "場中(進行中)", jst_now
-    return "引け後(確定値)", jst_now
-
-
 status_label, jst_now = get_market_status()
 status_color = "#d32f2f" if "進行中" in status_label else "#1976d2"
 
@@ -167,7 +165,6 @@ state_keys = [
     "error_messages",
     "clear_confirmed",
     "tickers_input_value",
-    "analysis_run_count",
     "is_first_session_run",
     "analysis_index",
     "current_input_hash",
@@ -180,9 +177,9 @@ state_keys = [
     "ui_filter_liquid_on",
     "ui_filter_max_rsi",
     "ui_filter_rsi_on",
-    "is_running_continuous",
-    "wait_start_time",
-    "run_continuously_checkbox",
+    "job_id",
+    "job_total",
+    "job_notice",
     "gemini_api_key_input",
     "authenticated",
     "trigger_copy_filtered_data",
@@ -201,15 +198,16 @@ for k in state_keys:
             st.session_state[k] = "スコア順 (高い順)"
         elif k == "selected_model_name":
             st.session_state[k] = "gemma-3-27b-it"
-        elif k in ["analyzed_data", "error_messages"]:
+        elif k == "analyzed_data":
+            st.session_state[k] = ResultTable()
+        elif k == "error_messages":
             st.session_state[k] = []
         elif k == "score_history":
             st.session_state[k] = {}
-        # TypeError回避のため、空文字ではなく None で初期化
-        elif k == "wait_start_time":
+        elif k == "job_id":
             st.session_state[k] = None
         # 数値項目は 0 で初期化
-        elif k in ["analysis_run_count", "analysis_index"]:
+        elif k in ["analysis_index", "job_total"]:
             st.session_state[k] = 0
         else:
             st.session_state[k] = (
@@ -221,7 +219,7 @@ for k in state_keys:
 # マニュアルURL定義 (278行目あたりの NameError 回避用)
 MANUAL_URL = "https://soutori296.stars.ne.jp/SoutoriWebShop/ai2_manual.html"
 
-MAX_TICKERS = 10
+JOB_POLL_INTERVAL = 2  # 分析ジョブの進捗を読みに行く間隔 (秒)
 
 # --- タイトル表示 ---
 st.markdown(
@@ -309,457 +307,67 @@ def clear_all_data_confirm():
 
 
 def reanalyze_all_data_logic():
-    all_tickers = [d["code"] for d in st.session_state.analyzed_data]
+    all_tickers = st.session_state.analyzed_data.codes
     st.session_state.tickers_input_value = "\n".join(all_tickers)
     st.session_state.analysis_index = 0
     st.session_state.ui_filter_score_on = False
     st.session_state.ui_filter_liquid_on = False
 
 
-def toggle_continuous_run():
-    if not st.session_state.get("run_continuously_checkbox_key", False):
-        st.session_state.is_running_continuous = False
-        st.session_state.wait_start_time = None
+INFO_CACHE_MAX_ENTRIES = 5000
 
 
-def fetch_with_retry(url, max_retry=3):
+@st.cache_data(
+    ttl=datetime.timedelta(days=4),
+    max_entries=INFO_CACHE_MAX_ENTRIES,
+    show_spinner=False,
+)
+def fetch_stock_info(code, phase_id):
     """
-    Pythonスペシャリスト仕様：
-    1. セッション維持によるクッキー管理
-    2. stooq.pl（ポーランド版）へのフォールバック
-    3. 接続前の「足踏み（トップページ訪問）」による偽装
+    株探の個別情報 (analysis.fetch_kabutan_info) をキャッシュ付きで取得する。
+    プロセス内で見つからなければ、phase_id ごとの共有キャッシュ (他のプロセスの取得分) を使う。
+    取得失敗時は例外を送出し、結果をキャッシュしない。
     """
-    session = requests.Session()
-
-    # 指紋を散らすためのUser-Agentリスト
-    user_agents = [
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
-        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
-    ]
-
-    headers = {
-        "User-Agent": random.choice(user_agents),
-        "Accept": "text/csv,application/csv,text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-        "Accept-Language": "ja,en-US;q=0.9,en;q=0.8",
-        "Connection": "keep-alive",
-        "DNT": "1",
-        "Upgrade-Insecure-Requests": "1",
-    }
-
-    # Stooqの場合、まず「ポーランド本国」のトップページを訪れてクッキーを取得（人間らしさ）
-    #    if "stooq" in url:
-    #        try:
-    #            target_base = "https://stooq.pl/"
-    #            session.get(target_base, headers=headers, timeout=10)
-    #            time.sleep(random.uniform(1.5, 3.0))  # ページを読んでるふり
-    #            headers["Referer"] = "https://stooq.pl/q/d/"
-    #        except Exception:
-    #            pass
-
-    if "stooq" in url:
-        headers["Referer"] = "https://stooq.pl/q/d/"
-
-    for attempt in range(max_retry):
-        try:
-            # 待機時間を「人間が操作する間隔」に設定
-            wait_time = (
-                random.uniform(10.0, 20.0) if attempt > 0 else random.uniform(5.0, 8.0)
-            )
-            time.sleep(wait_time)
-
-            res = session.get(url, headers=headers, timeout=20)
-
-            # 200 OK かつ CSVとして成立するサイズ（100バイト以上）があるか確認
-            if res.status_code == 200 and len(res.content) > 100:
-                return res
-
-            # もし0バイトや403なら、リトライ前にインターバルを置く
-            if attempt < max_retry - 1:
-                time.sleep(10)
-                continue
-
-            res.raise_for_status()
-            return res
-        except Exception:
-            if attempt == max_retry - 1:
-                raise
-            time.sleep(5)
-    raise Exception("Stooqサーバーがデータを返しませんでした（0バイト拒否）")
-
-
-@st.cache_data(ttl=1)
-def get_stock_info(code):
-    """株探から個別情報を取得 (月名問題・出来高正規表現・時価総額取得修正)"""
-    url = f"https://kabutan.jp/stock/?code={code}"
-    data = {
-        "name": "不明",
-        "per": "-",
-        "pbr": "-",
-        "price": None,
-        "volume": 0.0,
-        "cap": 0,
-        "open": None,
-        "high": None,
-        "low": None,
-        "close": None,
-        "issued_shares": 0.0,
-        "earnings_date": None,
-        "earnings_status": "",
-    }
-    try:
-        res = fetch_with_retry(url)
-        res.encoding = res.apparent_encoding
-        html = res.text.replace("\n", "").replace("\r", "")
-
-        m_name = re.search(r"<title>(.*?)【", html)
-        if m_name:
-            data["name"] = (
-                re.sub(r"[\(\（].*?[\)\）]", "", m_name.group(1).strip())
-                .replace("<br>", " ")
-                .strip()
-            )
-        m_price = re.search(r"(?:現在値|終値)</th>\s*<td[^>]*>([\d,.]+)</td>", html)
-        if m_price:
-            data["price"] = safe_float_convert(m_price.group(1))
-
-        # 出来高の正規表現をより柔軟に (spanタグ等に対応)
-        m_vol = re.search(
-            r"出来高</th>\s*<td[^>]*>(?:<span[^>]*>)?([\d,.]+)(?:</span>)?.*?株</td>",
-            html,
-        )
-        if m_vol:
-            data["volume"] = safe_float_convert(m_vol.group(1))
-
-        m_cap = re.search(r"時価総額.*?</th>\s*<td[^>]*>(.*?)</td>", html)
-        if m_cap:
-            cap_str = (
-                re.sub(r"<[^>]+>", "", m_cap.group(1))
-                .strip()
-                .replace("\n", "")
-                .replace("\r", "")
-            )
-            val = 0
-            if "兆" in cap_str:
-                parts = cap_str.split("兆")
-                # 小数点を含む数値に対応するため safe_float_convert を使用
-                trillion = safe_float_convert(parts[0])
-                billion = 0
-                if len(parts) > 1 and "億" in parts[1]:
-                    # "億" の前の数値部分を抽出（小数点も含む正規表現）
-                    b_match = re.search(r"([\d,.]+)", parts[1])
-                    if b_match:
-                        billion = safe_float_convert(b_match.group(1))
-                val = trillion * 10000 + billion
-            elif "億" in cap_str:
-                b_match = re.search(r"([\d,.]+)", cap_str)
-                if b_match:
-                    val = safe_float_convert(b_match.group(1))
-            data["cap"] = val
-
-        i3_match = re.search(r'<div id="stockinfo_i3">.*?<tbody>(.*?)</tbody>', html)
-        if i3_match:
-            tds = re.findall(r"<td.*?>(.*?)</td>", i3_match.group(1))
-
-            def clean_tag_and_br(s):
-                return re.sub(r"<[^>]+>", "", s).replace("<br>", "").strip()
-
-            if len(tds) >= 2:
-                data["per"] = clean_tag_and_br(tds[0])
-                data["pbr"] = clean_tag_and_br(tds[1])
-
-        # 月名(12月等)に依存しないように \d+月 に修正
-        ohlc_table_match = re.search(
-            r"<(?:h2|div)[^>]*>\s*\d+月\d+日.*?<table[^>]*>(.*?)</table>",
-            html,
-            re.DOTALL,
-        )
-        ohlc_content = ohlc_table_match.group(1) if ohlc_table_match else html
-        ohlc_map = {"始値": "open", "高値": "high", "安値": "low", "終値": "close"}
-        for key, val_key in ohlc_map.items():
-            m = re.search(
-                rf"<th[^>]*>{key}</th>\s*<td[^>]*>([\d,.]+)</td>", ohlc_content
-            )
-            if m:
-                data[val_key] = safe_float_convert(m.group(1))
-
-        m_issued = re.search(r"発行済株式数.*?<td>([\d,.]+).*?株</td>", html)
-        if m_issued:
-            data["issued_shares"] = safe_float_convert(m_issued.group(1))
-        m_earn_plan = re.search(r"決算発表予定日.*?(\d{4})/(\d{1,2})/(\d{1,2})", html)
-        if m_earn_plan:
-            data["earnings_date"] = datetime.datetime(
-                int(m_earn_plan.group(1)),
-                int(m_earn_plan.group(2)),
-                int(m_earn_plan.group(3)),
-            )
-            data["earnings_status"] = "upcoming"
-        else:
-            m_earn_done = re.search(r"決算.*?(\d{4})/(\d{1,2})/(\d{1,2}).*?発表", html)
-            if m_earn_done:
-                data["earnings_date"] = datetime.datetime(
-                    int(m_earn_done.group(1)),
-                    int(m_earn_done.group(2)),
-                    int(m_earn_done.group(3)),
-                )
-                data["earnings_status"] = "done"
-        return data
-    except Exception as e:
-        st.session_state.error_messages.append(f"データ取得エラー ({code}): {e}")
-        return data
-
-
-@st.cache_data(ttl=300, show_spinner="市場25日騰落レシオを取得中...")
-def get_25day_ratio():
-    url = "https://nikkeiyosoku.com/up_down_ratio/"
-    try:
-        res = fetch_with_retry(url)
-        res.encoding = res.apparent_encoding
-        m_ratio = re.search(
-            r'<p class="stock-txt">([0-9\.]+)', res.text.replace("\n", "")
-        )
-        return float(m_ratio.group(1).strip()) if m_ratio else 100.0
-    except Exception:
-        return 100.0
+    return fetch_kabutan_info(code, phase_id)
 
 
-# ここで一度だけ実行して変数に格納
-market_25d_ratio = get_25day_ratio()
+@st.cache_resource
+def get_info_cache_state():
+    """プロセス内で共有する、個別情報キャッシュの直近フェーズ"""
+    return {"phase": None, "lock": threading.Lock()}
 
 
-def get_kabutan_recent_history(code):
-    """株探の時系列テーブル(th/td混在型)からデータを確実に抽出する"""
-    url = f"https://kabutan.jp/stock/kabuka?code={code}&ashi=day"
-    try:
-        res = fetch_with_retry(url)
-        res.encoding = res.apparent_encoding
-        try:
-            from bs4 import BeautifulSoup
-        except ImportError:
-            return pd.DataFrame()
-
-        soup = BeautifulSoup(res.text, "html.parser")
-        # ユーザー提示のクラス名 'stock_kabuka_dwm' でテーブルを特定
-        table = soup.find("table", {"class": "stock_kabuka_dwm"})
-        if not table:
-            return pd.DataFrame()
-
-        rows = (
-            table.find("tbody").find_all("tr")
-            if table.find("tbody")
-            else table.find_all("tr")
-        )
-        history_data = []
-
-        for row in rows:
-            # 日付は <th>、数値は <td> に分かれている構造に対応
-            date_cell = row.find("th")
-            cols = row.find_all("td")
-
-            if not date_cell or len(cols) < 7:
-                continue
-
-            d_str = date_cell.get_text(strip=True)
-            if "/" not in d_str:
-                continue
-
-            try:
-                # 26/02/27 -> 2026-02-27 形式に変換
-                parts = d_str.split("/")
-                year = "20" + parts[0] if len(parts[0]) == 2 else parts[0]
-                date_val = pd.to_datetime(f"{year}-{parts[1]}-{parts[2]}")
-
-                # 数値変換 (カンマ、空文字、ハイフンを除去)
-                def p(s):
-                    v = s.get_text(strip=True).replace(",", "").replace("－", "0")
-                    return float(v) if v and v != "0" else 0.0
-
-                # 取得順: 始値(0), 高値(1), 安値(2), 終値(3), 売買高(6)
-                history_data.append(
-                    [
-                        date_val,
-                        p(cols[0]),
-                        p(cols[1]),
-                        p(cols[2]),
-                        p(cols[3]),
-                        p(cols[6]),
-                    ]
-                )
-            except Exception:
-                continue
-
-        df_new = pd.DataFrame(
-            history_data, columns=["Date", "Open", "High", "Low", "Close", "Volume"]
-        )
-        return df_new.set_index("Date").sort_index()
-    except Exception:
-        return pd.DataFrame()
-
-
-def get_kabutan_earnings_date(code):
+def get_stock_info(code, on_error):
     """
-    株探の時系列ページから決算日を抽出。
-    「発表予定日」と、発表後の「実績日（New!表示など）」の両方に対応。
+    株探の個別情報を市場フェーズに応じてキャッシュしつつ取得する。
+    休日・場前・引け後は次のフェーズまで再取得せず、場中は INTRADAY_INFO_TTL 秒ごとに更新。
+    フェーズが切り替わった時点でキャッシュ全体を破棄する。取得エラーは on_error に渡す。
     """
-    url = f"https://kabutan.jp/stock/kabuka?code={code}&ashi=day"
+    phase_id = market_phase_id()
+    state = get_info_cache_state()
+    with state["lock"]:
+        if state["phase"] != phase_id[0]:
+            if state["phase"] is not None:
+                fetch_stock_info.clear()
+            state["phase"] = phase_id[0]
     try:
-        res = fetch_with_retry(url)
-        res.encoding = res.apparent_encoding
-        html_text = res.text.replace("\n", "").replace("\r", "")
-
-        # 1. 予定日パターン (例: 決算発表予定日 2026/04/10)
-        m_plan = re.search(r"決算発表予定日.*?(\d{4})/(\d{1,2})/(\d{1,2})", html_text)
-        if m_plan:
-            return datetime.datetime(
-                int(m_plan.group(1)), int(m_plan.group(2)), int(m_plan.group(3))
-            )
-
-        # 2. 発表済パターン (例: 決算New! 2026/04/01 発表)
-        # 「決算」と「発表」の間にある日付を抜き出します
-        m_done = re.search(r"決算.*?(\d{4})/(\d{1,2})/(\d{1,2}).*?発表", html_text)
-        if m_done:
-            return datetime.datetime(
-                int(m_done.group(1)), int(m_done.group(2)), int(m_done.group(3))
-            )
-
-        return None
-    except Exception:
-        return None
-
-
-# --- テクニカル指標ロジック (RCI/Divergence) ---
-def calculate_rci(series, period=26):
-    """
-    RCI(26)を計算する関数
-    株探の中期線(26)に準拠した仕様です。
-    """
-    # データを古い順に並べ替え
-    series = series.sort_index(ascending=True)
-
-    if len(series) < period:
-        return 0
-
-    # 直近の期間分を切り出す
-    window = series.tail(period)
+        return fetch_stock_info(code, phase_id)
+    except Exception as e:
+        on_error(f"データ取得エラー ({code}): {e}")
+        return default_stock_info()
 
-    # 日付の順位（1, 2, ..., 26）
-    date_ranks = np.arange(1, period + 1)
 
-    # 価格の順位（低い=1, 高い=26）※同値は平均順位
-    price_ranks = window.rank(method="average").values
+MARKET_RATIO_TTL = 300  # 25日騰落レシオの更新間隔 (秒)
 
-    # RCI公式
-    d = date_ranks - price_ranks
-    d2_sum = np.sum(d**2)
-    rci = (1 - (6 * d2_sum) / (period * (period**2 - 1))) * 100
 
-    return rci
+@st.cache_resource
+def get_25day_ratio_source():
+    """全セッション共有。期限切れ時は裏で更新し、その間は直近の値を返す"""
+    return StaleWhileRevalidate(fetch_25day_ratio, ttl=MARKET_RATIO_TTL)
 
 
-def calculate_rsi(series, period=14):
-    """
-    RSI(14)を計算する関数（列を返す修正版）
-    """
-    series = series.sort_index(ascending=True)
-    if len(series) <= period:
-        return pd.Series(50, index=series.index)  # データ不足時は50で埋めた列を返す
-
-    delta = series.diff()
-    gain = delta.where(delta > 0, 0).rolling(window=period).mean()
-    loss = -delta.where(delta < 0, 0).rolling(window=period).mean()
-
-    # ゼロ除算を避けて計算
-    rs = gain / loss
-    rsi = 100 - (100 / (1 + rs))
-
-    return rsi.fillna(50)  # 計算できない初期期間を50で埋める
-
-
-def check_bullish_divergence(df):
-    if len(df) < 30:
-        return False
-    recent_slice = df.iloc[-8:]
-    if recent_slice.empty:
-        return False
-    min_price_idx_recent = recent_slice["Low"].idxmin()
-    min_price_recent = recent_slice.loc[min_price_idx_recent, "Low"]
-    rsi_recent = df.loc[min_price_idx_recent, "RSI"]
-    past_slice = df.iloc[-40:-8]
-    if past_slice.empty:
-        return False
-    min_price_idx_past = past_slice["Low"].idxmin()
-    min_price_past = past_slice.loc[min_price_idx_past, "Low"]
-    rsi_past = df.loc[min_price_idx_past, "RSI"]
-    return (
-        min_price_recent < min_price_past * 0.99
-        and rsi_recent > rsi_past + 5
-        and rsi_past < 40
-    )
-
-
-# --- 出来高調整ウェイト ---
-WEIGHT_MODELS = {
-    "large": {
-        (9 * 60): 0.00,
-        (9 * 60 + 30): 0.25,
-        (10 * 60): 0.30,
-        (11 * 60 + 30): 0.50,
-        (12 * 60 + 30): 0.525,
-        (13 * 60): 0.60,
-        (15 * 60): 0.70,
-        (15 * 60 + 25): 0.85,
-        (15 * 60 + 30): 1.00,
-    },
-    "mid": {
-        (9 * 60): 0.00,
-        (9 * 60 + 30): 0.30,
-        (10 * 60): 0.35,
-        (11 * 60 + 30): 0.55,
-        (12 * 60 + 30): 0.575,
-        (13 * 60): 0.675,
-        (15 * 60): 0.75,
-        (15 * 60 + 25): 0.90,
-        (15 * 60 + 30): 1.00,
-    },
-    "small": {
-        (9 * 60): 0.00,
-        (9 * 60 + 30): 0.40,
-        (10 * 60): 0.45,
-        (11 * 60 + 30): 0.65,
-        (12 * 60 + 30): 0.675,
-        (13 * 60): 0.75,
-        (15 * 60): 0.88,
-        (15 * 60 + 25): 0.95,
-        (15 * 60 + 30): 1.00,
-    },
-}
-
-
-def get_volume_weight(current_dt, market_cap):
-    status, _ = get_market_status()
-    if "休日" in status or "引け後" in status or current_dt.hour < 9:
-        return 1.0
-    current_minutes = current_dt.hour * 60 + current_dt.minute
-    if current_minutes > (15 * 60):
-        return 1.0
-    if current_minutes < (9 * 60):
-        return 0.01
-    if market_cap >= 5000:
-        weights = WEIGHT_MODELS["large"]
-    elif market_cap >= 500:
-        weights = WEIGHT_MODELS["mid"]
-    else:
-        weights = WEIGHT_MODELS["small"]
-    last_weight = 0.0
-    last_minutes = 9 * 60
-    for end_minutes, weight in weights.items():
-        if current_minutes <= end_minutes:
-            if end_minutes == last_minutes:
-                return weight
-            progress = (current_minutes - last_minutes) / (end_minutes - last_minutes)
-            return max(0.01, last_weight + progress * (weight - last_weight))
-        last_weight = weight
-        last_minutes = end_minutes
-    return 1.0
+# 画面描画を待たせないよう、取得済みの値をそのまま使う (初回の取得が終わるまでは None)
+market_25d_ratio, market_25d_ratio_at = get_25day_ratio_source().get()
 
 
 def format_volume(volume):
@@ -775,44 +383,6 @@ def format_volume(volume):
         return f"{round(volume / 10000):,.0f}万株"
 
 
-def get_market_cap_category(market_cap):
-    if market_cap >= 10000:
-        return "超大型"
-    elif market_cap >= 3000:
-        return "大型"
-    elif market_cap >= 500:
-        return "中型"
-    elif market_cap >= 100:
-        return "小型"
-    else:
-        return "超小型"
-
-
-def get_target_pct_new(category, is_half):
-    if is_half:
-        if category == "超大型":
-            return 0.015
-        elif category == "大型":
-            return 0.020
-        elif category == "中型":
-            return 0.025
-        elif category == "小型":
-            return 0.030
-        else:
-            return 0.040
-    else:
-        if category == "超大型":
-            return 0.025
-        elif category == "大型":
-            return 0.035
-        elif category == "中型":
-            return 0.040
-        elif category == "小型":
-            return 0.050
-        else:
-            return 0.070
-
-
 def fmt_market_cap(val):
     if not val or val == 0:
         return "-"
@@ -831,15 +401,6 @@ def fmt_market_cap(val):
         return "-"
 
 
-def safe_float_convert(s):
-    try:
-        if isinstance(s, (int, float)):
-            return float(s)
-        return float(s.replace(",", ""))
-    except ValueError:
-        return 0.0
-
-
 def clean_html_tags(text):
     if pd.isna(text) or not isinstance(text, str):
         return text
@@ -856,854 +417,36 @@ def remove_emojis_and_special_chars(text):
     return emoji_pattern.sub(r"", text)
 
 
-def create_signals_pro_bull(df, info, vol_ratio_in):
-    last = df.iloc[-1]
-    prev = df.iloc[-2] if len(df) >= 2 else last
-    category = get_market_cap_category(info.get("cap", 0))
-    ma5 = last.get("SMA5", 0)
-    close = last.get("Close", 0)
-    open_price = last.get("Open", 0)
-    high = last.get("High", 0)
-    low = last.get("Low", 0)
-    prev_close = prev.get("Close", 0)
-    rsi = last.get("RSI", 50)
-    vol_ratio = vol_ratio_in
-    vol_sma3 = df["Volume"].rolling(3).mean().iloc[-1] if len(df) >= 3 else 0
-    vol_sma5 = df["Volume"].rolling(5).mean().iloc[-1] if len(df) >= 5 else 0
-    if (
-        ma5 == 0
-        or close == 0
-        or open_price == 0
-        or high == 0
-        or low == 0
-        or prev_close == 0
-    ):
-        return {
-            "strategy": "様子見",
-            "buy": 0,
-            "p_half": 0,
-            "p_full": 0,
-            "sl_ma": 0,
-            "signal_success": False,
-        }
-    if close < ma5 or (close < prev_close and vol_ratio >= 1.5):
-        return {
-            "strategy": "様子見",
-            "buy": 0,
-            "p_half": 0,
-            "p_full": 0,
-            "sl_ma": 0,
-            "signal_success": False,
-        }
-    is_gap_up = open_price > prev_close * 1.01
-    if (
-        is_gap_up
-        or high >= ma5 * 1.01
-        or close > ma5 * 1.01
-        or close < prev_close * 0.995
-    ):
-        return {
-            "strategy": "様子見",
-            "buy": 0,
-            "p_half": 0,
-            "p_full": 0,
-            "sl_ma": 0,
-            "signal_success": False,
-        }
-    is_touching_or_close = abs((close - ma5) / ma5) <= 0.005
-    is_reversal_shape = False
-    is_positive_candle = close > open_price
-    body = abs(close - open_price)
-    if (
-        is_positive_candle
-        or (body > 0 and (min(close, open_price) - low) / body >= 0.3)
-        or (body == 0 and (min(close, open_price) - low) > 0)
-    ):
-        is_reversal_shape = True
-    required_vol_ratio = (
-        1.7 if category in ["小型", "超小型"] else (1.5 if category == "中型" else 1.3)
-    )
-    is_volume_spike = vol_ratio >= required_vol_ratio
-    is_volume_quality_ok = (vol_sma5 > 0) and (vol_sma3 >= vol_sma5 * 1.05)
-    if not is_volume_quality_ok:
-        return {
-            "strategy": "様子見",
-            "buy": 0,
-            "p_half": 0,
-            "p_full": 0,
-            "sl_ma": 0,
-            "signal_success": False,
-        }
-    is_momentum_ok = (30 <= rsi <= 60) and ((close / ma5 - 1) * 100) <= 0.5
-    is_entry_signal = (
-        is_touching_or_close
-        and is_reversal_shape
-        and is_volume_spike
-        and is_momentum_ok
-    )
-    if not is_entry_signal:
-        return {
-            "strategy": "様子見",
-            "signal_success": False,
-            "buy": 0,
-            "p_half": 0,
-            "p_full": 0,
-            "sl_ma": 0,
-        }
-    entry_price = close
-    stop_price = entry_price * (1 - 0.03)
-    half_pct = get_target_pct_new(category, is_half=True)
-    full_pct = get_target_pct_new(category, is_half=False)
-    p_half = int(np.floor(entry_price * (1 + half_pct)))
-    p_full = int(np.floor(entry_price * (1 + full_pct)))
-    return {
-        "strategy": "🚀順ロジ",
-        "buy": int(np.floor(entry_price)),
-        "p_half": p_half,
-        "p_full": p_full,
-        "sl_ma": int(np.floor(stop_price)),
-        "signal_success": True,
-    }
+LONG_JOB_SECONDS = 600  # 見込み時間がこれを超える分析は長時間ジョブの枠で実行する
 
 
-def create_signals_pro_bear(df, info, vol_ratio_in):
-    last = df.iloc[-1]
-    prev = df.iloc[-2] if len(df) >= 2 else last
-    open_price = last.get("Open", 0)
-    close = last.get("Close", 0)
-    high = last.get("High", 0)
-    low = last.get("Low", 0)
-    rsi = last.get("RSI", 50)
-    ma5 = last.get("SMA5", 0)
-    ma25 = last.get("SMA25", 0)
-    vol_ratio = vol_ratio_in
-    prev_close = prev.get("Close", 0)
-    vol_sma3 = df["Volume"].rolling(3).mean().iloc[-1] if len(df) >= 3 else 0
-    vol_sma5 = df["Volume"].rolling(5).mean().iloc[-1] if len(df) >= 5 else 0
-    if ma5 == 0 or ma25 == 0 or close == 0 or open_price == 0 or high == 0 or low == 0:
-        return {
-            "strategy": "様子見",
-            "buy": 0,
-            "p_half": 0,
-            "p_full": 0,
-            "sl_ma": 0,
-            "signal_success": False,
-        }
-    is_gap_down = open_price < prev_close * 0.99
-    if is_gap_down:
-        return {
-            "strategy": "様子見",
-            "signal_success": False,
-            "buy": 0,
-            "p_half": 0,
-            "p_full": 0,
-            "sl_ma": 0,
-        }
-    is_low_rsi = rsi <= 30
-    is_large_gap = close < ma25 * 0.9
-    if not is_low_rsi and not is_large_gap:
-        return {
-            "strategy": "様子見",
-            "signal_success": False,
-            "buy": 0,
-            "p_half": 0,
-            "p_full": 0,
-            "sl_ma": 0,
-        }
-    is_reversal_shape = False
-    body = abs(close - open_price)
-    if close > open_price or (
-        body > 0 and (min(close, open_price) - low) / body >= 0.3
-    ):
-        is_reversal_shape = True
-    if not is_reversal_shape:
-        return {
-            "strategy": "様子見",
-            "signal_success": False,
-            "buy": 0,
-            "p_half": 0,
-            "p_full": 0,
-            "sl_ma": 0,
-        }
-    is_volume_spike = vol_ratio >= 1.3
-    is_volume_quality_ok = (vol_sma5 > 0) and (vol_sma3 >= vol_sma5 * 1.05)
-    if not is_volume_spike or not is_volume_quality_ok:
-        return {
-            "strategy": "様子見",
-            "signal_success": False,
-            "buy": 0,
-            "p_half": 0,
-            "p_full": 0,
-            "sl_ma": 0,
-        }
-    if close >= ma5:
-        return {
-            "strategy": "様子見",
-            "signal_success": False,
-            "buy": 0,
-            "p_half": 0,
-            "p_full": 0,
-            "sl_ma": 0,
-        }
-    entry_price = close
-    stop_price = entry_price * (1 - 0.03)
-    p_half = int(np.floor(ma5 - 1)) if ma5 else 0
-    p_full = int(np.floor(ma25 - 1)) if ma25 else 0
-    return {
-        "strategy": "🚀逆ロジ",
-        "buy": int(np.floor(entry_price)),
-        "p_half": p_half,
-        "p_full": p_full,
-        "sl_ma": int(np.floor(stop_price)),
-        "signal_success": True,
-    }
+@st.cache_resource
+def get_job_runner():
+    """全セッション共有の分析ジョブ実行スレッド (ジョブはセッションごとに job_id で追う)"""
+    return JobRunner()
 
 
-def evaluate_strategy_new(
-    df,
-    info,
-    vol_ratio,
-    high_250d,
-    atr_val,
-    curr_price,
-    ma5,
-    ma25,
-    ma75,
-    prev_ma5,
-    rsi_val,
-    atr_sl_price,
-    is_div,
-    is_rci_rev,
-):
-    signals_bull = create_signals_pro_bull(df, info, vol_ratio)
-    signals_bear = create_signals_pro_bear(df, info, vol_ratio)
-    strategy, buy_target, p_half, p_full, sl_ma, is_aoteng = (
-        "様子見",
-        int(ma5) if ma5 > 0 else 0,
-        0,
-        0,
-        atr_sl_price,
-        False,
-    )
-
-    if signals_bull["signal_success"] and signals_bull["strategy"] == "🚀順ロジ":
-        signals = signals_bull
-        strategy, buy_target, p_half, p_full, sl_ma, is_aoteng = (
-            signals["strategy"],
-            signals["buy"],
-            signals["p_half"],
-            signals["p_full"],
-            signals["sl_ma"],
-            False,
-        )
-    elif signals_bear["signal_success"] and signals_bear["strategy"] == "🚀逆ロジ":
-        signals = signals_bear
-        strategy, buy_target, p_half, p_full, sl_ma, is_aoteng = (
-            signals["strategy"],
-            signals["buy"],
-            signals["p_half"],
-            signals["p_full"],
-            signals["sl_ma"],
-            False,
-        )
-    else:
-        sl_ma = atr_sl_price
-        # 順張り判定
-        if ma5 > ma25 > ma75 and curr_price > ma75:
-            strategy, buy_target = "🔥順張り", int(ma5)
-            category_str = get_market_cap_category(info["cap"])
-            half_pct = get_target_pct_new(category_str, is_half=True)
-            full_pct = get_target_pct_new(category_str, is_half=False)
-            p_half_candidate = int(np.floor(buy_target * (1 + half_pct)))
-            p_full_candidate = int(np.floor(buy_target * (1 + full_pct)))
-            is_ath = high_250d > 0 and curr_price > high_250d
-            is_rsi_ok = rsi_val < 80
-            is_volume_ok = vol_ratio >= 1.5
-            if is_ath and is_rsi_ok and is_volume_ok:
-                is_aoteng = True
-                max_high_today = df["High"].iloc[-1]
-                atr_trailing_price = max(0, max_high_today - (atr_val * 2.5))
-                p_full = int(np.floor(atr_trailing_price))
-                p_half = 0
-                sl_ma = p_full
-            else:
-                p_half = p_half_candidate
-                p_full = p_full_candidate
-
-        # 逆張り(底打ち)判定強化
-        elif (rsi_val <= 30) or (is_div) or (is_rci_rev and rsi_val <= 45):
-            strategy, buy_target = "💎底打反転", int(curr_price)
-            p_half_candidate = int(np.floor(ma5 - 1)) if ma5 else 0
-            p_full_candidate = int(np.floor(ma25 - 1)) if ma25 else 0
-            p_half = p_half_candidate
-            p_full = p_full_candidate
-        elif curr_price < ma25 * 0.9 if ma25 else False:
-            strategy, buy_target = "🌊逆張り", int(curr_price)
-            p_half_candidate = int(np.floor(ma5 - 1)) if ma5 else 0
-            p_full_candidate = int(np.floor(ma25 - 1)) if ma25 else 0
-            p_half = p_half_candidate
-            p_full = p_full_candidate
-
-    sl_pct = ((curr_price / sl_ma) - 1) * 100 if curr_price > 0 and sl_ma > 0 else 0.0
-    return strategy, buy_target, p_half, p_full, sl_ma, is_aoteng, sl_pct
-
-
-def calculate_score_and_logic(df, info, vol_ratio, status, market_ratio=100.0):
-    if len(df) < 80:
-        return (
-            50,
-            {},
-            "様子見",
-            0,
-            0,
-            0,
-            0,
-            False,
-            0,
-            50,
-            0,
-            "通常レンジ",
-            "0%",
-            0,
-            0,
-            0,
-        )
-
-    df = df.copy()
-    df["SMA5"] = df["Close"].rolling(5).mean()
-    df["SMA25"] = df["Close"].rolling(25).mean()
-    df["SMA75"] = df["Close"].rolling(75).mean()
-    df["Vol_SMA5"] = df["Volume"].rolling(5).mean()
-
-    # --- 指標計算（最新修正版：RSIを列として保持） ---
-    # 1. RSIを列として算出し、データフレームに格納（ダイバージェンス判定用）
-    df["RSI"] = calculate_rsi(df["Close"], period=14)
-
-    # 2. 各判定で使う「最新の数値」を抽出
-    rsi_val = df["RSI"].iloc[-1]
-    rci_val = calculate_rci(df["Close"], period=26)  # 株探準拠の26日
-
-    last = df.iloc[-1]
-    prev = df.iloc[-2]
-    curr_price = round(float(last["Close"]), 1)
-    ma5, ma25, ma75 = last["SMA5"], last["SMA25"], last["SMA75"]
-
-    # 3. 前日RCI（好転判定用）を算出
-    prev_rci = calculate_rci(df["Close"].iloc[:-1], period=26)
-
-    atr_smoothed = df["Close"].rolling(14).std().iloc[-1]
-    vol_sma5_val = last["Vol_SMA5"]
-
-    # モメンタム（直近5日の陽線確率）
-    recent = df["Close"].diff().tail(5)
-    up_days = int((recent > 0).sum())
-    momentum_str = f"{(up_days / 5) * 100:.0f}%"
-
-    # --- 1. 鉄の掟 (Gatekeeper) 強制除外判定 ---
-    is_trend_dead = curr_price < ma75
-    is_supply_dead = (curr_price < prev["Close"]) and (vol_ratio >= 1.5)
-    is_short_trend_dead = curr_price < ma5 * 0.98
-    is_illiquid = vol_sma5_val < 1000
-
-    if is_trend_dead or is_supply_dead or is_short_trend_dead or is_illiquid:
-        reasons = []
-        if is_trend_dead:
-            reasons.append("長期トレンド崩壊")
-        if is_supply_dead:
-            reasons.append("需給悪化")
-        if is_short_trend_dead:
-            reasons.append("短期トレンド喪失")
-        if is_illiquid:
-            reasons.append("流動性欠如")
-
-        return (
-            0,
-            {"鉄の掟（除外）": -50},
-            "⛔対象外",
-            0,
-            0,
-            0,
-            0,
-            False,
-            0,
-            rsi_val,
-            atr_smoothed,
-            " | ".join(reasons),
-            momentum_str,
-            rci_val,
-            0,
-            0,
-        )
-
-    # --- 2. ダイバージェンス & RCI好転 & 青天井 判定 ---
-    # ここで df["RSI"] を参照するため、列として存在している必要があります
-    is_divergence = check_bullish_divergence(df)
-    is_rci_reversal = (prev_rci < -80 and rci_val > prev_rci and rci_val > -80) or (
-        prev_rci < -70 and rci_val > prev_rci + 10
-    )
-
-    high_250d = df["High"].iloc[:-1].tail(250).max()
-    is_ath = high_250d > 0 and curr_price > high_250d
-    is_aoteng = is_ath and rsi_val < 80 and vol_ratio >= 1.5
-
-    # --- 3. フラグ判定 ---
-    try:
-        df_w = df.resample("W-FRI").agg({"Close": "last"})
-        if len(df_w) >= 13:
-            ma13_w = df_w["Close"].rolling(13).mean().iloc[-1]
-            is_weekly_up = df_w["Close"].iloc[-1] >= ma13_w
-    except Exception:
-        is_weekly_up = True
-
-    if len(df) >= 120:
-        bb_mid = df["Close"].rolling(20).mean()
-        bb_width = (4 * df["Close"].rolling(20).std()) / bb_mid
-        is_squeeze = bb_width.iloc[-1] <= bb_width.rolling(120).min().iloc[-1] * 1.1
-    else:
-        is_squeeze = False
-
-    lookback_75_high = df["High"].iloc[:-1].tail(75).max()
-    is_breakout = curr_price > lookback_75_high
-
-    # 最大含損率(MDD)と急落判定
-    dd_75 = df.tail(75).copy()
-    max_1d_drop = dd_75["Close"].pct_change(1).min()
-    max_3d_drop = dd_75["Close"].pct_change(3).min()
-    is_large = info.get("cap", 0) >= 3000
-    is_plunge = (is_large and (max_1d_drop <= -0.04 or max_3d_drop <= -0.08)) or (
-        not is_large and (max_1d_drop <= -0.07 or max_3d_drop <= -0.12)
-    )
-    dd_75["Peak"] = dd_75["Close"].cummax()
-    dd_abs_val = ((dd_75["Close"] / dd_75["Peak"]) - 1).min() * 100
-
-    # --- 4. 戦略評価呼び出し ---
-    strategy, buy_target, p_half, p_full, sl_ma, _, sl_pct = evaluate_strategy_new(
-        df,
-        info,
-        vol_ratio,
-        high_250d,
-        atr_smoothed,
-        curr_price,
-        ma5,
-        ma25,
-        ma75,
-        ma5,
-        rsi_val,
-        curr_price * 0.95,
-        is_divergence,
-        is_rci_reversal,
-    )
-
-    oshime_price = 0
-    if is_breakout:
-        strategy = "🚀ブレイク"
-        oshime_price = round(max(lookback_75_high, ma5), 1)
-        buy_target = curr_price
-        atr_sl_calc = round(curr_price - max(atr_smoothed * 1.5, curr_price * 0.01), 1)
-
-        if is_aoteng:
-            max_high_today = df["High"].iloc[-1]
-            sl_ma = round(max(0, max_high_today - (atr_smoothed * 2.5)), 1)
-            p_full = sl_ma
-            p_half = 0
-        else:
-            p_half = round(buy_target * 1.05, 1)
-            p_full = round(buy_target * 1.10, 1)
-            sl_ma = round(max(atr_sl_calc, buy_target * 0.96), 1)
-        sl_pct = ((curr_price / sl_ma) - 1) * 100 if sl_ma > 0 else 0.0
-
-    # --- 5. スコアリング ---
-    score = 50
-    factors = {"基礎点": 50}
-    trend_sum = 0
-
-    if is_weekly_up:
-        factors["週足上昇"] = 5
-        trend_sum += 5
-    else:
-        score -= 20
-        factors["週足下落"] = -20
-
-    if is_breakout:
-        factors["新高値ブレイク"] = 15
-        trend_sum += 15
-
-    if is_squeeze:
-        factors["スクイーズ"] = 10
-        trend_sum += 10
-
-    if "🚀" in strategy:
-        factors["戦略優位性"] = 15
-        trend_sum += 15
-
-    if is_divergence:
-        factors["RSIダイバー"] = 15
-        trend_sum += 15
-
-    if is_rci_reversal:
-        factors["RCI好転"] = 10
-        trend_sum += 10
-
-    if is_aoteng:
-        factors["青天井"] = 15
-        trend_sum += 15
-
-    score += trend_sum
-
-    if market_ratio >= 125.0:
-        score -= 10
-        factors["市場過熱"] = -10
-
-    # R/R比判定
-    if is_breakout and oshime_price > 0 and not is_aoteng:
-        risk = oshime_price - sl_ma
-        target_avg = (p_half + p_full) / 2 if p_half > 0 else p_full
-        reward = target_avg - oshime_price
-        if risk > 0 and reward > 0:
-            rr_ratio = reward / risk
-            if rr_ratio >= 2.0:
-                factors["高R/R比"] = 20
-                score += 20
-            elif rr_ratio < 0.8:
-                factors["低R/R比"] = -25
-                score -= 25
-
-    if dd_abs_val > -1.0:
-        factors["低含損率"] = 5
-        score += 5
-    elif dd_abs_val < -15.0 or is_plunge:
-        factors["高含損リスク"] = -15
-        score -= 15
-
-    if 55 <= rsi_val <= 65:
-        score += 5
-        factors["RSI適正"] = 5
-
-    cat = get_market_cap_category(info.get("cap", 0))
-    rsi_penalty_threshold = 80 if cat in ["超大型", "大型"] else 70
-    if rsi_val >= rsi_penalty_threshold and not is_aoteng:
-        score -= 15
-        factors["RSIペナルティ"] = -15
-
-    if vol_ratio > 1.5:
-        score += 10
-        factors["出来高急増"] = 10
-
-    if up_days >= 4:
-        score += 5
-        factors["直近勢い"] = 5
-
-    return (
-        score,
-        factors,
-        strategy,
-        buy_target,
-        p_half,
-        p_full,
-        sl_ma,
-        is_aoteng,
-        sl_pct,
-        rsi_val,
-        atr_smoothed,
-        "通常レンジ",
-        momentum_str,
-        rci_val,
-        oshime_price,
-        dd_abs_val,
-    )
-
-
-def run_backtest_precise(df, market_cap):
-    try:
-        if len(df) < 80:
-            return "データ不足", 0.0, 0, 0.0, 0.0, 0, 0
-        category = get_market_cap_category(market_cap)
-        target_pct = get_target_pct_new(category, is_half=False)
-        wins, losses, max_dd_pct = 0, 0, 0.0
-        test_data = df.tail(75).copy()
-        n = len(test_data)
-        test_data["SMA5"] = test_data["Close"].rolling(5).mean()
-        test_data["SMA25"] = test_data["Close"].rolling(25).mean()
-        test_data["High_250d"] = test_data["High"].rolling(250, min_periods=1).max()
-        test_data["PrevClose"] = test_data["Close"].shift(1)
-        test_data["High_Low"] = test_data["High"] - test_data["Low"]
-        test_data["High_PrevClose"] = abs(test_data["High"] - test_data["PrevClose"])
-        test_data["Low_PrevClose"] = abs(test_data["Low"] - test_data["PrevClose"])
-        test_data["TR"] = test_data[
-            ["High_Low", "High_PrevClose", "Low_PrevClose"]
-        ].max(axis=1)
-        test_data["ATR"] = test_data["TR"].rolling(14).mean()
-        test_data["Vol_SMA5"] = test_data["Volume"].rolling(5).mean()
-
-        i = 1
-        while i < n - 10:
-            prev_row = test_data.iloc[i - 1]
-            curr_row = test_data.iloc[i]
-            prev_low, prev_close, prev_sma5, prev_sma25 = (
-                prev_row.get("Low", 0),
-                prev_row.get("Close", 0),
-                prev_row.get("SMA5", 0),
-                prev_row.get("SMA25", 0),
-            )
-            if (
-                pd.isna(prev_low)
-                or pd.isna(prev_sma5)
-                or pd.isna(prev_sma25)
-                or prev_sma5 == 0
-                or prev_sma25 == 0
-            ):
-                i += 1
-                continue
-            is_prev_bull_trend = prev_sma5 > prev_sma25
-            is_prev_ma5_touch = prev_low <= prev_sma5 * 1.005
-            open_price, close_price, high_price = (
-                curr_row.get("Open", 0),
-                curr_row.get("Close", 0),
-                curr_row.get("High", 0),
-            )
-            is_gap_down = open_price < prev_close * 0.99
-            is_ma5_signal = False
-            if is_prev_bull_trend and is_prev_ma5_touch and not is_gap_down:
-                if close_price > open_price or high_price >= prev_row.get("High", 0):
-                    is_ma5_signal = True
-            is_aoteng_signal = False
-            is_ath = (
-                curr_row.get("High", 0) >= curr_row.get("High_250d", 0)
-                and curr_row.get("High_250d", 0) > 0
-            )
-            curr_vol_sma5 = curr_row.get("Vol_SMA5", 0)
-            if is_ath and curr_row.get("Volume", 0) >= curr_vol_sma5 * 1.5:
-                is_aoteng_signal = True
-            if is_ma5_signal or is_aoteng_signal:
-                entry_price = (
-                    prev_sma5 if is_ma5_signal and not is_aoteng_signal else close_price
-                )
-                if entry_price == 0:
-                    i += 1
-                    continue
-                if is_aoteng_signal:
-                    target_price = entry_price * 1.5
-                    tsl_price = entry_price - (curr_row.get("ATR", 0) * 2.5)
-                else:
-                    target_price = entry_price * (1 + target_pct)
-                    tsl_price = entry_price * 0.97
-                is_win, hold_days, trade_min_low = False, 0, entry_price
-                for j in range(1, 11):
-                    if i + j >= n:
-                        break
-                    future = test_data.iloc[i + j]
-                    future_high, future_low = (
-                        future.get("High", 0),
-                        future.get("Low", 0),
-                    )
-                    hold_days = j
-                    if future_low is not None and not pd.isna(future_low):
-                        trade_min_low = min(trade_min_low, future_low)
-                    if future_high >= target_price and not is_aoteng_signal:
-                        is_win = True
-                        break
-                    sl_level = tsl_price
-                    if future_low <= sl_level:
-                        break
-                if is_aoteng_signal and hold_days == 10 and trade_min_low > sl_level:
-                    is_win = True
-                if is_win:
-                    wins += 1
-                else:
-                    losses += 1
-                if entry_price > 0 and trade_min_low < entry_price:
-                    max_dd_pct = min(
-                        max_dd_pct, ((trade_min_low / entry_price) - 1) * 100
-                    )
-                i += max(1, hold_days)
-            i += 1
-        total_trades = wins + losses
-        win_rate_pct = (wins / total_trades) * 100 if total_trades > 0 else 0.0
-        bt_str_new = f"{win_rate_pct:.0f}%"
-        if total_trades == 0:
-            return "機会なし", 0.0, 0, 0.0, target_pct, 0, 0
-        return (
-            bt_str_new,
-            win_rate_pct,
-            total_trades,
-            max_dd_pct,
-            target_pct,
-            wins,
-            losses,
-        )
-    except Exception as e:
-        return f"計算エラー: {e}", 0.0, 0, 0.0, 0.0, 0, 0
-
-
-run_backtest = run_backtest_precise
-
-
-@st.cache_data(ttl=1)
-def get_stock_data(ticker, current_run_count):
-    status, jst_now_local = get_market_status()
-    ticker_clean = str(ticker).strip().upper()
-    yf_ticker = f"{ticker_clean}.T"
+def get_scan_owner():
+    """
+    チェックポイントの実行者 ID。URL (?scan=) に残すため、同じタブの再読み込みでは
+    続きから再開し、別のタブ・別のユーザーとは途中経過を共有しない。
+    """
+    owner = st.query_params.get("scan")
+    if not owner:
+        owner = uuid.uuid4().hex
+        st.query_params["scan"] = owner
+    return owner
 
-    info = get_stock_info(ticker_clean)
-    if info.get("price") is None:
-        return None
 
-    # 株探から最新の決算日情報を取得
-    k_earnings_date = get_kabutan_earnings_date(ticker_clean)
+def generate_comment_text(client, model_name, prompt):
+    """Gemini の呼び出し (取得元の予算は http_client のペーサーで管理)"""
+    with host_slot("generativelanguage.googleapis.com"):
+        return client.models.generate_content(model=model_name, contents=prompt).text
 
-    try:
-        time.sleep(random.uniform(2.0, 5.0))
-        df_yf = yf.download(
-            yf_ticker, period="6mo", interval="1d", progress=False, auto_adjust=False
-        )
-        if df_yf.empty:
-            st.session_state.error_messages.append(f"Yahooデータ空空 ({yf_ticker})")
-            return None
-
-        df = df_yf.copy()
-        if isinstance(df.columns, pd.MultiIndex):
-            df.columns = df.columns.get_level_values(0)
-        df = df.sort_index().rename(
-            columns={
-                "Open": "Open",
-                "High": "High",
-                "Low": "Low",
-                "Close": "Close",
-                "Volume": "Volume",
-            }
-        )
 
-        # 現在値の反映
-        today_date = pd.to_datetime(jst_now_local.date())
-        if info.get("price") is not None:
-            new_row = pd.Series(
-                {
-                    "Open": info.get("open", info["price"]),
-                    "High": info.get("high", info["price"]),
-                    "Low": info.get("low", info["price"]),
-                    "Close": info["price"],
-                    "Volume": info.get("volume", 0),
-                },
-                name=today_date,
-            )
-            if today_date > df.index[-1]:
-                df = pd.concat([df, new_row.to_frame().T])
-            else:
-                for col in new_row.index:
-                    df.iloc[-1, df.columns.get_loc(col)] = new_row[col]
-
-        # --- 決算判定ロジック：多段階カラー表示と発表後3日間の維持 ---
-        earnings_day_count = None
-        earnings_disp_str = ""
-        is_earnings_soon = False
-
-        if k_earnings_date:
-            days = (k_earnings_date.date() - jst_now_local.date()).days
-            earnings_day_count = days
-            dt_str = k_earnings_date.strftime("%m/%d")
-
-            if days > 14:
-                # 14日超：グレー表示
-                earnings_disp_str = f"決算 {dt_str} (あと{days}日)"
-            elif 7 < days <= 14:
-                # 8〜14日：オレンジ表示
-                earnings_disp_str = f"決算 {dt_str} (あと{days}日)"
-            elif 0 <= days <= 7:
-                # 0〜7日：赤色表示（CSVフラグをTRUEに）
-                earnings_disp_str = f"決算 {dt_str} (あと{days}日)"
-                is_earnings_soon = True
-            elif -3 <= days < 0:
-                # 発表後3日間：グレー表示（決算発表済）
-                earnings_disp_str = f"決算発表済"
-            else:
-                # 発表から4日以上：表示を消去
-                earnings_day_count = None
-
-        # 指標・スコア計算
-        df["Vol_SMA5"] = df["Volume"].rolling(5).mean()
-        vol_sma5_val = df["Vol_SMA5"].iloc[-1]
-        v_weight = get_volume_weight(jst_now_local, info["cap"])
-        vol_ratio = (
-            info.get("volume", 0) / (vol_sma5_val * v_weight)
-            if (vol_sma5_val * v_weight) > 0
-            else 1.0
-        )
-
-        bt_res = run_backtest(df, info["cap"])
-        bt_str, bt_win_rate, _, _, _, bt_wins, bt_losses = bt_res
-
-        (p_s, _, _, _, _, _, _, _, _, _, _, _, _, _, _, _) = calculate_score_and_logic(
-            df.iloc[:-1], info, 1.0, "引け後"
-        )
-        (
-            s,
-            f,
-            st_n,
-            bt,
-            ph,
-            pf,
-            slm,
-            at,
-            slp,
-            rsi,
-            atr,
-            atrc,
-            mom,
-            rci,
-            osh,
-            mdd_val,
-        ) = calculate_score_and_logic(df, info, vol_ratio, status)
-
-        return {
-            "code": ticker_clean,
-            "name": info["name"],
-            "price": info.get("price"),
-            "cap_val": info["cap"],
-            "cap_disp": fmt_market_cap(info["cap"]),
-            "per": info["per"],
-            "pbr": info["pbr"],
-            "rsi": rsi,
-            "rci": rci,
-            "vol_ratio": vol_ratio,
-            "avg_volume_5d": vol_sma5_val,
-            "strategy": st_n,
-            "score": max(0, min(100, s)),
-            "score_diff": s - p_s,
-            "score_factors": f,
-            "buy": bt,
-            "oshime_price": osh,
-            "p_half": ph,
-            "p_full": pf,
-            "max_dd_pct": mdd_val,
-            "sl_pct": slp,
-            "sl_ma": slm,
-            "risk_reward": (pf - bt) / (bt - slm) if (bt - slm) > 0 else 0.0,
-            "atr_smoothed": atr,
-            "atr_comment": atrc,
-            "momentum": mom,
-            "is_aoteng": at,
-            "backtest": bt_str,
-            "backtest_raw": bt_str,
-            "win_rate_pct": bt_win_rate,
-            "bt_win_count": bt_wins,
-            "bt_loss_count": bt_losses,
-            "update_count": 1,
-            "is_updated_in_this_run": True,
-            "earnings_date": k_earnings_date,
-            "earnings_day_count": earnings_day_count,
-            "earnings_disp_str": earnings_disp_str,
-            "is_earnings_soon": is_earnings_soon,
-        }
-    except Exception as e:
-        st.session_state.error_messages.append(f"Yahoo解析エラー ({ticker_clean}): {e}")
-        return None
-
-
-def batch_analyze_with_ai(data_list):
+def batch_analyze_with_ai(data_list, api_key, model_name, market_ratio, on_error):
     """Gemini APIを使用して分析コメントを生成（アイさん人格版）"""
-    model_name = st.session_state.selected_model_name
     client = None  # 「model」から「client」に変更
-    global api_key
     if api_key:
         try:
             # 新仕様：クライアントオブジェクトを作成
@@ -1711,7 +454,8 @@ def batch_analyze_with_ai(data_list):
         except Exception:
             pass
 
-    if not client:
+    # 再生モードでは記録済みの応答を使うため、APIキーが無くても続行する
+    if not client and not is_replay():
         return (
             {},
             f"⚠️ AIモデル ({model_name}) が設定されていません。APIキーを確認してください。",
@@ -1719,36 +463,33 @@ def batch_analyze_with_ai(data_list):
 
     data_for_ai = ""
     for d in data_list:
-        price = d["price"] if d["price"] is not None else 0
-        rr_val = d.get("risk_reward", 0.0)
+        price = d.price if d.price is not None else 0
+        rr_val = d.risk_reward
 
-        if d.get("is_aoteng"):
+        if d.is_aoteng:
             rr_disp = "青天"
         elif rr_val >= 0.1:
             rr_disp = f"{rr_val:.1f}"
         else:
             rr_disp = "-"
 
-        ma_div = (
-            (price / d.get("buy", 1) - 1) * 100
-            if d.get("buy", 1) > 0 and price > 0
-            else 0
-        )
-        mdd = d.get("max_dd_pct", 0.0)
-        sl_ma = d.get("sl_ma", 0)
-        atr_sl_price = d.get("atr_sl_price", 0)
-        ma25_sl_price = d.get("ma25", 0) * 0.995
-        rci_val = d.get("rci", 0)
+        ma_div = (price / d.buy - 1) * 100 if d.buy > 0 and price > 0 else 0
+        mdd = d.max_dd_pct
+        sl_ma = d.sl_ma
+        # ATR・25日線の損切値は結果に持っていない (従来どおり 0 を渡す)
+        atr_sl_price = 0
+        ma25_sl_price = 0.0
+        rci_val = d.rci
 
         low_liq = (
             "致命的低流動性:警告(1000株未満)"
-            if d.get("avg_volume_5d", 0) < 1000
+            if d.avg_volume_5d < 1000
             else "流動性:問題なし"
         )
-        atr_msg = d.get("atr_comment", "")
+        atr_msg = d.atr_comment
 
         earnings_info = ""
-        days = d.get("earnings_day_count")
+        days = d.earnings_day_count
         if days is not None:
             if days >= 0:
                 earnings_info = f" | EARNINGS_DAYS:{days}"
@@ -1756,26 +497,32 @@ def batch_analyze_with_ai(data_list):
                 earnings_info = " | EARNINGS_DONE:RECENT"
 
         data_for_ai += (
-            f"ID:{d['code']}: 名称:{d['name']} | 点:{d['score']} | 戦略:{d['strategy']} | "
-            f"RSI:{d['rsi']:.1f} | RCI:{rci_val:.1f} | 乖離:{ma_div:+.1f}% | R/R:{rr_disp} | MDD:{mdd:+.1f}% | "
+            f"ID:{d.code}: 名称:{d.name} | 点:{d.score} | 戦略:{d.strategy} | "
+            f"RSI:{d.rsi:.1f} | RCI:{rci_val:.1f} | 乖離:{ma_div:+.1f}% | R/R:{rr_disp} | MDD:{mdd:+.1f}% | "
             f"SL_R/R:{sl_ma:,.0f} | SL_ATR:{atr_sl_price:,.0f} | SL_MA25:{ma25_sl_price:,.0f} | "
             f"LIQUIDITY:{low_liq} | ATR_MSG:{atr_msg}{earnings_info}\n"
         )
 
-    global market_25d_ratio
-    r25 = market_25d_ratio
+    r25 = market_ratio
 
-    market_alert_info = f"市場25日騰落レシオ: {r25:.2f}%。"
-    if r25 >= 125.0:
-        market_alert_info += (
-            "市場は【明確な過熱ゾーン】にあり、全体的な調整リスクが非常に高いです。"
-        )
-    elif r25 <= 80.0:
-        market_alert_info += (
-            "市場は【明確な底値ゾーン】にあり、全体的な反発期待が高いです。"
+    # 未取得 (None) の場合は市場環境を判断材料にさせない
+    r25_disp = "未取得" if r25 is None else f"{r25:.2f}%"
+    if r25 is None:
+        market_alert_info = (
+            "市場25日騰落レシオは取得できていません。市場の過熱感には言及しないでください。"
         )
     else:
-        market_alert_info += "市場の過熱感は中立的です。"
+        market_alert_info = f"市場25日騰落レシオ: {r25:.2f}%。"
+        if r25 >= 125.0:
+            market_alert_info += (
+                "市場は【明確な過熱ゾーン】にあり、全体的な調整リスクが非常に高いです。"
+            )
+        elif r25 <= 80.0:
+            market_alert_info += (
+                "市場は【明確な底値ゾーン】にあり、全体的な反発期待が高いです。"
+            )
+        else:
+            market_alert_info += "市場の過熱感は中立的です。"
 
     prompt = f"""あなたは「アイ」という名前のプロトレーダー（30代女性、冷静・理知的）です。以下の【市場環境】と【銘柄データ】に基づき、それぞれの「所感コメント（丁寧語）」を【生成コメントの原則】に従って作成してください。
 
@@ -1810,18 +557,20 @@ def batch_analyze_with_ai(data_list):
 （例）
 ID:9984 | <b>ソフトバンクグループ</b>｜RCIが-80から反転し底打ちを示唆。MA25_SL（6,500円）を終値で割るか、ATR_SL（6,400円）を割るかのどちらかをロスカット基準としてご検討ください。
 
-【最後に】リストの最後に「END_OF_LIST」と書き、その後に続けて「アイの独り言（常体・独白調）」を1行で書いてください。語尾に「ね」や「だわ」などは使わず、冷静な口調で。※見出し不要。独り言は、市場25日騰落レシオ({r25:.2f}%)を総括し、規律ある撤退の重要性に言及する。
+【最後に】リストの最後に「END_OF_LIST」と書き、その後に続けて「アイの独り言（常体・独白調）」を1行で書いてください。語尾に「ね」や「だわ」などは使わず、冷静な口調で。※見出し不要。独り言は、市場25日騰落レシオ({r25_disp})を総括し、規律ある撤退の重要性に言及する。
 """
 
     try:
         # 新仕様：client.models.generate_content を使用
-        res = client.models.generate_content(model=model_name, contents=prompt)
-        text = res.text
+        text = archived_call(
+            ("gemini", model_name, prompt),
+            lambda: generate_comment_text(client, model_name, prompt),
+        )
         comments = {}
         monologue = ""
 
         if "END_OF_LIST" not in text:
-            st.session_state.error_messages.append(
+            on_error(
                 "AI分析エラー: Geminiモデルからの応答にEND_OF_LISTが見つかりません。"
             )
             return {}, "AI分析失敗"
@@ -1864,27 +613,107 @@ ID:9984 | <b>ソフトバンクグループ</b>｜RCIが-80から反転し底打
                     pass
         return comments, monologue
     except Exception as e:
-        st.session_state.error_messages.append(
-            f"AI分析エラー: Gemini応答解析失敗。詳細: {e}"
-        )
+        on_error(f"AI分析エラー: Gemini応答解析失敗。詳細: {e}")
         return {}, "コメント生成エラー"
 
 
 def merge_new_data(new_data_list):
-    existing_map = {d["code"]: d for d in st.session_state.analyzed_data}
-    for d in existing_map.values():
-        if "is_updated_in_this_run" in d:
-            d["is_updated_in_this_run"] = False
-    for new_data in new_data_list:
-        if new_data["code"] in existing_map:
-            new_data["update_count"] = (
-                existing_map[new_data["code"]].get("update_count", 0) + 1
-            )
-        else:
-            new_data["update_count"] = 1
-        new_data["is_updated_in_this_run"] = True
-        existing_map[new_data["code"]] = new_data
-    st.session_state.analyzed_data = list(existing_map.values())
+    """今回の結果をセッションの結果表に反映する (既存銘柄は更新回数を加算)"""
+    st.session_state.analyzed_data.upsert(new_data_list)
+
+
+def collect_job_results(job):
+    """
+    ジョブの完了済みバッチを結果表に反映する。反映したバッチがあれば True。
+    チェックポイントから読み戻した銘柄は、結果表に無い場合 (再読み込み後など) だけ加える。
+    """
+    table = st.session_state.analyzed_data
+    batches = job.take_results()
+    for batch in batches:
+        records, monologue, errors = batch.value
+        merge_new_data(
+            [d for d in records if d.code not in job.restored or d.code not in table]
+        )
+        if monologue:
+            st.session_state.ai_monologue = monologue
+        st.session_state.error_messages.extend(errors)
+        st.session_state.analysis_index = batch.end
+        st.session_state.is_first_session_run = False
+    return bool(batches)
+
+
+def finish_job(job):
+    """終了したジョブを片付け、結果を次の描画で表示するメッセージにする"""
+    total = st.session_state.job_total
+    if job.state == "failed":
+        st.session_state.job_notice = ("error", f"❌ 分析を中断しました: {job.error}")
+    elif st.session_state.analysis_index >= total:
+        st.session_state.job_notice = ("success", f"🎉 全{total}銘柄完了。")
+        st.session_state.analysis_index = 0
+    else:
+        remaining = total - st.session_state.analysis_index
+        st.session_state.job_notice = (
+            "warning",
+            f"⏹️ 停止しました。残り {remaining} 件は再度【▶️分析】で続きから分析します。",
+        )
+    if not st.session_state.analyzed_data and job.processed:
+        st.session_state.job_notice = ("warning", "⚠️ 全データ取得失敗。")
+    st.session_state.job_id = None
+    get_job_runner().discard(job.job_id)
+
+
+def parse_ticker_input(text):
+    """入力欄の銘柄コードを重複なしのリストにする (改行・空白・読点・カンマ区切り)"""
+    raw = text.replace("\n", ",").replace(" ", ",").replace("、", ",")
+    return list(dict.fromkeys(t.strip() for t in raw.split(",") if t.strip()))
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}時間{seconds % 3600 // 60}分"
+    if seconds >= 60:
+        return f"{seconds // 60}分{seconds % 60}秒"
+    return f"{seconds}秒"
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def job_progress_panel():
+    """
+    分析ジョブの進捗表示。JOB_POLL_INTERVAL 秒ごとにこの部分だけ再実行し、
+    完了した分があれば画面全体を描き直して結果表に反映する。
+    """
+    job = get_job_runner().get(st.session_state.job_id)
+    if job is None:
+        return
+    if collect_job_results(job) or not job.is_active:
+        if not job.is_active:
+            finish_job(job)
+        st.rerun()
+    p = job.snapshot()
+    st.progress(
+        p["processed"] / p["total"] if p["total"] else 0.0,
+        text=f"{p['processed']}/{p['total']} 件",
+    )
+    if p["state"] == "queued":
+        st.info("⌛️ 他の分析の完了を待っています。")
+    else:
+        if p["restored"]:
+            st.caption(f"💾 {p['restored']}件は前回の途中経過から再開しました。")
+        if p["cached"]:
+            st.caption(f"⚡ {p['cached']}件は通信せずに処理しました（共有キャッシュなど）。")
+        requests_text = " / ".join(
+            f"{label} {p['requests'][source]}回"
+            for source, label in SOURCE_LABELS.items()
+        )
+        st.info(
+            f"📊 分析中。{p['rate_per_min']:.1f}銘柄/分・残り約{format_duration(p['eta_seconds'])}"
+            f"（律速: {p['bottleneck']}｜{requests_text}）"
+        )
+
+
+active_job = get_job_runner().get(st.session_state.job_id)
+is_job_active = active_job is not None and active_job.is_active
 
 
 # --- サイドバー構成 ---
@@ -2013,30 +842,26 @@ with st.sidebar:
 
         # keyを指定してStreamlitに入力管理を任せる（これで消えなくなります）
         st.text_area(
-            "銘柄コード (上限10銘柄/回)",
+            "銘柄コード",
             key="tickers_input_value",  # session_stateと自動連携
             placeholder="7203\n8306",
             height=150,
         )
         # ▲▲▲ 修正箇所ここまで ▲▲▲
 
-        col_start, col_cont = st.columns([0.6, 0.4])
-        col_cont.checkbox(
-            "連続",
-            value=st.session_state.get("run_continuously_checkbox", False),
-            key="run_continuously_checkbox_key",
-            on_change=toggle_continuous_run,
-        )
+        input_count = len(parse_ticker_input(st.session_state.tickers_input_value))
+        if input_count and not is_job_active:
+            st.caption(
+                f"{input_count}銘柄・見込み 約{format_duration(estimate_seconds(input_count))}"
+            )
 
-        is_btn_disabled = (
-            st.session_state.get("is_running_continuous", False) or api_key is None
-        )
-        analyze_start_clicked = col_start.button(
+        is_btn_disabled = is_job_active or api_key is None
+        analyze_start_clicked = st.button(
             "▶️分析", use_container_width=True, disabled=is_btn_disabled
         )
 
         col_clr, col_re = st.columns(2)
-        is_mng_disabled = st.session_state.get("is_running_continuous", False)
+        is_mng_disabled = is_job_active
         clear_button_clicked = col_clr.button(
             "🗑️消去",
             on_click=clear_all_data_confirm,
@@ -2050,10 +875,10 @@ with st.sidebar:
             disabled=is_mng_disabled,
         )
 
-        if st.session_state.is_running_continuous:
+        if is_job_active:
             if st.button("⏹️ 分析中止", use_container_width=True, key="cancel_run_btn"):
-                st.session_state.is_running_continuous = False
-                st.session_state.wait_start_time = None
+                # 分析中の銘柄を終えたところで止まる (そこまでの結果は反映する)
+                active_job.cancel()
                 st.rerun()
     else:
         analyze_start_clicked = False
@@ -2067,7 +892,7 @@ if clear_button_clicked or reload_button_clicked:
 
 # クリア処理を安全に行うための関数（コールバック）
 def perform_clear_all():
-    st.session_state.analyzed_data = []
+    st.session_state.analyzed_data = ResultTable()
     st.session_state.ai_monologue = ""
     st.session_state.error_messages = []
     st.session_state.clear_confirmed = False
@@ -2076,9 +901,10 @@ def perform_clear_all():
     st.session_state.tickers_input_value = ""
     st.session_state.analysis_index = 0
     st.session_state.current_input_hash = ""
-    st.session_state.is_running_continuous = False
-    st.session_state.wait_start_time = None
-    st.session_state.run_continuously_checkbox = False
+    st.session_state.job_notice = ""
+    if st.session_state.job_id is not None:
+        get_job_runner().discard(st.session_state.job_id)
+        st.session_state.job_id = None
 
 
 if st.session_state.clear_confirmed:
@@ -2103,47 +929,10 @@ if not st.session_state.authenticated:
     st.stop()
 
 # --- メイン実行制御 ---
-if (
-    st.session_state.is_running_continuous
-    and st.session_state.wait_start_time is not None
-):
-    REQUIRED_DELAY = 60 + random.uniform(5.0, 10.0)
-    time_elapsed = (
-        datetime.datetime.now() - st.session_state.wait_start_time
-    ).total_seconds()
-    if time_elapsed >= REQUIRED_DELAY or not st.session_state.is_running_continuous:
-        st.session_state.wait_start_time = None
-        st.rerun()
-    else:
-        time_to_wait = REQUIRED_DELAY - time_elapsed
-        status_placeholder = st.empty()
-        while time_to_wait > 0 and st.session_state.is_running_continuous:
-            time_to_wait = (
-                REQUIRED_DELAY
-                - (
-                    datetime.datetime.now() - st.session_state.wait_start_time
-                ).total_seconds()
-            )
-            status_placeholder.info(
-                f"⌛️ サーバー負荷を考慮し、次のバッチ分析まで【残り {time_to_wait:.1f}秒間】待機中です。"
-            )
-            time.sleep(1)
-            if time_to_wait <= 0:
-                break
-        if st.session_state.is_running_continuous:
-            st.session_state.wait_start_time = None
-            st.info("✅ 待機完了。分析開始。")
-        else:
-            st.warning("⏹️ 連続分析キャンセル。停止します。")
-            st.session_state.wait_start_time = None
-        st.rerun()
-
-if analyze_start_clicked or (
-    st.session_state.is_running_continuous
-    and st.session_state.wait_start_time is None
-    and st.session_state.analysis_index > 0
-):
+# 分析はジョブとしてバックグラウンドで進め、ここでは投入と進捗表示だけを行う
+if analyze_start_clicked and not is_job_active:
     st.session_state.error_messages = []
+    st.session_state.job_notice = ""
     input_tickers = st.session_state.tickers_input_value
     resolved_api_key = (
         api_key if api_key else st.session_state.get("gemini_api_key_input")
@@ -2155,135 +944,54 @@ if analyze_start_clicked or (
         st.warning("銘柄コードを入力してください。")
     else:
         api_key = resolved_api_key
-        raw_tickers_str = (
-            input_tickers.replace("\n", ",").replace(" ", ",").replace("、", ",")
-        )
-
-        # --- ここが重要：分析ボタンが押された時だけハッシュを更新してインデックスをリセット ---
-        if analyze_start_clicked:
-            current_hash = hashlib.sha256(raw_tickers_str.encode()).hexdigest()
-            if st.session_state.current_input_hash != current_hash:
-                st.session_state.analysis_index = 0
-                st.session_state.current_input_hash = current_hash
-        # --------------------------------------------------------------------------
-
-        all_unique_tickers = list(
-            set([t.strip() for t in raw_tickers_str.split(",") if t.strip()])
-        )
+        all_unique_tickers = parse_ticker_input(input_tickers)
         total_tickers = len(all_unique_tickers)
-        if analyze_start_clicked:
-            is_checkbox_on = st.session_state.get(
-                "run_continuously_checkbox_key", False
-            )
-            if total_tickers > MAX_TICKERS and is_checkbox_on:
-                st.session_state.is_running_continuous = True
-            else:
-                st.session_state.is_running_continuous = False
-        if (
-            not st.session_state.is_running_continuous
-            and st.session_state.analysis_index > 0
-            and not analyze_start_clicked
-        ):
-            st.info("キャンセルされました。手動で再実行してください。")
-            st.session_state.analysis_index = 0
-            st.stop()
-        start_index = st.session_state.analysis_index
-        end_index = min(start_index + MAX_TICKERS, total_tickers)
-        raw_tickers = all_unique_tickers[start_index:end_index]
-        if not raw_tickers:
-            if start_index > 0:
-                st.info("✅ 分析完了。")
-            else:
-                st.warning("⚠️ 分析対象なし。")
-            st.session_state.analysis_index = 0
-        st.session_state.analysis_run_count += 1
-        current_run_count = st.session_state.analysis_run_count
-        if total_tickers > MAX_TICKERS and end_index < total_tickers:
-            current_batch_num = start_index // MAX_TICKERS + 1
-            remaining_tickers = total_tickers - end_index
-            mode_text = (
-                "自動継続します。"
-                if st.session_state.is_running_continuous
-                else "再度【🚀 分析開始】を押してください。"
+
+        st.session_state.analysis_index = 0
+        if not all_unique_tickers:
+            st.warning("⚠️ 分析対象なし。")
+        else:
+            # 同じタブ・同じ入力・同じ市場フェーズで途中まで進んだスキャンがあれば、
+            # 保存済みの銘柄は取得し直さずに続きから分析する (checkpoint.py)
+            checkpoint = ScanCheckpoint(
+                all_unique_tickers, market_phase_id()[0], get_scan_owner()
             )
-            st.warning(
-                f"⚠️ {MAX_TICKERS}件超。第{current_batch_num}回分析中。（残り {remaining_tickers} 件）{mode_text}"
+            st.session_state.current_input_hash = checkpoint.key
+            # 件数・間隔は固定せず、取得元ごとの予算の範囲で全件を1本のジョブで回す
+            # 長時間かかる分析は別枠で回し、他のユーザーの小さな分析を待たせない
+            active_job = get_job_runner().submit(
+                UniverseScan(
+                    all_unique_tickers,
+                    get_info=get_stock_info,
+                    annotate=partial(
+                        batch_analyze_with_ai,
+                        api_key=api_key,
+                        model_name=st.session_state.selected_model_name,
+                        market_ratio=market_25d_ratio,
+                    ),
+                    checkpoint=checkpoint,
+                ),
+                long_running=estimate_seconds(total_tickers) > LONG_JOB_SECONDS,
             )
-        elif total_tickers > MAX_TICKERS and end_index == total_tickers:
-            current_batch_num = start_index // MAX_TICKERS + 1
-            st.info(f"📊 【最終回: 第{current_batch_num}回】分析開始。")
-        elif end_index <= total_tickers and total_tickers > 0:
-            st.info("📊 分析開始。")
-
-        data_list, bar, status_label, jst_now, new_analyzed_data = (
-            [],
-            None,
-            get_market_status(),
-            get_market_status()[1],
-            [],
-        )
-        if len(raw_tickers) > 0:
-            if len(raw_tickers) > 20:
-                st.info(f"💡 {len(raw_tickers)}件分析中。")
-            else:
-                bar = st.progress(0)
-            for i, t in enumerate(raw_tickers):
-                d = get_stock_data(t, current_run_count)
-                if d:
-                    d["batch_order"] = start_index + i + 1
-                    new_analyzed_data.append(d)
-                if bar:
-                    bar.progress((i + 1) / len(raw_tickers))
-                time.sleep(random.uniform(1.5, 2.5))
-            with st.spinner("アイが診断中..."):
-                comments_map, monologue = batch_analyze_with_ai(new_analyzed_data)
-                for d in new_analyzed_data:
-                    d["comment"] = comments_map.get(d["code"], "コメント生成失敗")
-                merge_new_data(new_analyzed_data)
-                st.session_state.ai_monologue = monologue
-                st.session_state.is_first_session_run = False
-                st.session_state.analysis_index = end_index
-                is_analysis_complete = end_index >= total_tickers
-                if is_analysis_complete:
-                    st.success(f"🎉 全{total_tickers}銘柄完了。")
-                    # st.session_state.tickers_input_value = ""  <-- エラー原因のこの行を削除しました
-                    st.session_state.analysis_index = 0
-                    st.session_state.is_running_continuous = False
-                    st.session_state.wait_start_time = None
-                    st.session_state.run_continuously_checkbox = False
-                elif new_analyzed_data and st.session_state.is_running_continuous:
-                    current_batch_num = start_index // MAX_TICKERS + 1
-                    st.success(f"✅ 第{current_batch_num}回完了。次へ自動移行。")
-                    st.session_state.wait_start_time = datetime.datetime.now()
-                    st.rerun()
-                elif (
-                    new_analyzed_data
-                    and not st.session_state.is_running_continuous
-                    and start_index > 0
-                ):
-                    st.warning("⏹️ 停止しました。残りは未分析です。")
-                if raw_tickers:
-                    st.empty()
-                if is_analysis_complete or not st.session_state.is_running_continuous:
-                    st.rerun()
-
-        if st.session_state.error_messages:
-            if not st.session_state.tickers_input_value and end_index >= total_tickers:
-                st.session_state.error_messages = []
-            else:
-                st.error("❌ エラーによりスキップされました。")
-                with st.expander("詳細"):
-                    for msg in st.session_state.error_messages:
-                        st.markdown(
-                            f'<p style="color: red;">- {msg}</p>',
-                            unsafe_allow_html=True,
-                        )
-        elif not st.session_state.analyzed_data and raw_tickers:
-            st.warning("⚠️ 全データ取得失敗。")
-        if new_analyzed_data and end_index >= total_tickers:
-            st.success(f"✅ 全{total_tickers}件完了。")
-        elif new_analyzed_data and end_index < total_tickers:
-            st.success(f"✅ {len(new_analyzed_data)}件完了。")
+            st.session_state.job_id = active_job.job_id
+            st.session_state.job_total = total_tickers
+            # サイドバーのボタンを実行中の表示にする
+            st.rerun()
+
+if st.session_state.job_id is not None:
+    job_progress_panel()
+
+if st.session_state.job_notice:
+    level, message = st.session_state.job_notice
+    getattr(st, level)(message)
+    if st.session_state.error_messages:
+        st.error("❌ エラーによりスキップされました。")
+        with st.expander("詳細"):
+            for msg in st.session_state.error_messages:
+                st.markdown(
+                    f'<p style="color: red;">- {msg}</p>',
+                    unsafe_allow_html=True,
+                )
 
 # --- 結果表示UI ---
 HEADER_MAP = [
@@ -2309,34 +1017,25 @@ HEADER_MAP = [
 st.markdown("---")
 
 if st.session_state.analyzed_data:
-    data = st.session_state.analyzed_data
-    filtered_data = []
+    table = st.session_state.analyzed_data
 
     is_filter_active = (
         st.session_state.ui_filter_score_on
         or st.session_state.ui_filter_liquid_on
         or st.session_state.ui_filter_rsi_on
     )
-    if is_filter_active:
-        min_score = st.session_state.ui_filter_min_score
-        min_liquid_man = st.session_state.ui_filter_min_liquid_man
-        max_rsi = st.session_state.ui_filter_max_rsi
-        for d in data:
-            keep = True
-            if st.session_state.ui_filter_score_on:
-                if d["score"] < min_score:
-                    keep = False
-            if keep and st.session_state.ui_filter_liquid_on:
-                if d["avg_volume_5d"] < min_liquid_man * 10000:
-                    keep = False
-            if keep and st.session_state.ui_filter_rsi_on and d["rsi"] >= max_rsi:
-                keep = False
-            if keep:
-                filtered_data.append(d)
-    else:
-        filtered_data = data
-
-    df = pd.DataFrame(filtered_data)
+    # 絞り込みは結果表の列 (配列) に対して一括で行う
+    keep = np.ones(len(table), dtype=bool)
+    if st.session_state.ui_filter_score_on:
+        keep &= ~(table.column("score") < st.session_state.ui_filter_min_score)
+    if st.session_state.ui_filter_liquid_on:
+        min_volume = st.session_state.ui_filter_min_liquid_man * 10000
+        keep &= ~(table.column("avg_volume_5d") < min_volume)
+    if st.session_state.ui_filter_rsi_on:
+        keep &= ~(table.column("rsi") >= st.session_state.ui_filter_max_rsi)
+
+    df = table.to_frame(keep)
+    df["cap_disp"] = df["cap_val"].apply(fmt_market_cap)
 
     if st.session_state.get("trigger_copy_filtered_data", False):
         st.session_state.trigger_copy_filtered_data = False
@@ -2523,7 +1222,7 @@ if st.session_state.analyzed_data:
     )
     df["bt_cell_content"] = df.apply(
         lambda row: (
-            f"<b>{row['backtest_raw']}</b><br><span style='font-size:11px;'>({row['bt_win_count']}勝{row.get('bt_loss_count', 0)}敗)</span>"
+            f"<b>{row['backtest']}</b><br><span style='font-size:11px;'>({row['bt_win_count']}勝{row.get('bt_loss_count', 0)}敗)</span>"
         ),
         axis=1,
     )
@@ -2570,7 +1269,7 @@ if st.session_state.analyzed_data:
         ("vol_ratio", "出来高倍率"),
         ("avg_volume_5d", "5日平均出来高(株)"),
         ("momentum", "直近勝率"),
-        ("backtest_raw", "MA5実績"),
+        ("backtest", "MA5実績"),
         ("per", "PER"),
         ("pbr", "PBR"),
         ("comment", "アイの所感"),
@@ -2645,11 +1344,20 @@ if st.session_state.analyzed_data:
 
     st.markdown("### 📊 アイ分析結果")
     r25 = market_25d_ratio
-    ratio_color = (
-        "#d32f2f" if r25 >= 125.0 else ("#1976d2" if r25 <= 80.0 else "#4A4A4A")
+    if r25 is None:
+        ratio_color, ratio_disp = "#888", "未取得"
+    else:
+        ratio_color = (
+            "#d32f2f" if r25 >= 125.0 else ("#1976d2" if r25 <= 80.0 else "#4A4A4A")
+        )
+        ratio_disp = f"{r25:.2f}%"
+    ratio_time = (
+        f"{market_25d_ratio_at.strftime('%H:%M')}時点"
+        if market_25d_ratio_at
+        else "取得中"
     )
     st.markdown(
-        f'<p class="big-font"><b>市場環境（25日騰落レシオ）：<span style="color:{ratio_color};">{r25:.2f}%</span></b></p>',
+        f'<p class="big-font"><b>市場環境（25日騰落レシオ）：<span style="color:{ratio_color};">{ratio_disp}</span></b> <span style="font-size:11px; color:#888;">({ratio_time})</span></p>',
         unsafe_allow_html=True,
     )
 
@@ -2694,7 +1402,6 @@ if st.session_state.analyzed_data:
             ]
         )
         rows_html = []
-        raw_data_map = {d["code"]: d for d in st.session_state.analyzed_data}
         for _, row in data_frame.iterrows():
             bg_class = ""
             if row.get("is_low_liquidity"):
@@ -2714,12 +1421,11 @@ if st.session_state.analyzed_data:
                 cell_data = row[col_key]
                 if col_key == "name":
                     badges_html = ""
-                    raw_row = raw_data_map.get(row["code"])
-                    if raw_row and "score_factors" in raw_row:
-                        factors = raw_row["score_factors"]
+                    factors = row["score_factors"]
+                    if factors:
                         pos = []
                         neg = []
-                        for f_key, f_val in factors.items():
+                        for f_key, f_val in factors:
                             if f_val == 0 or f_key == "基礎点" or "合計" in f_key:
                                 continue
                             if f_key in FACTOR_META:
@@ -2791,40 +1497,37 @@ if st.session_state.analyzed_data:
 
     with st.expander("詳細なスコア内訳（透明性向上）"):
         st.subheader("銘柄ごとのスコア要因")
-        raw_data_map = {d["code"]: d for d in st.session_state.analyzed_data}
         for index, row in df.iterrows():
-            raw_row = raw_data_map.get(row["code"])
-            if raw_row:
+            st.markdown(
+                f"**No.{index + 1} - {row['name']} ({row['code']}) - 総合点: {row['score']:.0f}**",
+                unsafe_allow_html=True,
+            )
+            factors = row["score_factors"]
+            st.markdown("##### ➕ 加点要因")
+            for k, v in factors:
+                if k == "基礎点" or v > 0:
+                    color = "green" if v > 0 else "black"
+                    st.markdown(
+                        f'<p style="color:{color}; margin: 0; padding: 0 0 0 15px; font-weight: bold;">{k}: {v:+.0f}点</p>',
+                        unsafe_allow_html=True,
+                    )
+            st.markdown("##### ➖ 減点要因")
+            has_minus = False
+            for k, v in factors:
+                if "合計" in k:
+                    continue
+                if v < 0:
+                    st.markdown(
+                        f'<p style="color:#800000; margin: 0; padding: 0 0 0 15px; font-weight: bold;">{k}: {v:+.0f}点</p>',
+                        unsafe_allow_html=True,
+                    )
+                    has_minus = True
+            if not has_minus:
                 st.markdown(
-                    f"**No.{index + 1} - {row['name']} ({row['code']}) - 総合点: {row['score']:.0f}**",
+                    '<p style="color:#666; margin: 0; padding: 0 0 0 15px;">- 該当なし</p>',
                     unsafe_allow_html=True,
                 )
-                if "score_factors" in raw_row:
-                    st.markdown("##### ➕ 加点要因")
-                    for k, v in raw_row["score_factors"].items():
-                        if k == "基礎点" or v > 0:
-                            color = "green" if v > 0 else "black"
-                            st.markdown(
-                                f'<p style="color:{color}; margin: 0; padding: 0 0 0 15px; font-weight: bold;">{k}: {v:+.0f}点</p>',
-                                unsafe_allow_html=True,
-                            )
-                    st.markdown("##### ➖ 減点要因")
-                    has_minus = False
-                    for k, v in raw_row["score_factors"].items():
-                        if "合計" in k:
-                            continue
-                        if v < 0:
-                            st.markdown(
-                                f'<p style="color:#800000; margin: 0; padding: 0 0 0 15px; font-weight: bold;">{k}: {v:+.0f}点</p>',
-                                unsafe_allow_html=True,
-                            )
-                            has_minus = True
-                    if not has_minus:
-                        st.markdown(
-                            '<p style="color:#666; margin: 0; padding: 0 0 0 15px;">- 該当なし</p>',
-                            unsafe_allow_html=True,
-                        )
-                st.markdown("---")
+            st.markdown("---")
 
     st.markdown(
         """
@@ -0,0 +1,199 @@
+"""
+バックグラウンド処理
+
+Streamlit のスクリプト実行 (rerun) をブロックしないよう、
+時間のかかる取得処理をワーカースレッドに逃がすための部品。
+"""
+
+import datetime
+import itertools
+import queue
+import threading
+import time
+from typing import NamedTuple
+
+JOB_WORKERS = 2  # 同時に実行する通常のジョブ数 (全セッション合計)
+LONG_JOB_WORKERS = 1  # 長時間のジョブ専用の枠 (通常のジョブの枠は使わない)
+JOB_RETENTION = 3600  # 終了後に結果が受け取られなかったジョブを保持する秒数
+
+
+def jst_now():
+    return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=9)
+
+
+class StaleWhileRevalidate:
+    """
+    最後に取得できた値を即座に返し、期限切れなら裏で更新を1本だけ走らせる。
+    更新に失敗した場合は古い値を保持し、retry_interval 秒後に再試行する。
+    """
+
+    def __init__(self, loader, ttl, default=None, retry_interval=60, name=None):
+        self.loader = loader
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.name = name or getattr(loader, "__name__", "refresh")
+        self.value = default
+        self.updated_at = None  # 最後に取得に成功した時刻 (JST)
+        self._fresh_until = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        """(値, 取得時刻) を返す。取得時刻が None なら初回取得中 (値は既定値)"""
+        with self._lock:
+            if not self._refreshing and time.monotonic() >= self._fresh_until:
+                self._refreshing = True
+                threading.Thread(
+                    target=self._refresh, name=f"swr-{self.name}", daemon=True
+                ).start()
+            return self.value, self.updated_at
+
+    @property
+    def is_refreshing(self):
+        return self._refreshing
+
+    def _refresh(self):
+        try:
+            value = self.loader()
+        except Exception:
+            value = None
+        with self._lock:
+            if value is not None:
+                self.value = value
+                self.updated_at = jst_now()
+                self._fresh_until = time.monotonic() + self.ttl
+            else:
+                self._fresh_until = time.monotonic() + self.retry_interval
+            self._refreshing = False
+
+
+class BatchResult(NamedTuple):
+    """ジョブが完了分として渡す1まとまり (start / end は入力リスト全体での位置)"""
+
+    number: int
+    start: int
+    end: int
+    value: object
+
+
+class Job:
+    """
+    JobRunner で実行する処理の共通部分。サブクラスは _run() を実装し、
+    完了分ができるたびに _emit() で渡す。全件終えたら True を返す。
+    cancel() 後は処理中の分を終えたところで止め、その結果も受け取れる。
+    画面側は snapshot() で進捗を読み、take_results() で完了分を受け取る。
+    """
+
+    def __init__(self):
+        self.job_id = None
+        self.state = "queued"  # queued / running / done / cancelled / failed
+        self.error = None
+        self.finished_at = None
+        self._results = []
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def is_active(self):
+        return self.state in ("queued", "running")
+
+    @property
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "error": self.error}
+
+    def take_results(self):
+        """前回から完了した分の結果を取り出す"""
+        with self._lock:
+            results, self._results = self._results, []
+        return results
+
+    def _emit(self, result):
+        with self._lock:
+            self._results.append(result)
+
+    def _set_state(self, state):
+        with self._lock:
+            self.state = state
+            if state not in ("queued", "running"):
+                self.finished_at = time.monotonic()
+
+    def _run(self):
+        raise NotImplementedError
+
+    def run(self):
+        try:
+            self._set_state("running")
+            done = self._run()
+        except Exception as e:
+            self.error = str(e)
+            self._set_state("failed")
+            return
+        self._set_state("done" if done else "cancelled")
+
+
+class JobRunner:
+    """
+    Job をキューに積み、max_workers 本のワーカースレッドで順に実行する。
+    全銘柄スキャンのような長時間のジョブは long_running=True で投入すると
+    long_workers 本の別のワーカーで実行し、通常のジョブの順番待ちを塞がない。
+    スクリプト実行 (rerun) はジョブを投入して進捗を読むだけで、待機も処理もしない。
+    """
+
+    def __init__(
+        self, max_workers=JOB_WORKERS, long_workers=LONG_JOB_WORKERS, name="jobs"
+    ):
+        self._queues = {False: queue.Queue(), True: queue.Queue()}
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        for long_running, workers, prefix in (
+            (False, max_workers, name),
+            (True, long_workers, f"{name}-long"),
+        ):
+            for i in range(workers):
+                threading.Thread(
+                    target=self._worker,
+                    args=(self._queues[long_running],),
+                    name=f"{prefix}-{i}",
+                    daemon=True,
+                ).start()
+
+    def submit(self, job, long_running=False):
+        with self._lock:
+            self._prune()
+            job.job_id = next(self._ids)
+            self._jobs[job.job_id] = job
+        self._queues[long_running].put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def discard(self, job_id):
+        """結果を受け取り終えたジョブを忘れる (実行中なら中止する)"""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            job.cancel()
+
+    def _prune(self):
+        limit = time.monotonic() - JOB_RETENTION
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and job.finished_at < limit:
+                del self._jobs[job_id]
+
+    def _worker(self, jobs):
+        while True:
+            job = jobs.get()
+            if job.is_cancelled:
+                job._set_state("cancelled")
+                continue
+            job.run()
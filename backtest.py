@@ -0,0 +1,172 @@
+"""
+バックテスト (配列版)
+
+build_features の指標列を NumPy 配列として読み、全日のエントリー判定と
+保有期間中の高値・安値 (先読み窓) を一括で求める。
+行ごとの iloc や Series の生成を行わないため、数年分の日足でもそのまま回せる。
+
+売買ルール (従来の run_backtest_precise と同じ):
+- 5日線押し目: 前日が 5日線>25日線 かつ 前日安値が5日線+0.5%以内、当日は
+  1%超のギャップダウンでなく、陽線か前日高値を更新 → 前日の5日線で買い、
+  目標 +target_pct / 損切り -stop_pct (既定 3%)
+- 青天井: 当日高値が250日高値以上、かつ出来高が5日平均の1.5倍以上 → 終値で買い、
+  ATR×atr_mult (既定 2.5) の損切りに保有期間中一度も掛からなければ勝ち
+- 決済後は翌々日から次のシグナルを探す
+"""
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_LOOKBACK = 75  # 検証する直近の日数 (None で全期間)
+DEFAULT_HOLD_DAYS = 10  # 最大保有日数
+DEFAULT_STOP_PCT = 0.03  # 5日線押し目の損切り幅
+DEFAULT_ATR_MULT = 2.5  # 青天井の損切り幅 (ATR の倍数)
+
+TRADE_COLUMNS = ["date", "kind", "entry", "hold_days", "win", "drawdown_pct"]
+
+
+def _column(df, name):
+    if name not in df.columns:
+        return np.zeros(len(df))
+    return df[name].to_numpy(dtype=np.float64)
+
+
+def _forward_windows(values, hold_days):
+    """行 i に i+1 〜 i+hold_days 日目の値を並べた (n - hold_days, hold_days) の配列"""
+    return np.lib.stride_tricks.sliding_window_view(values[1:], hold_days)
+
+
+def entry_signals(features):
+    """
+    各日のエントリー判定を (5日線押し目, 青天井) の bool 配列で返す。
+    前日の安値・5日線・25日線が欠損/0 の日はどちらも False。
+    """
+    open_, high, low, close = (
+        _column(features, c) for c in ("Open", "High", "Low", "Close")
+    )
+    volume = _column(features, "Volume")
+    sma5, sma25 = _column(features, "SMA5"), _column(features, "SMA25")
+    high_250d, vol_sma5 = _column(features, "High_250d"), _column(features, "Vol_SMA5")
+
+    n = len(close)
+    is_ma5 = np.zeros(n, dtype=bool)
+    is_aoteng = np.zeros(n, dtype=bool)
+    if n < 2:
+        return is_ma5, is_aoteng
+
+    p_low, p_close, p_high = low[:-1], close[:-1], high[:-1]
+    p_sma5, p_sma25 = sma5[:-1], sma25[:-1]
+    with np.errstate(invalid="ignore"):
+        valid = (
+            ~np.isnan(p_low)
+            & ~np.isnan(p_sma5)
+            & ~np.isnan(p_sma25)
+            & (p_sma5 != 0)
+            & (p_sma25 != 0)
+        )
+        is_gap_down = open_[1:] < p_close * 0.99
+        is_ma5[1:] = (
+            valid
+            & (p_sma5 > p_sma25)
+            & (p_low <= p_sma5 * 1.005)
+            & ~is_gap_down
+            & ((close[1:] > open_[1:]) | (high[1:] >= p_high))
+        )
+        is_aoteng[1:] = (
+            valid
+            & (high[1:] >= high_250d[1:])
+            & (high_250d[1:] > 0)
+            & (volume[1:] >= vol_sma5[1:] * 1.5)
+        )
+    return is_ma5, is_aoteng
+
+
+def simulate_trades(
+    features,
+    target_pct,
+    lookback=DEFAULT_LOOKBACK,
+    hold_days=DEFAULT_HOLD_DAYS,
+    stop_pct=DEFAULT_STOP_PCT,
+    atr_mult=DEFAULT_ATR_MULT,
+):
+    """
+    直近 lookback 日 (None で全期間) を対象に売買をシミュレートし、
+    1トレード1行の DataFrame (TRADE_COLUMNS) を返す。
+    """
+    if lookback is not None:
+        features = features.tail(lookback)
+    n = len(features)
+    if n <= hold_days + 1:
+        return pd.DataFrame(columns=TRADE_COLUMNS)
+
+    is_ma5, is_aoteng = entry_signals(features)
+    high, low, close = (_column(features, c) for c in ("High", "Low", "Close"))
+    sma5, atr = _column(features, "SMA5"), _column(features, "ATR")
+
+    # エントリー価格 (5日線押し目は前日の5日線、青天井は当日終値)
+    entry = close.copy()
+    only_ma5 = is_ma5 & ~is_aoteng
+    entry[1:][only_ma5[1:]] = sma5[:-1][only_ma5[1:]]
+
+    # 先読み窓が収まる日だけが対象 (最初の日は前日が無いので除く)
+    signal = (is_ma5 | is_aoteng) & (entry != 0)
+    signal[0] = False
+    signal[n - hold_days :] = False
+    pos = np.flatnonzero(signal)
+    if len(pos) == 0:
+        return pd.DataFrame(columns=TRADE_COLUMNS)
+
+    aoteng = is_aoteng[pos]
+    e = entry[pos]
+    target = np.where(aoteng, e * 1.5, e * (1 + target_pct))
+    stop = np.where(aoteng, e - atr[pos] * atr_mult, e * (1 - stop_pct))
+
+    fwd_high = _forward_windows(high, hold_days)[pos]
+    fwd_low = _forward_windows(low, hold_days)[pos]
+    with np.errstate(invalid="ignore"):
+        hit_target = (fwd_high >= target[:, None]) & ~aoteng[:, None]
+        hit_stop = fwd_low <= stop[:, None]
+    exited = hit_target | hit_stop
+    has_exit = exited.any(axis=1)
+    exit_idx = np.where(has_exit, exited.argmax(axis=1), hold_days - 1)
+    held = exit_idx + 1
+
+    # 保有期間中の最安値 (欠損は無視、エントリー価格を起点とする)
+    rows = np.arange(len(pos))
+    min_low = np.fmin(e, np.fmin.accumulate(fwd_low, axis=1)[rows, exit_idx])
+
+    win = has_exit & hit_target[rows, exit_idx]
+    with np.errstate(invalid="ignore"):
+        win |= aoteng & (held == hold_days) & (min_low > stop)
+        drawdown = np.where(
+            (e > 0) & (min_low < e), (min_low / np.where(e > 0, e, 1) - 1) * 100, 0.0
+        )
+
+    # 保有中は次のシグナルを見ない (決済日の翌日も見送る)
+    taken = []
+    next_free = 0
+    for k, p in enumerate(pos):
+        if p >= next_free:
+            taken.append(k)
+            next_free = p + max(1, held[k]) + 1
+    taken = np.asarray(taken, dtype=int)
+
+    return pd.DataFrame(
+        {
+            "date": features.index[pos[taken]],
+            "kind": np.where(aoteng[taken], "aoteng", "ma5"),
+            "entry": e[taken],
+            "hold_days": held[taken],
+            "win": win[taken],
+            "drawdown_pct": drawdown[taken],
+        },
+        columns=TRADE_COLUMNS,
+    )
+
+
+def summarize_trades(trades):
+    """(勝ち数, 負け数, 最大含み損率%) を返す"""
+    if trades.empty:
+        return 0, 0, 0.0
+    wins = int(trades["win"].sum())
+    return wins, len(trades) - wins, float(min(0.0, trades["drawdown_pct"].min()))
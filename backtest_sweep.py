@@ -0,0 +1,365 @@
+"""
+バックテストのパラメータ検証 (グリッド・ウォークフォワード)
+
+ローカルの日足ストアに保存済みの銘柄すべてについて、売買ルールの定数
+(検証日数・保有日数・損切り幅・ATR倍率・利確目標) の組み合わせごとに
+backtest.simulate_trades を回し、勝率・取引数・最大含み損率を集計する。
+銘柄はまとめてプロセスプールに配り、指標の計算は銘柄ごとに1回だけ行う。
+
+ウォークフォワードでは期間を等分したブロックを順にずらし、
+学習期間 (train) と検証期間 (test) それぞれの成績を出す。
+worst_trade_dd_pct は1トレードの保有中の含み損率の最悪値で、
+資産曲線のドローダウンではない。
+
+分析時に保存される日足は直近 analysis.HISTORY_MONTHS か月分だけなので、
+長い期間で検証する場合は --history-years で先に取り直す。学習・検証の各期間が
+検証日数 + 保有日数 (営業日) に満たない分け方はエラーにする。
+"""
+
+import argparse
+import itertools
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from backtest import (
+    DEFAULT_ATR_MULT,
+    DEFAULT_HOLD_DAYS,
+    DEFAULT_LOOKBACK,
+    DEFAULT_STOP_PCT,
+    simulate_trades,
+)
+from analysis import backfill_yahoo_history
+from indicators import build_features
+from scoring import get_market_cap_category, get_target_pct_new
+from storage import get_bar_store
+
+SWEEP_CHUNK = 50  # 1タスクで処理する銘柄数
+MIN_HISTORY = 80  # これより日足の少ない銘柄は対象外 (run_backtest_precise と同じ)
+
+REPORT_COLUMNS = [
+    "lookback",
+    "hold_days",
+    "stop_pct",
+    "atr_mult",
+    "target_pct",
+    "split",
+    "segment",
+    "trades",
+    "wins",
+    "losses",
+    "win_rate_pct",
+    "worst_trade_dd_pct",
+]
+
+
+class BacktestParams(NamedTuple):
+    """1通りの売買ルールの定数 (target_pct=None は時価総額区分の既定値)"""
+
+    lookback: object = DEFAULT_LOOKBACK
+    hold_days: int = DEFAULT_HOLD_DAYS
+    stop_pct: float = DEFAULT_STOP_PCT
+    atr_mult: float = DEFAULT_ATR_MULT
+    target_pct: object = None
+
+
+class Split(NamedTuple):
+    """ウォークフォワードの1区切り (学習は test_start まで、検証は test_end まで)"""
+
+    name: str
+    train_start: pd.Timestamp
+    test_start: pd.Timestamp
+    test_end: pd.Timestamp
+
+
+def param_grid(**axes):
+    """
+    BacktestParams の各項目の候補 (リスト) から全組み合わせを作る。
+    指定しない項目は既定値。例: param_grid(hold_days=[5, 10], stop_pct=[0.02, 0.03])
+    """
+    names = list(BacktestParams._fields)
+    unknown = set(axes) - set(names)
+    if unknown:
+        raise ValueError(f"未対応のパラメータ: {', '.join(sorted(unknown))}")
+    values = [axes.get(name, [BacktestParams._field_defaults[name]]) for name in names]
+    return [BacktestParams(*combo) for combo in itertools.product(*values)]
+
+
+def walk_forward_splits(start, end, n_splits, train_blocks=1):
+    """
+    [start, end) を n_splits + train_blocks 個の等しいブロックに分け、
+    train_blocks 個分を学習、続く1個を検証として1ブロックずつずらす。
+    """
+    edges = pd.date_range(
+        pd.Timestamp(start), pd.Timestamp(end), periods=n_splits + train_blocks + 1
+    ).normalize()
+    return [
+        Split(
+            f"wf{k + 1:02d}",
+            edges[k],
+            edges[k + train_blocks],
+            edges[k + train_blocks + 1],
+        )
+        for k in range(n_splits)
+    ]
+
+
+def short_segments(splits, min_bars):
+    """学習・検証期間のうち営業日が min_bars に満たないものを (split, segment, 日数) で返す"""
+    short = []
+    for split in splits:
+        for segment, start, end in (
+            ("train", split.train_start, split.test_start),
+            ("test", split.test_start, split.test_end),
+        ):
+            days = int(np.busday_count(start.date(), end.date()))
+            if days < min_bars:
+                short.append((split.name, segment, days))
+    return short
+
+
+def _period_features(features, start, end, hold_days):
+    """
+    エントリー日が [start, end) に入る行と、その後の決済判定に使う hold_days 行を切り出す。
+    (simulate_trades は末尾 hold_days 行ではエントリーしない)
+    """
+    dates = features.index
+    lo = dates.searchsorted(start)
+    hi = dates.searchsorted(end)
+    return features.iloc[lo : min(len(features), hi + hold_days)]
+
+
+def _segments(features, params, splits):
+    """(split 名, segment 名, 対象の日足) を列挙する。splits が無ければ直近 lookback 日"""
+    if not splits:
+        frame = features if params.lookback is None else features.tail(params.lookback)
+        yield "all", "all", frame
+        return
+    for split in splits:
+        for segment, start, end in (
+            ("train", split.train_start, split.test_start),
+            ("test", split.test_start, split.test_end),
+        ):
+            yield split.name, segment, _period_features(
+                features, start, end, params.hold_days
+            )
+
+
+def _sweep_codes(codes, caps, grid, splits):
+    """
+    プロセスプールの1タスク。銘柄ごとに日足を読み込んで指標を作り、
+    {(パラメータ番号, split, segment): [wins, losses, 最悪の含み損率]} を返す。
+    """
+    store = get_bar_store()
+    totals = {}
+    for code in codes:
+        df = store.load(code)
+        if len(df) < MIN_HISTORY:
+            continue
+        features = build_features(df)
+        category = get_market_cap_category(caps.get(code, 0))
+        default_target = get_target_pct_new(category, is_half=False)
+        for i, params in enumerate(grid):
+            target_pct = (
+                default_target if params.target_pct is None else params.target_pct
+            )
+            for split, segment, frame in _segments(features, params, splits):
+                trades = simulate_trades(
+                    frame,
+                    target_pct,
+                    lookback=None,
+                    hold_days=params.hold_days,
+                    stop_pct=params.stop_pct,
+                    atr_mult=params.atr_mult,
+                )
+                total = totals.setdefault((i, split, segment), [0, 0, 0.0])
+                if trades.empty:
+                    continue
+                wins = int(trades["win"].sum())
+                total[0] += wins
+                total[1] += len(trades) - wins
+                total[2] = min(total[2], float(trades["drawdown_pct"].min()))
+    return totals
+
+
+def run_sweep(grid, codes=None, caps=None, splits=None, max_workers=None):
+    """
+    grid (BacktestParams のリスト) を codes (省略時はストアの全銘柄) で検証し、
+    パラメータ・split・segment ごとの成績を REPORT_COLUMNS の DataFrame で返す。
+    caps は {コード: 時価総額(億円)} (利確目標の区分に使う)。省略時はストアに
+    保存済みの値 (分析時に記録したもの) を使い、それも無い銘柄は超小型扱い。
+    """
+    grid = list(grid)
+    store = get_bar_store()
+    codes = list(store.codes() if codes is None else codes)
+    caps = dict(store.load_caps() if caps is None else caps)
+    chunks = [codes[i : i + SWEEP_CHUNK] for i in range(0, len(codes), SWEEP_CHUNK)]
+
+    totals = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                _sweep_codes,
+                chunk,
+                {c: caps[c] for c in chunk if c in caps},
+                grid,
+                splits,
+            )
+            for chunk in chunks
+        ]
+        for future in futures:
+            for key, (wins, losses, dd) in future.result().items():
+                total = totals.setdefault(key, [0, 0, 0.0])
+                total[0] += wins
+                total[1] += losses
+                total[2] = min(total[2], dd)
+
+    rows = []
+    for (i, split, segment), (wins, losses, dd) in sorted(totals.items()):
+        params = grid[i]
+        trades = wins + losses
+        rows.append(
+            {
+                **params._asdict(),
+                "split": split,
+                "segment": segment,
+                "trades": trades,
+                "wins": wins,
+                "losses": losses,
+                "win_rate_pct": wins / trades * 100 if trades else np.nan,
+                "worst_trade_dd_pct": dd,
+            }
+        )
+    return pd.DataFrame(rows, columns=REPORT_COLUMNS)
+
+
+def best_by_split(report, min_trades=30):
+    """
+    ウォークフォワードの結果から、split ごとに学習期間の勝率が最も高い
+    パラメータ (取引数 min_trades 以上) を選び、その検証期間の成績を並べる。
+    """
+    keys = ["hold_days", "stop_pct", "atr_mult", "target_pct"]
+    train = report[(report["segment"] == "train") & (report["trades"] >= min_trades)]
+    test = report[report["segment"] == "test"]
+    if train.empty:
+        return pd.DataFrame()
+    best = train.loc[train.groupby("split")["win_rate_pct"].idxmax()]
+    merged = best.merge(
+        test, on=["split"] + keys, how="left", suffixes=("_train", "_test")
+    )
+    columns = ["split"] + keys
+    for metric in ("trades", "win_rate_pct", "worst_trade_dd_pct"):
+        columns += [f"{metric}_train", f"{metric}_test"]
+    return merged[columns].reset_index(drop=True)
+
+
+def read_caps(path):
+    """時価総額のファイル (CSV: コード, 億円。見出し行は無視) を {コード: 億円} で読む"""
+    caps = {}
+    with open(path, encoding="utf-8-sig") as f:
+        for line in f:
+            fields = [v.strip().strip('"') for v in line.split(",")]
+            if len(fields) < 2:
+                continue
+            try:
+                caps[fields[0].upper()] = float(fields[1])
+            except ValueError:
+                continue
+    return caps
+
+
+def _floats(text):
+    return [float(v) for v in text.split(",")]
+
+
+def _ints(text):
+    return [int(v) for v in text.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="保存済みの日足で売買ルールの定数を総当たり検証する"
+    )
+    parser.add_argument("--lookback", type=_ints, default=[DEFAULT_LOOKBACK])
+    parser.add_argument("--hold-days", type=_ints, default=[DEFAULT_HOLD_DAYS])
+    parser.add_argument("--stop-pct", type=_floats, default=[DEFAULT_STOP_PCT])
+    parser.add_argument("--atr-mult", type=_floats, default=[DEFAULT_ATR_MULT])
+    parser.add_argument(
+        "--target-pct", type=_floats, default=None, help="省略時は時価総額区分の既定値"
+    )
+    parser.add_argument("--codes", default=None, help="カンマ区切り (省略時は全銘柄)")
+    parser.add_argument(
+        "--caps", default=None, help="時価総額の CSV (省略時はストアの保存値)"
+    )
+    parser.add_argument(
+        "--walk-forward", type=int, default=0, help="ウォークフォワードの区切り数"
+    )
+    parser.add_argument("--train-blocks", type=int, default=2)
+    parser.add_argument(
+        "--history-years",
+        type=float,
+        default=None,
+        help="検証前に直近この年数分の日足を Yahoo から取り直す",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default=None, help="結果の CSV (省略時は標準出力)")
+    args = parser.parse_args(argv)
+
+    # ウォークフォワードでは期間を split で決めるので lookback は使わない
+    grid = param_grid(
+        lookback=[None] if args.walk_forward else args.lookback,
+        hold_days=args.hold_days,
+        stop_pct=args.stop_pct,
+        atr_mult=args.atr_mult,
+        target_pct=args.target_pct or [None],
+    )
+    codes = args.codes.split(",") if args.codes else None
+    if args.history_years:
+        months = max(1, round(args.history_years * 12))
+        targets = codes or get_bar_store().codes()
+        fetched = backfill_yahoo_history(targets, months=months)
+        print(
+            f"{len(fetched)}/{len(targets)} 銘柄の日足を {months} か月分取り直しました",
+            file=sys.stderr,
+        )
+    caps = read_caps(args.caps) if args.caps else get_bar_store().load_caps()
+    if args.target_pct is None:
+        unknown = len(set(codes or get_bar_store().codes()) - set(caps))
+        if unknown:
+            print(
+                f"時価総額が不明な {unknown} 銘柄は超小型の利確目標で検証します",
+                file=sys.stderr,
+            )
+    splits = None
+    if args.walk_forward:
+        first, last = get_bar_store().date_range(codes)
+        splits = walk_forward_splits(
+            first, last + pd.Timedelta(days=1), args.walk_forward, args.train_blocks
+        )
+        # 期間が短いと取引数が少なく、勝率・含み損率が当てにならない
+        min_bars = DEFAULT_LOOKBACK + max(args.hold_days)
+        short = short_segments(splits, min_bars)
+        if short:
+            detail = ", ".join(
+                f"{name}/{segment}={days}日" for name, segment, days in short
+            )
+            parser.error(
+                f"営業日が {min_bars} 日に満たない期間があります ({detail})。"
+                "--history-years で日足を取り直すか、--walk-forward を減らしてください"
+            )
+    report = run_sweep(
+        grid, codes=codes, caps=caps, splits=splits, max_workers=args.workers
+    )
+    if args.out:
+        report.to_csv(args.out, index=False)
+    else:
+        print(report.to_string(index=False))
+        if splits:
+            print(best_by_split(report).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
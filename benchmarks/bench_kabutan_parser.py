@@ -0,0 +1,154 @@
+"""
+株探ページ解析のベンチマーク
+
+benchmarks/fixtures/kabutan/ の保存済みHTMLを解析し、
+期待値 (同名の .json) との一致を確認したうえで毎秒の処理ページ数を表示する。
+- fixtures/kabutan/*.html: --capture で保存した実際の株探のページ
+- fixtures/kabutan/synthetic/: ページ構造を模して手で作ったページ
+  (解析の境界条件用。実ページの変化による退行は検出できない)
+
+    python benchmarks/bench_kabutan_parser.py [--iterations 500]
+    python benchmarks/bench_kabutan_parser.py --capture 7203 3350
+
+--capture は個別ページ・時系列ページを取得して保存し、現在の解析結果を
+期待値として書き出す。書き出した .json は目で確認してからコミットすること。
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from http_client import fetch_with_retry  # noqa: E402
+from kabutan_parser import parse_kabuka_page, parse_stock_page  # noqa: E402
+
+FIXTURE_DIR = os.path.join(ROOT, "benchmarks", "fixtures", "kabutan")
+SYNTHETIC_DIR = os.path.join(FIXTURE_DIR, "synthetic")
+
+# ページ種別ごとの取得先 (--capture 用)
+PAGE_URLS = {
+    "stock": "https://kabutan.jp/stock/?code={code}",
+    "kabuka": "https://kabutan.jp/stock/kabuka?code={code}&ashi=day",
+}
+
+
+def parse_kabuka_summary(html):
+    """時系列ページの解析結果を期待値と比較できる辞書にする"""
+    earnings_date, history = parse_kabuka_page(html)
+    return {
+        "earnings_date": earnings_date,
+        "rows": len(history),
+        "first": history.reset_index().iloc[0].astype(str).tolist() if len(history) else None,
+        "last": history.reset_index().iloc[-1].astype(str).tolist() if len(history) else None,
+        "volume_sum": float(history["Volume"].sum()) if len(history) else 0.0,
+    }
+
+
+# ページ種別ごとの解析関数 (ファイル名の接頭辞で選ぶ)
+PARSERS = {
+    "stock": parse_stock_page,
+    "kabuka": parse_kabuka_summary,
+}
+
+
+def to_jsonable(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def to_expected(actual):
+    if isinstance(actual, dict):
+        return {k: to_jsonable(v) for k, v in actual.items()}
+    return actual
+
+
+def capture(codes):
+    """実際のページを取得してフィクスチャと期待値 (現在の解析結果) を保存する"""
+    for code in codes:
+        for kind, url in PAGE_URLS.items():
+            res = fetch_with_retry(url.format(code=code))
+            res.encoding = res.apparent_encoding
+            base = os.path.join(FIXTURE_DIR, f"{kind}_{code}")
+            with open(base + ".html", "w", encoding="utf-8") as f:
+                f.write(res.text)
+            expected = to_expected(PARSERS[kind](res.text))
+            with open(base + ".json", "w", encoding="utf-8") as f:
+                json.dump(expected, f, ensure_ascii=False, indent=2)
+                f.write("\n")
+            print(f"保存しました: {base}.html")
+
+
+def load_fixtures():
+    fixtures = []
+    paths = sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.html")))
+    paths += sorted(glob.glob(os.path.join(SYNTHETIC_DIR, "*.html")))
+    for path in paths:
+        name = os.path.relpath(os.path.splitext(path)[0], FIXTURE_DIR)
+        kind = os.path.basename(name).split("_", 1)[0]
+        if kind not in PARSERS:
+            continue
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        expected = None
+        json_path = os.path.splitext(path)[0] + ".json"
+        if os.path.exists(json_path):
+            with open(json_path, encoding="utf-8") as f:
+                expected = json.load(f)
+        fixtures.append((name, PARSERS[kind], html, expected))
+    return fixtures
+
+
+def check(name, parser, html, expected):
+    if expected is None:
+        return True
+    actual = to_expected(parser(html))
+    if actual != expected:
+        print(f"NG  {name}")
+        for key in sorted(set(actual) | set(expected)):
+            if actual.get(key) != expected.get(key):
+                print(f"    {key}: expected={expected.get(key)!r} actual={actual.get(key)!r}")
+        return False
+    return True
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--iterations", type=int, default=500)
+    ap.add_argument("--capture", nargs="+", metavar="CODE", help="実ページを保存する")
+    args = ap.parse_args()
+
+    if args.capture:
+        capture(args.capture)
+        return 0
+
+    fixtures = load_fixtures()
+    if not fixtures:
+        print(f"フィクスチャがありません: {FIXTURE_DIR}")
+        return 1
+    if all(name.startswith("synthetic") for name, *_ in fixtures):
+        print("実ページのフィクスチャがありません (--capture で保存してください)")
+
+    ok = all([check(name, p, html, exp) for name, p, html, exp in fixtures])
+
+    total_pages, total_sec = 0, 0.0
+    for name, parser, html, _ in fixtures:
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            parser(html)
+        elapsed = time.perf_counter() - start
+        total_pages += args.iterations
+        total_sec += elapsed
+        kb = len(html.encode("utf-8")) / 1024
+        print(f"{name:<28} {kb:7.1f} KB  {args.iterations / elapsed:9.0f} pages/s")
+    print(f"{'合計':<26} {'':>10}  {total_pages / total_sec:9.0f} pages/s")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
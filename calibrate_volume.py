@@ -0,0 +1,59 @@
+"""
+場中の出来高進捗の校正 (Streamlit なし)
+
+銘柄リストの直近の1分足の出来高を Yahoo から取得して日足ストアに保存し、
+保存済みの1分足から時価総額区分ごとの累積出来高比率 (volume_profile) を推定して保存する。
+Yahoo の1分足は直近7日分しか取れないため、引け後に cron で毎日回す用途を想定している。
+時価総額は分析時に保存した値を使い、未保存の銘柄だけ株探から取得する。
+校正結果はアプリ・score_universe.py の次回起動時から使われる。
+
+例: python calibrate_volume.py universe.txt
+"""
+
+import argparse
+import sys
+
+import pandas as pd
+
+from analysis import collect_intraday_volume, get_kabutan_info
+from score_universe import read_universe
+from storage import get_bar_store
+from volume_profile import CAP_BUCKETS, calibrate_from_store
+
+CALIBRATION_DAYS = 60  # 校正に使う1分足の期間 (日数)。これより古い分は消す
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="場中の出来高進捗を校正する")
+    parser.add_argument("universe", nargs="?", help="銘柄コードのファイル (1行1銘柄 / CSV)")
+    parser.add_argument(
+        "--no-fetch", action="store_true", help="取得せず保存済みの1分足だけで校正する"
+    )
+    args = parser.parse_args(argv)
+
+    store = get_bar_store()
+    if not args.no_fetch:
+        if not args.universe:
+            parser.error("銘柄コードのファイルを指定してください (--no-fetch 以外)")
+        codes = read_universe(args.universe)
+        saved = collect_intraday_volume(codes)
+        print(f"{saved}/{len(codes)} 銘柄の1分足を保存しました", file=sys.stderr)
+
+    start = pd.Timestamp.now().normalize() - pd.Timedelta(days=CALIBRATION_DAYS)
+    store.delete_intraday(start)
+
+    caps = store.load_caps()
+    missing = sorted(set(store.intraday_codes(start)) - set(caps))
+    if missing:
+        caps.update({code: get_kabutan_info(code).get("cap", 0) for code in missing})
+        store.save_caps({code: caps[code] for code in missing})
+
+    profile = calibrate_from_store(store, caps, start=start)
+    for bucket in CAP_BUCKETS:
+        state = "校正済み" if bucket in profile.calibrated else "既定の折れ線"
+        print(f"{bucket:<6} {state}", file=sys.stderr)
+    return 0 if profile.calibrated else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+スキャンのチェックポイント (SQLite)
+
+銘柄ごとの分析結果を、1銘柄終わるたびに CACHE_DIR の scans.sqlite3 に書き込む。
+入力 (銘柄リスト) のハッシュと実行者 (owner) をキーにし、同じ実行者が同じ入力で
+スキャンをやり直すと保存済みの銘柄は取得し直さずに結果を読み戻す。
+ブラウザの再読み込み・サーバーの再起動・途中の例外で止まっても、
+次の実行は続きから始まる。
+- 実行者が違えば同じ入力でも途中経過は共有しない (他の実行の finish() で消えない)
+- 最後まで終えたスキャンは完了扱いにし、同じ入力でも次は最初から取得する
+- 市場フェーズ (analysis.market_phase_id) が変わった場合も最初から取得する
+- 場中 ("live:" のフェーズ) は LIVE_RECORD_MAX_AGE 秒より前に保存した銘柄を取得し直す
+- 取得に失敗した銘柄は保存しない (再開時に取得し直す)
+"""
+
+import datetime
+import hashlib
+import pickle
+import time
+from contextlib import closing
+
+from storage import connect
+
+SCANS_DB = "scans.sqlite3"
+CHECKPOINT_RETENTION_DAYS = 7  # 更新の無いスキャンを残す日数
+LIVE_RECORD_MAX_AGE = 600  # 場中に保存した結果を読み戻す期限 (秒)
+
+
+def input_hash(tickers):
+    """銘柄リスト (順序を含む) のハッシュ"""
+    return hashlib.sha256(",".join(tickers).encode()).hexdigest()
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+
+
+class ScanCheckpoint:
+    """1つの実行者・入力 (銘柄リスト) に対応するスキャンの途中経過"""
+
+    def __init__(self, tickers, phase, owner, db_name=SCANS_DB):
+        self.tickers = list(tickers)
+        self.key = input_hash(self.tickers)
+        self.phase = phase
+        self.owner = owner
+        self.db_name = db_name
+        with closing(connect(self.db_name)) as conn, conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(scan_runs)")]
+            if columns and "owner" not in columns:
+                # 実行者を持たない以前の版のテーブル (途中経過は捨てる)
+                conn.execute("DROP TABLE scan_runs")
+                conn.execute("DROP TABLE IF EXISTS scan_results")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS scan_runs (
+                    input_hash TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    phase TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (input_hash, owner)
+                ) WITHOUT ROWID
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS scan_results (
+                    input_hash TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    code TEXT NOT NULL,
+                    record BLOB NOT NULL,
+                    saved_at REAL NOT NULL,
+                    PRIMARY KEY (input_hash, owner, idx)
+                ) WITHOUT ROWID
+                """
+            )
+            self._prune(conn)
+            row = conn.execute(
+                "SELECT phase, status FROM scan_runs "
+                "WHERE input_hash = ? AND owner = ?",
+                (self.key, self.owner),
+            ).fetchone()
+            if row is None or row != (self.phase, "running"):
+                conn.execute(
+                    "DELETE FROM scan_results WHERE input_hash = ? AND owner = ?",
+                    (self.key, self.owner),
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO scan_runs "
+                    "(input_hash, owner, phase, total, status, updated_at) "
+                    "VALUES (?, ?, ?, ?, 'running', ?)",
+                    (self.key, self.owner, self.phase, len(self.tickers), _now()),
+                )
+
+    def _prune(self, conn):
+        limit = (
+            datetime.datetime.now(datetime.timezone.utc)
+            - datetime.timedelta(days=CHECKPOINT_RETENTION_DAYS)
+        ).isoformat(timespec="seconds")
+        stale = conn.execute(
+            "SELECT input_hash, owner FROM scan_runs WHERE updated_at < ?", (limit,)
+        ).fetchall()
+        for key in stale:
+            conn.execute(
+                "DELETE FROM scan_results WHERE input_hash = ? AND owner = ?", key
+            )
+            conn.execute(
+                "DELETE FROM scan_runs WHERE input_hash = ? AND owner = ?", key
+            )
+
+    def load(self):
+        """保存済みの結果を {入力リスト上の位置: AnalysisRecord} で返す"""
+        sql = (
+            "SELECT idx, code, record FROM scan_results "
+            "WHERE input_hash = ? AND owner = ?"
+        )
+        params = [self.key, self.owner]
+        if self.phase.startswith("live:"):
+            # 場中は値が動くため、古い結果は読み戻さずに取得し直す
+            sql += " AND saved_at >= ?"
+            params.append(time.time() - LIVE_RECORD_MAX_AGE)
+        with closing(connect(self.db_name)) as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return {
+            idx: pickle.loads(blob)
+            for idx, code, blob in rows
+            if idx < len(self.tickers) and self.tickers[idx] == code
+        }
+
+    def save(self, records):
+        """[(入力リスト上の位置, AnalysisRecord), ...] を保存する (同じ位置は上書き)"""
+        saved_at = time.time()
+        rows = [
+            (self.key, self.owner, idx, record.code, pickle.dumps(record), saved_at)
+            for idx, record in records
+        ]
+        if not rows:
+            return
+        with closing(connect(self.db_name)) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO scan_results "
+                "(input_hash, owner, idx, code, record, saved_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute(
+                "UPDATE scan_runs SET updated_at = ? "
+                "WHERE input_hash = ? AND owner = ?",
+                (_now(), self.key, self.owner),
+            )
+
+    def finish(self):
+        """全銘柄を終えたスキャンを完了扱いにし、途中経過を消す"""
+        with closing(connect(self.db_name)) as conn, conn:
+            conn.execute(
+                "DELETE FROM scan_results WHERE input_hash = ? AND owner = ?",
+                (self.key, self.owner),
+            )
+            conn.execute(
+                "UPDATE scan_runs SET status = 'done', updated_at = ? "
+                "WHERE input_hash = ? AND owner = ?",
+                (_now(), self.key, self.owner),
+            )
@@ -0,0 +1,357 @@
+"""
+外部HTTPアクセスの共通クライアント
+
+- ホストごとに requests.Session を1つだけ保持し、コネクションプールを再利用する
+- ホストごとのトークンバケットで「間隔を空ける」処理を一か所に集約する
+  (呼び出し側で time.sleep を重ねない)
+
+Streamlit の再実行(rerun)ではスクリプト本体は毎回評価し直されるが、
+import されたモジュールは sys.modules に残るため、ここで保持した
+セッションとペーサーはプロセス内で共有される。
+
+環境変数 HTTP_ARCHIVE_MODE で外部アクセスの記録・再生を切り替えられる。
+- record: 実際に取得した応答を HTTP_ARCHIVE_DIR に保存する
+- replay: 保存済みの応答だけを返す (通信・待機なし、未記録なら ArchiveMiss)
+再生時は日足ストアの状態で取得範囲が変わらないよう、記録時と同じ
+STOCK_CACHE_DIR の複製を使うこと。
+"""
+
+import hashlib
+import os
+import pickle
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 指紋を散らすためのUser-Agentリスト (クライアント生成時に1つ選ぶ)
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
+]
+
+DEFAULT_HEADERS = {
+    "Accept": "text/csv,application/csv,text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+    "Accept-Language": "ja,en-US;q=0.9,en;q=0.8",
+    "Connection": "keep-alive",
+    "DNT": "1",
+    "Upgrade-Insecure-Requests": "1",
+}
+
+# ホスト別のリクエスト予算: (毎秒の補充トークン数, バースト上限, 同時接続数)
+# yfinance は自前のセッションで通信するため、論理ホスト名で順番待ちだけ行う。
+# yf.download はモジュール共有の状態を使うので同時実行数は1に制限する。
+# yf.download は銘柄ごとに1リクエストを送るので、トークンは銘柄数分消費する
+# (バースト上限は analysis.YF_CHUNK_SIZE の1回分)
+# Gemini (google-genai) も同様に論理ホスト名で枠を取る (無料枠の 30 回/分に合わせる)
+HOST_BUDGETS = {
+    "kabutan.jp": (0.5, 2, 2),
+    "nikkeiyosoku.com": (0.2, 1, 1),
+    "stooq.pl": (0.2, 1, 1),
+    "finance.yahoo.com": (1.0, 50, 1),
+    "generativelanguage.googleapis.com": (0.5, 1, 1),
+}
+DEFAULT_BUDGET = (0.5, 1, 1)
+
+REQUEST_TIMEOUT = 20
+POOL_MAXSIZE = 8
+
+ARCHIVE_MODE = os.environ.get("HTTP_ARCHIVE_MODE", "").strip().lower()
+ARCHIVE_DIR = os.environ.get(
+    "HTTP_ARCHIVE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "http_archive"),
+)
+
+
+class ArchiveMiss(LookupError):
+    """再生モードで、要求された応答が記録されていない"""
+
+
+def is_replay():
+    return ARCHIVE_MODE == "replay"
+
+
+def _archive_path(key):
+    digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+    return os.path.join(ARCHIVE_DIR, digest[:2], digest + ".pkl")
+
+
+def archived_call(key, fn):
+    """
+    外部アクセス fn() を記録・再生の対象にする。
+    key は要求を一意に表す値 (URL や引数のタプル)。通常モードでは fn() をそのまま返す。
+    """
+    if is_replay():
+        path = _archive_path(key)
+        if not os.path.exists(path):
+            raise ArchiveMiss(f"未記録の要求です: {key!r}")
+        with open(path, "rb") as f:
+            return pickle.load(f)["value"]
+
+    value = fn()
+    if ARCHIVE_MODE == "record":
+        path = _archive_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 書きかけのファイルを再生側に読ませないよう、一時ファイルから置き換える
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump({"key": repr(key), "value": value}, f)
+        os.replace(tmp, path)
+    return value
+
+
+_listeners = threading.local()
+
+
+@contextmanager
+def count_requests(callback):
+    """
+    この with の中 (同じスレッド) で実際に送るリクエストを callback(ホストキー, 件数) で知らせる。
+    キャッシュや他スレッドの取得結果で済んだ分、再生モードの分は数えない。
+    """
+    previous = getattr(_listeners, "callback", None)
+    _listeners.callback = callback
+    try:
+        yield
+    finally:
+        _listeners.callback = previous
+
+
+def host_key(url_or_host):
+    """URL またはホスト名から予算管理用のホストキーを求める (www. 等は無視)"""
+    host = urlsplit(url_or_host).hostname if "://" in url_or_host else url_or_host
+    host = (host or "").lower()
+    for key in HOST_BUDGETS:
+        if host == key or host.endswith("." + key):
+            return key
+    return host
+
+
+class TokenBucket:
+    """
+    スレッドセーフなトークンバケット。
+    トークン不足時は負債として予約し、ロック外で必要時間だけ待機する。
+    """
+
+    def __init__(self, rate, burst, jitter=0.2):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.jitter = jitter
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1.0):
+        """tokens 個のトークンを予約し、待つべき秒数を返す"""
+        with self._lock:
+            now = time.monotonic()
+            refill = (now - self._last) * self.rate
+            self._tokens = min(self.burst, self._tokens + refill)
+            self._last = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            wait = -self._tokens / self.rate
+        # 機械的な等間隔アクセスを避けるため、待ちが発生した時だけ揺らぎを加える
+        return wait * (1.0 + random.uniform(0, self.jitter))
+
+    def acquire(self, tokens=1.0):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class HostClient:
+    """1ホスト分のプール済みセッションとペーサー"""
+
+    def __init__(self, host, rate, burst, max_concurrent=1):
+        self.host = host
+        self.pacer = TokenBucket(rate, burst)
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(DEFAULT_HEADERS)
+        self.session.headers["User-Agent"] = random.choice(USER_AGENTS)
+        if host == "stooq.pl":
+            self.session.headers["Referer"] = "https://stooq.pl/q/d/"
+
+    @contextmanager
+    def _paced_slot(self, tokens):
+        with self.slots:
+            self.pacer.acquire(tokens)
+            callback = getattr(_listeners, "callback", None)
+            if callback is not None:
+                callback(self.host, tokens)
+            yield
+
+    def slot(self, tokens=1):
+        """
+        同時接続数の枠を確保してから順番待ちを行う (再生モードでは待たない)。
+        1回の処理で複数のリクエストを送る場合は tokens にその数を渡す。
+        """
+        return nullcontext() if is_replay() else self._paced_slot(tokens)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+
+        def send():
+            with self.slot():
+                return self.session.get(url, **kwargs)
+
+        return archived_call(("GET", url), send)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url_or_host):
+    """ホストごとに1つだけ生成される HostClient を返す"""
+    key = host_key(url_or_host)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                rate, burst, max_concurrent = HOST_BUDGETS.get(key, DEFAULT_BUDGET)
+                client = HostClient(key, rate, burst, max_concurrent)
+                _clients[key] = client
+    return client
+
+
+def host_slot(url_or_host, tokens=1):
+    """
+    自前で通信するライブラリ (yfinance 等) 向けに、ホストの枠と順番だけを確保する。
+    with host_slot("finance.yahoo.com", tokens=len(symbols)): yf.download(symbols)
+    """
+    return get_client(url_or_host).slot(tokens)
+
+
+def _backoff(attempt):
+    """失敗時の待機 (再生モードでは記録済みの応答を返すだけなので待たない)"""
+    if not is_replay():
+        time.sleep(5.0 * (attempt + 1) + random.uniform(0, 5.0))
+
+
+def fetch_with_retry(url, max_retry=3):
+    """
+    ホスト共通クライアント経由で GET する。
+    通常の間隔調整はペーサーに任せ、ここでは失敗時のバックオフだけを行う。
+    """
+    client = get_client(url)
+    for attempt in range(max_retry):
+        try:
+            res = client.get(url)
+
+            # 200 OK かつ 実体のある応答（100バイト以上）か確認
+            if res.status_code == 200 and len(res.content) > 100:
+                return res
+
+            # 0バイトや403なら、リトライ前にインターバルを置く
+            if attempt < max_retry - 1:
+                _backoff(attempt)
+                continue
+
+            res.raise_for_status()
+            return res
+        except ArchiveMiss:
+            raise
+        except Exception:
+            if attempt == max_retry - 1:
+                raise
+            _backoff(attempt)
+    raise Exception("サーバーがデータを返しませんでした（0バイト拒否）")
+
+
+PAGE_TTL = 300  # 取得済みページの既定の保持秒数
+PAGE_CACHE_MAX_ENTRIES = 2000  # 保持するページ数の上限
+
+
+class PageCache:
+    """
+    URL をキーにした TTL 付きキャッシュ。
+    同じ URL を複数スレッドが同時に要求した場合も、取得・解析は1回だけ行う。
+    件数が max_entries を超えたら期限切れの分を、それでも多ければ期限の近い順に捨てる。
+    """
+
+    def __init__(self, max_entries=PAGE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._key_locks = {}  # key -> [Lock, 待っているスレッド数]
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _key_lock(self, key):
+        """key ごとのロック。使うスレッドがいなくなったら辞書から外す"""
+        with self._lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[key]
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def _put(self, key, value, ttl):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (now + ttl, value)
+            if len(self._entries) <= self.max_entries:
+                return
+            for k in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                del self._entries[k]
+            excess = len(self._entries) - self.max_entries
+            if excess > 0:
+                oldest = sorted(self._entries, key=lambda k: self._entries[k][0])
+                for k in oldest[:excess]:
+                    del self._entries[k]
+
+    def get_or_load(self, key, loader, ttl=PAGE_TTL):
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._key_lock(key):
+            value = self.get(key)
+            if value is None:
+                value = loader()
+                self._put(key, value, ttl)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+page_cache = PageCache()
+
+
+def fetch_page(url, parse=None, ttl=PAGE_TTL):
+    """
+    URL のページを取得して (parse 指定時は解析結果を) TTL 付きでキャッシュする。
+    同一ページを複数の抽出処理で使う場合のダウンロードを1回にまとめる。
+    """
+
+    def load():
+        res = fetch_with_retry(url)
+        res.encoding = res.apparent_encoding
+        return parse(res.text) if parse else res.text
+
+    key = (url, parse.__name__ if parse else None)
+    return page_cache.get_or_load(key, load, ttl=ttl)
@@ -0,0 +1,571 @@
+"""
+テクニカル指標の計算
+
+build_features で1銘柄分の日足に必要な指標列をまとめて1回だけ計算し、
+スコアリング・売買シグナル・バックテストはその結果を読むだけにする。
+(各処理で rolling をやり直したり、DataFrame を複製したりしない)
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from pandas.api.indexers import BaseIndexer
+
+RSI_PERIOD = 14
+RCI_PERIOD = 26  # 株探の中期線に準拠
+ATR_PERIOD = 14
+BB_PERIOD = 20
+BB_SQUEEZE_LOOKBACK = 120
+HIGH_LOOKBACK = 250
+WEEKLY_PERIOD = 13
+
+FEATURE_COLUMNS = [
+    "SMA5",
+    "SMA25",
+    "SMA75",
+    "Vol_SMA3",
+    "Vol_SMA5",
+    "RSI",
+    "RCI",
+    "STD14",
+    "ATR",
+    "BB_Width",
+    "BB_Width_Min120",
+    "High_75d",
+    "High_250d",
+    "Weekly_SMA13",
+]
+
+
+RCI_CHUNK = 16384  # 一度に順位付けする窓の数 (作業配列のメモリ上限)
+
+
+def _average_ranks(windows):
+    """各窓 (行) 内の値の順位 (低い=1)。同値は平均順位"""
+    period = windows.shape[1]
+    idx = np.arange(period)
+    order = np.argsort(windows, axis=1, kind="stable")
+    ordered = np.take_along_axis(windows, order, axis=1)
+    # 並べ替え後に同値が続く区間の先頭・末尾の位置から平均順位を求める
+    is_head = np.ones(ordered.shape, dtype=bool)
+    is_head[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    is_tail = np.ones(ordered.shape, dtype=bool)
+    is_tail[:, :-1] = is_head[:, 1:]
+    head = np.maximum.accumulate(np.where(is_head, idx, 0), axis=1)
+    tail = np.minimum.accumulate(np.where(is_tail, idx, period - 1)[:, ::-1], axis=1)
+    ranks = np.empty(windows.shape)
+    np.put_along_axis(ranks, order, (head + tail[:, ::-1]) / 2.0 + 1, axis=1)
+    return ranks
+
+
+def rci_values(values, period=RCI_PERIOD):
+    """
+    終値の配列から各日時点の RCI を一括で求める (期間に満たない先頭と欠損を含む窓は NaN)。
+    窓は sliding_window_view で作り、窓ごとの価格順位は行単位のソートで求める。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    if len(values) < period:
+        return out
+
+    windows = np.lib.stride_tricks.sliding_window_view(values, period)
+    date_ranks = np.arange(1, period + 1)
+    for lo in range(0, len(windows), RCI_CHUNK):
+        chunk = windows[lo : lo + RCI_CHUNK]
+        # 日付の順位（1, 2, ..., period）と価格の順位の差で RCI 公式を適用
+        d = date_ranks - _average_ranks(chunk)
+        rci = (1 - (6 * (d**2).sum(axis=1)) / (period * (period**2 - 1))) * 100
+        rci[np.isnan(chunk).any(axis=1)] = np.nan
+        out[period - 1 + lo : period - 1 + lo + len(chunk)] = rci
+    return out
+
+
+def rci_series(series, period=RCI_PERIOD):
+    """各日時点の RCI を並べた列 (期間に満たない先頭は NaN)"""
+    series = series.sort_index(ascending=True)
+    return pd.Series(rci_values(series.to_numpy(), period), index=series.index)
+
+
+def calculate_rci(series, period=RCI_PERIOD):
+    """
+    RCI(26)を計算する関数
+    株探の中期線(26)に準拠した仕様です。直近1日分の値を返す (データ不足時は 0)。
+    """
+    if len(series) < period:
+        return 0
+    return rci_series(series.tail(period), period).iloc[-1]
+
+
+def calculate_rsi(series, period=RSI_PERIOD):
+    """
+    RSI(14)を計算する関数（列を返す修正版）
+    """
+    series = series.sort_index(ascending=True)
+    if len(series) <= period:
+        return pd.Series(50, index=series.index)  # データ不足時は50で埋めた列を返す
+
+    delta = series.diff()
+    gain = delta.where(delta > 0, 0).rolling(window=period).mean()
+    loss = -delta.where(delta < 0, 0).rolling(window=period).mean()
+
+    # ゼロ除算を避けて計算
+    rs = gain / loss
+    rsi = 100 - (100 / (1 + rs))
+
+    return rsi.fillna(50)  # 計算できない初期期間を50で埋める
+
+
+def week_ids(dates):
+    """
+    日付 (DatetimeIndex など) を週番号にする。土曜始まり・金曜締め (W-FRI) で、
+    1970-01-01 (木) 起点の日数から求める。
+    """
+    days = np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+    return (days + 5) // 7
+
+
+def weekly_sma_values(close, weeks, group_start, period=WEEKLY_PERIOD):
+    """
+    各日時点の週足終値の period 週平均 (当週は当日終値、過去の週はその週の最終日の終値)。
+    直前 period-1 週のどこかに取引の無い週があるか、履歴が足りなければ NaN。
+    """
+    close = np.asarray(close, dtype=np.float64)
+    n = len(close)
+    out = np.full(n, np.nan)
+    m = period - 1
+    if n == 0:
+        return out
+    is_week_last = np.ones(n, dtype=bool)
+    is_week_last[:-1] = (weeks[1:] != weeks[:-1]) | (
+        group_start[1:] != group_start[:-1]
+    )
+    week_rows = np.flatnonzero(is_week_last)
+    # 各日より前に締まった週の数 (当週の最終行は当日以降にある)
+    completed = np.cumsum(is_week_last) - is_week_last
+    oldest = completed - m  # 直前 m 週のうち最も古い週
+    ok = oldest >= 0
+    ok[ok] &= group_start[week_rows[oldest[ok]]] == group_start[ok]
+    ok[ok] &= weeks[ok] - weeks[week_rows[oldest[ok]]] == m
+    rows = np.flatnonzero(ok)
+    if len(rows):
+        prior = week_rows[oldest[rows][:, None] + np.arange(m)]
+        weekly = np.concatenate([close[prior], close[rows][:, None]], axis=1)
+        out[rows] = weekly.mean(axis=1)
+    return out
+
+
+class GroupWindow(BaseIndexer):
+    """
+    長さ window の後ろ向きの窓。ただし各行の銘柄の先頭行 (group_start) より前は含めない。
+    銘柄を縦に連結した配列に rolling をかけても、銘柄ごとに計算した場合と同じ値になる
+    (銘柄の先頭で窓の集計がリセットされる)。
+    """
+
+    def __init__(self, group_start, window):
+        super().__init__(window_size=window)
+        self.group_start = group_start
+
+    def get_window_bounds(
+        self, num_values=0, min_periods=None, center=None, closed=None, step=None
+    ):
+        end = np.arange(1, num_values + 1, dtype=np.int64)
+        start = np.maximum(end - self.window_size, self.group_start).astype(np.int64)
+        return start, end
+
+
+def _feature_columns(df, group_start):
+    """
+    日足 (銘柄ごとに日付昇順で連結済み) の指標列を dict で返す。
+    group_start は各行が属する銘柄の先頭行の位置。
+    """
+    n = len(df)
+    pos_in_group = np.arange(n) - group_start
+    is_first = pos_in_group == 0
+    group_len = np.bincount(group_start, minlength=n)[group_start]
+
+    def rolling(series, window, min_periods=None):
+        return series.rolling(
+            GroupWindow(group_start, window),
+            min_periods=window if min_periods is None else min_periods,
+        )
+
+    close, high, low, volume = df["Close"], df["High"], df["Low"], df["Volume"]
+    prev_close = close.shift(1).mask(is_first)
+
+    # RSI (calculate_rsi と同じ計算。データ不足の銘柄は全期間 50)
+    delta = close.diff().mask(is_first)
+    gain = rolling(delta.where(delta > 0, 0), RSI_PERIOD).mean()
+    loss = rolling(-delta.where(delta < 0, 0), RSI_PERIOD).mean()
+    rsi = (100 - (100 / (1 + gain / loss))).fillna(50)
+    rsi[group_len <= RSI_PERIOD] = 50
+
+    rci = rci_values(close.to_numpy(), RCI_PERIOD)
+    rci[pos_in_group < RCI_PERIOD - 1] = np.nan
+
+    tr = pd.concat(
+        [high - low, (high - prev_close).abs(), (low - prev_close).abs()], axis=1
+    ).max(axis=1)
+    bb_width = (4 * rolling(close, BB_PERIOD).std()) / rolling(close, BB_PERIOD).mean()
+    weeks = week_ids(df.index.get_level_values(-1))
+
+    return {
+        "SMA5": rolling(close, 5).mean(),
+        "SMA25": rolling(close, 25).mean(),
+        "SMA75": rolling(close, 75).mean(),
+        "Vol_SMA3": rolling(volume, 3).mean(),
+        "Vol_SMA5": rolling(volume, 5).mean(),
+        "RSI": rsi,
+        "RCI": pd.Series(rci, index=df.index),
+        # スコア表示用の値幅 (終値の標準偏差) と、バックテストの損切りに使う真の ATR
+        "STD14": rolling(close, 14).std(),
+        "ATR": rolling(tr, ATR_PERIOD).mean(),
+        "BB_Width": bb_width,
+        "BB_Width_Min120": rolling(bb_width, BB_SQUEEZE_LOOKBACK).min(),
+        # 当日を含む高値 (前日までの高値は1行前の値を読む)
+        "High_75d": rolling(high, 75, min_periods=1).max(),
+        "High_250d": rolling(high, HIGH_LOOKBACK, min_periods=1).max(),
+        # 週足13週平均 (当週は当日終値)。日足と同じ行に持たせ、評価時は読むだけにする
+        "Weekly_SMA13": pd.Series(
+            weekly_sma_values(close.to_numpy(), weeks, group_start), index=df.index
+        ),
+    }
+
+
+def _with_features(df, group_start):
+    base = df.drop(columns=[c for c in FEATURE_COLUMNS if c in df.columns])
+    features = pd.DataFrame(_feature_columns(base, group_start), index=df.index)
+    return pd.concat([base, features], axis=1)
+
+
+def build_features(df):
+    """
+    日足 (Open/High/Low/Close/Volume) に指標列を加えた DataFrame を返す。
+    指標はすべて当日までのデータだけで決まるため、結果の先頭 n 行は
+    df.iloc[:n] から作り直した場合と一致する (前日時点の評価は iloc[:-1] で良い)。
+    """
+    df = df.sort_index()
+    return _with_features(df, np.zeros(len(df), dtype=np.int64))
+
+
+def to_panel(frames):
+    """
+    複数銘柄の日足を (code, Date) の MultiIndex を持つ1つの DataFrame にまとめる。
+    frames: {コード: 日足DataFrame}、または code / Date 列を持つ縦持ちの DataFrame
+    """
+    if isinstance(frames, dict):
+        panel = pd.concat(frames, names=["code", "Date"])
+    elif isinstance(frames.index, pd.MultiIndex):
+        panel = frames
+    else:
+        panel = frames.set_index(["code", "Date"])
+    return panel.sort_index()
+
+
+def build_panel_features(panel):
+    """
+    複数銘柄の日足 (to_panel の形式) に、銘柄ごとの指標列をまとめて加える。
+    rolling は銘柄をまたがない窓で全銘柄を一度に計算するため、
+    各銘柄に build_features をかけた結果と同じ値になる。
+    """
+    panel = to_panel(panel)
+    codes = panel.index.get_level_values(0)
+    n = len(panel)
+    is_first = np.ones(n, dtype=bool)
+    if n:
+        is_first[1:] = codes[1:] != codes[:-1]
+    group_start = np.maximum.accumulate(np.where(is_first, np.arange(n), 0))
+    return _with_features(panel, group_start)
+
+
+def ensure_features(df):
+    """指標列が無ければ build_features を通す (計算済みならそのまま返す)"""
+    if all(c in df.columns for c in FEATURE_COLUMNS):
+        return df
+    return build_features(df)
+
+
+class _WindowMax:
+    """直近 size 件の最大値 (単調減少キューで追加・参照とも償却 O(1))"""
+
+    def __init__(self, size, values=()):
+        self.size = size
+        self._count = 0
+        self._queue = deque()  # (通し番号, 値)。値は単調減少
+        for v in values:
+            self.push(v)
+
+    def push(self, value):
+        if value == value:  # NaN は無視 (rolling の max と同じ)
+            while self._queue and self._queue[-1][1] <= value:
+                self._queue.pop()
+            self._queue.append((self._count, value))
+        self._count += 1
+        while self._queue and self._queue[0][0] <= self._count - 1 - self.size:
+            self._queue.popleft()
+
+    def max(self):
+        return self._queue[0][1] if self._queue else np.nan
+
+
+class _WindowMin(_WindowMax):
+    """直近 size 件の最小値"""
+
+    def push(self, value):
+        super().push(-value)
+
+    def max(self):
+        return -super().max()
+
+    min = max
+
+
+class _WindowSum:
+    """直近 size 件の和と二乗和 (基準値からの差で持ち、桁落ちを抑える)"""
+
+    def __init__(self, size, values=(), ref=0.0):
+        self.size = size
+        self.ref = ref
+        self._values = deque()
+        self.total = 0.0
+        self.total_sq = 0.0
+        for v in values:
+            self.push(v)
+
+    def push(self, value):
+        x = value - self.ref
+        self._values.append(x)
+        self.total += x
+        self.total_sq += x * x
+        if len(self._values) > self.size:
+            old = self._values.popleft()
+            self.total -= old
+            self.total_sq -= old * old
+
+    def __len__(self):
+        return len(self._values)
+
+    def mean_with(self, value, window):
+        """保持している値 (window - 1 件) に value を加えた平均。件数不足は NaN"""
+        if len(self._values) < window - 1:
+            return np.nan
+        return (self.total + value - self.ref) / window + self.ref
+
+    def std_with(self, value, window):
+        """保持している値に value を加えた標本標準偏差 (ddof=1)"""
+        if len(self._values) < window - 1:
+            return np.nan
+        x = value - self.ref
+        total = self.total + x
+        var = (self.total_sq + x * x - total * total / window) / (window - 1)
+        return float(np.sqrt(max(var, 0.0)))
+
+
+def _rci_last(window):
+    """1窓分 (古い順) の RCI。rci_values の最終値と同じ計算をスカラーで行う"""
+    period = len(window)
+    ordered = sorted(window)
+    d2_sum = 0.0
+    for date_rank, v in enumerate(window, start=1):
+        # 同値は平均順位
+        rank = (bisect_left(ordered, v) + bisect_right(ordered, v) + 1) / 2.0
+        d2_sum += (date_rank - rank) ** 2
+    return (1 - (6 * d2_sum) / (period * (period**2 - 1))) * 100
+
+
+def _true_range(high, low, prev_close):
+    if prev_close != prev_close:
+        return high - low
+    return max(high - low, abs(high - prev_close), abs(low - prev_close))
+
+
+class IndicatorState:
+    """
+    1銘柄の指標を、最終日の足の更新 (場中の現在値) と翌日の足の追加に
+    定数時間で追従させる。
+
+    確定済みの足 (最終行より前) について、各窓の「最終日を除いた部分」の和・最大値などを
+    保持しておき、最終日の値だけを差し込んで最終行の指標を求める。
+    rolling で作り直した値とは浮動小数点の誤差の範囲で一致する。
+    """
+
+    COLUMNS = ["Open", "High", "Low", "Close", "Volume"] + FEATURE_COLUMNS
+
+    def __init__(self, features):
+        """features: build_features の結果 (最終行が更新対象の足)"""
+        features = ensure_features(features)
+        self._index = features.index
+        self._values = features[self.COLUMNS].to_numpy(dtype=np.float64, copy=True)
+        self._col = {c: i for i, c in enumerate(self.COLUMNS)}
+
+        hist = self._values[:-1]
+        closes = hist[:, self._col["Close"]]
+        highs = hist[:, self._col["High"]]
+        lows = hist[:, self._col["Low"]]
+        volumes = hist[:, self._col["Volume"]]
+        self._rows = len(hist)
+        self._prev_close = float(closes[-1]) if len(closes) else np.nan
+
+        def tail(values, size):
+            return values[len(values) - size :].tolist() if size else []
+
+        ref = self._prev_close if len(closes) else 0.0
+        self._closes = {
+            w: _WindowSum(w - 1, tail(closes, min(w - 1, len(closes))), ref=ref)
+            for w in (5, 14, BB_PERIOD, 25, 75)
+        }
+        self._rci_closes = deque(
+            tail(closes, min(RCI_PERIOD - 1, len(closes))), maxlen=RCI_PERIOD - 1
+        )
+        self._volumes = {
+            w: _WindowSum(w - 1, tail(volumes, min(w - 1, len(volumes))))
+            for w in (3, 5)
+        }
+
+        # RSI: 先頭日の差分は 0 とする (calculate_rsi と同じ)
+        delta = np.diff(closes, prepend=np.nan)
+        delta[np.isnan(delta)] = 0.0
+        k = min(RSI_PERIOD - 1, len(delta))
+        self._gains = _WindowSum(RSI_PERIOD - 1, tail(np.maximum(delta, 0), k))
+        self._losses = _WindowSum(RSI_PERIOD - 1, tail(np.maximum(-delta, 0), k))
+
+        prev_closes = np.concatenate(([np.nan], closes[:-1]))
+        tr = np.fmax(
+            highs - lows,
+            np.fmax(np.abs(highs - prev_closes), np.abs(lows - prev_closes)),
+        )
+        self._tr = _WindowSum(ATR_PERIOD - 1, tail(tr, min(ATR_PERIOD - 1, len(tr))))
+
+        self._high_75 = _WindowMax(74, tail(highs, min(74, len(highs))))
+        self._high_250 = _WindowMax(
+            HIGH_LOOKBACK - 1, tail(highs, min(HIGH_LOOKBACK - 1, len(highs)))
+        )
+        bb_width = tail(hist[:, self._col["BB_Width"]], min(119, len(hist)))
+        self._bb_hist = deque(bb_width, maxlen=BB_SQUEEZE_LOOKBACK - 1)
+        self._bb_count = sum(1 for w in bb_width if w == w)  # 窓内の有効な値の数
+        self._bb_min = _WindowMin(BB_SQUEEZE_LOOKBACK - 1, bb_width)
+
+        # 最終行の週より前に締まった週の (週番号, 終値)
+        weeks = week_ids(self._index)
+        self._week = int(weeks[-1])
+        is_week_last = np.ones(len(hist), dtype=bool)
+        is_week_last[:-1] = weeks[1 : len(hist)] != weeks[: len(hist) - 1]
+        done = np.flatnonzero(is_week_last & (weeks[: len(hist)] < self._week))
+        self._weekly = deque(
+            zip(weeks[done].tolist(), closes[done].tolist()),
+            maxlen=WEEKLY_PERIOD - 1,
+        )
+
+    @property
+    def frame(self):
+        """現在の指標列付き日足 (コピー)"""
+        return pd.DataFrame(
+            self._values.copy(), index=self._index, columns=self.COLUMNS
+        )
+
+    def _last_values(self, bar):
+        o, h, l, c, v = (
+            float(bar[k]) for k in ("Open", "High", "Low", "Close", "Volume")
+        )
+        closes, volumes = self._closes, self._volumes
+        prev = self._prev_close
+
+        delta = 0.0 if prev != prev else c - prev
+        gain = self._gains.mean_with(max(delta, 0.0), RSI_PERIOD)
+        loss = self._losses.mean_with(max(-delta, 0.0), RSI_PERIOD)
+        if self._rows + 1 <= RSI_PERIOD or gain != gain or (gain == 0 and loss == 0):
+            rsi = 50.0
+        elif loss == 0:
+            rsi = 100.0
+        else:
+            rsi = 100 - (100 / (1 + gain / loss))
+
+        if len(self._rci_closes) == RCI_PERIOD - 1:
+            rci = _rci_last(list(self._rci_closes) + [c])
+        else:
+            rci = np.nan
+
+        bb_mean = closes[BB_PERIOD].mean_with(c, BB_PERIOD)
+        bb_width = 4 * closes[BB_PERIOD].std_with(c, BB_PERIOD) / bb_mean
+        if self._bb_count + (bb_width == bb_width) >= BB_SQUEEZE_LOOKBACK:
+            bb_min = min(self._bb_min.min(), bb_width)
+        else:
+            bb_min = np.nan
+        high_75, high_250 = self._high_75.max(), self._high_250.max()
+        weekly = self._weekly
+        if (
+            len(weekly) == WEEKLY_PERIOD - 1
+            and self._week - weekly[0][0] == WEEKLY_PERIOD - 1
+        ):
+            weekly_sma = np.array([w[1] for w in weekly] + [c]).mean()
+        else:
+            weekly_sma = np.nan
+        return {
+            "Open": o,
+            "High": h,
+            "Low": l,
+            "Close": c,
+            "Volume": v,
+            "SMA5": closes[5].mean_with(c, 5),
+            "SMA25": closes[25].mean_with(c, 25),
+            "SMA75": closes[75].mean_with(c, 75),
+            "Vol_SMA3": volumes[3].mean_with(v, 3),
+            "Vol_SMA5": volumes[5].mean_with(v, 5),
+            "RSI": rsi,
+            "RCI": rci,
+            "STD14": closes[14].std_with(c, 14),
+            "ATR": self._tr.mean_with(_true_range(h, l, prev), ATR_PERIOD),
+            "BB_Width": bb_width,
+            "BB_Width_Min120": bb_min,
+            # 当日を含む高値 (履歴が無ければ当日高値)
+            "High_75d": h if high_75 != high_75 else max(high_75, h),
+            "High_250d": h if high_250 != high_250 else max(high_250, h),
+            "Weekly_SMA13": float(weekly_sma),
+        }
+
+    def update_last(self, bar):
+        """
+        最終行の足を bar (Open/High/Low/Close/Volume を持つ dict/Series) で置き換え、
+        指標を更新した最終行の値 (dict) を返す。
+        """
+        values = self._last_values(bar)
+        self._values[-1] = [values[c] for c in self.COLUMNS]
+        return values
+
+    def append(self, date, bar):
+        """現在の最終行を確定させ、date の足を新しい最終行として追加する"""
+        last = dict(zip(self.COLUMNS, self._values[-1].tolist()))
+        c, h, low = last["Close"], last["High"], last["Low"]
+        prev = self._prev_close
+        delta = 0.0 if prev != prev else c - prev
+        for window in self._closes.values():
+            window.push(c)
+        self._rci_closes.append(c)
+        for window in self._volumes.values():
+            window.push(last["Volume"])
+        self._gains.push(max(delta, 0.0))
+        self._losses.push(max(-delta, 0.0))
+        self._tr.push(_true_range(h, low, prev))
+        self._high_75.push(h)
+        self._high_250.push(h)
+        bb_width = last["BB_Width"]
+        if len(self._bb_hist) == self._bb_hist.maxlen:
+            dropped = self._bb_hist[0]
+            self._bb_count -= dropped == dropped
+        self._bb_hist.append(bb_width)
+        self._bb_count += bb_width == bb_width
+        self._bb_min.push(bb_width)
+        self._rows += 1
+        self._prev_close = c
+        week = int(week_ids([date])[0])
+        if week != self._week:
+            self._weekly.append((self._week, c))
+            self._week = week
+
+        # 行の追加だけは配列の作り直しになる (日に1回なので許容)
+        self._values = np.vstack([self._values, self._values[-1:]])
+        self._index = self._index.append(
+            pd.DatetimeIndex([date], name=self._index.name)
+        )
+        return self.update_last(bar)
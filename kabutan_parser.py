@@ -0,0 +1,293 @@
+"""
+株探 (kabutan.jp) のページ解析
+
+- 正規表現はすべてモジュール読み込み時にコンパイル済み
+- ページ全体の改行除去コピーを作らず、各項目のラベルを先頭から1回だけ探し、
+  その位置で値パターンを照合する
+"""
+
+import datetime
+import re
+
+import numpy as np
+import pandas as pd
+
+
+def safe_float_convert(s):
+    try:
+        if isinstance(s, (int, float)):
+            return float(s)
+        return float(s.replace(",", ""))
+    except ValueError:
+        return 0.0
+
+
+def default_stock_info():
+    return {
+        "name": "不明",
+        "per": "-",
+        "pbr": "-",
+        "price": None,
+        "volume": 0.0,
+        "cap": 0,
+        "open": None,
+        "high": None,
+        "low": None,
+        "close": None,
+        "issued_shares": 0.0,
+        "earnings_date": None,
+        "earnings_status": "",
+    }
+
+
+OHLC_KEYS = {"始値": "open", "高値": "high", "安値": "low", "終値": "close"}
+
+# 値パターンは各ラベル位置から match で照合する (改行を含むページをそのまま扱うため DOTALL)
+_TITLE = re.compile(r"<title>(.*?)【", re.DOTALL)
+_TH_VALUE = re.compile(r"\s*<td[^>]*>([\d,.]+)</td>")
+_VOLUME = re.compile(
+    r"\s*<td[^>]*>(?:<span[^>]*>)?([\d,.]+)(?:</span>)?.*?株</td>", re.DOTALL
+)
+_CAP = re.compile(r".*?</th>\s*<td[^>]*>(.*?)</td>", re.DOTALL)
+_I3_BODY = re.compile(r".*?<tbody>(.*?)</tbody>", re.DOTALL)
+_TD = re.compile(r"<td.*?>(.*?)</td>", re.DOTALL)
+_OHLC = {
+    key: re.compile(rf"<th[^>]*>{key}</th>\s*<td[^>]*>([\d,.]+)</td>")
+    for key in OHLC_KEYS
+}
+_MONTH_DAY = re.compile(r"月\d+日")
+_HEADING_TAG = re.compile(r"<(?:h2|div)[^>]*>\s*\d+$")
+_TABLE = re.compile(r".*?<table[^>]*>(.*?)</table>", re.DOTALL)
+_ISSUED = re.compile(r".*?<td>([\d,.]+).*?株</td>", re.DOTALL)
+_DATE = re.compile(r"(\d{4})/(\d{1,2})/(\d{1,2})")
+_PARENS = re.compile(r"[\(\（].*?[\)\）]")
+_TAGS = re.compile(r"<[^>]+>")
+_NUMBER = re.compile(r"([\d,.]+)")
+_NEWLINES = re.compile(r"[\r\n]")
+
+
+def _to_datetime(m):
+    return datetime.datetime(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+
+
+def _positions(html, label, start=0, end=None):
+    """label の出現位置 (label 直後の位置) を先頭から順に返す"""
+    end = len(html) if end is None else end
+    i = html.find(label, start, end)
+    while i >= 0:
+        yield i + len(label)
+        i = html.find(label, i + 1, end)
+
+
+def parse_market_cap(cap_html):
+    """時価総額セル ("3兆1,234億円" 等) を億円単位の数値にする"""
+    cap_str = _NEWLINES.sub("", _TAGS.sub("", cap_html).strip())
+    val = 0
+    if "兆" in cap_str:
+        parts = cap_str.split("兆")
+        # 小数点を含む数値に対応するため safe_float_convert を使用
+        trillion = safe_float_convert(parts[0])
+        billion = 0
+        if len(parts) > 1 and "億" in parts[1]:
+            b_match = _NUMBER.search(parts[1])
+            if b_match:
+                billion = safe_float_convert(b_match.group(1))
+        val = trillion * 10000 + billion
+    elif "億" in cap_str:
+        b_match = _NUMBER.search(cap_str)
+        if b_match:
+            val = safe_float_convert(b_match.group(1))
+    return val
+
+
+def parse_earnings_date(html):
+    """
+    決算日を (日付, "upcoming" | "done") で返す。見つからなければ (None, "")。
+    「発表予定日」と、発表後の「実績日（New!表示など）」の両方に対応。
+    """
+    # 1. 予定日パターン (例: 決算発表予定日 2026/04/10)
+    i = html.find("決算発表予定日")
+    if i >= 0:
+        m = _DATE.search(html, i)
+        if m:
+            return _to_datetime(m), "upcoming"
+
+    # 2. 発表済パターン (例: 決算New! 2026/04/01 発表)
+    # 最初の「決算」以降で、後ろに「発表」が続く最初の日付を採る
+    i = html.find("決算")
+    if i >= 0:
+        last = html.rfind("発表", i)
+        if last >= 0:
+            m = _DATE.search(html, i, last)
+            if m:
+                return _to_datetime(m), "done"
+    return None, ""
+
+
+class StockPageParser:
+    """
+    株探の個別銘柄ページ (/stock/?code=) の解析器。
+    各項目はラベルを str.find で1回ずつ探し、その位置で値パターンを照合する。
+    """
+
+    def parse(self, html):
+        data = default_stock_info()
+
+        i = html.find("<title>")
+        if i >= 0:
+            m = _TITLE.match(html, i)
+            if m:
+                name = _NEWLINES.sub("", m.group(1)).strip()
+                data["name"] = _PARENS.sub("", name).replace("<br>", " ").strip()
+
+        price = self._first_th_value(html, ("現在値</th>", "終値</th>"))
+        if price is not None:
+            data["price"] = price
+
+        for p in _positions(html, "出来高</th>"):
+            m = _VOLUME.match(html, p)
+            if m:
+                data["volume"] = safe_float_convert(m.group(1))
+                break
+
+        i = html.find("時価総額")
+        if i >= 0:
+            m = _CAP.match(html, i)
+            if m:
+                data["cap"] = parse_market_cap(m.group(1))
+
+        i = html.find('<div id="stockinfo_i3">')
+        if i >= 0:
+            m = _I3_BODY.match(html, i)
+            if m:
+                tds = _TD.findall(m.group(1))
+                if len(tds) >= 2:
+                    data["per"] = _TAGS.sub("", tds[0]).strip()
+                    data["pbr"] = _TAGS.sub("", tds[1]).strip()
+
+        self._parse_ohlc(html, data)
+
+        i = html.find("発行済株式数")
+        if i >= 0:
+            m = _ISSUED.match(html, i)
+            if m:
+                data["issued_shares"] = safe_float_convert(m.group(1))
+
+        data["earnings_date"], data["earnings_status"] = parse_earnings_date(html)
+        return data
+
+    def _first_th_value(self, html, labels):
+        """いずれかのラベル直後の <td> 数値のうち、ページ内で最初に現れるもの"""
+        candidates = sorted(p for label in labels for p in _positions(html, label))
+        for p in candidates:
+            m = _TH_VALUE.match(html, p)
+            if m:
+                return safe_float_convert(m.group(1))
+        return None
+
+    def _ohlc_window(self, html):
+        """日付見出し (例: <h2>10月17日</h2>) 直後のテーブル範囲。見出しが無ければページ全体"""
+        for m in _MONTH_DAY.finditer(html):
+            tag_start = html.rfind("<", 0, m.start())
+            if tag_start >= 0 and _HEADING_TAG.match(html, tag_start, m.start()):
+                t = _TABLE.match(html, m.end())
+                if t:
+                    return t.start(1), t.end(1)
+                break
+        return 0, len(html)
+
+    def _parse_ohlc(self, html, data):
+        lo, hi = self._ohlc_window(html)
+        for key, val_key in OHLC_KEYS.items():
+            m = _OHLC[key].search(html, lo, hi)
+            if m:
+                data[val_key] = safe_float_convert(m.group(1))
+
+
+HISTORY_COLUMNS = ["Date", "Open", "High", "Low", "Close", "Volume"]
+
+_KABUKA_TABLE = re.compile(
+    r"<table[^>]*class=\"[^\"]*\bstock_kabuka_dwm\b[^\"]*\"[^>]*>(.*?)</table>",
+    re.DOTALL,
+)
+_TBODY = re.compile(r"<tbody[^>]*>(.*?)</tbody>", re.DOTALL)
+_ROW = re.compile(r"<tr[^>]*>(.*?)</tr>", re.DOTALL)
+_TH_CELL = re.compile(r"<th[^>]*>(.*?)</th>", re.DOTALL)
+_TD_CELL = re.compile(r"<td[^>]*>(.*?)</td>", re.DOTALL)
+_SEP = "\x1f"  # セル連結用の区切り文字 (HTML本文には現れない制御文字)
+
+
+def parse_kabuka_history(html):
+    """
+    株探の時系列テーブル (class="stock_kabuka_dwm"、日付は <th>、数値は <td>) を
+    Date インデックスの Open/High/Low/Close/Volume に変換する。
+    DOM は組み立てず、テーブル部分だけを切り出して文字列のまま列単位で数値化する。
+    """
+    m = _KABUKA_TABLE.search(html)
+    if not m:
+        return pd.DataFrame()
+    table = m.group(1)
+    body = _TBODY.search(table)
+    if body:
+        table = body.group(1)
+
+    dates, cells = [], []
+    for row in _ROW.finditer(table):
+        row_html = row.group(1)
+        th = _TH_CELL.search(row_html)
+        tds = _TD_CELL.findall(row_html)
+        if not th or len(tds) < 7:
+            continue
+        dates.append(th.group(1))
+        # 取得順: 始値(0), 高値(1), 安値(2), 終値(3), 売買高(6)
+        cells.append((tds[0], tds[1], tds[2], tds[3], tds[6]))
+    if not dates:
+        return pd.DataFrame(columns=HISTORY_COLUMNS).set_index("Date")
+
+    # セル文字列を1本に連結し、タグ・カンマ除去などを一括で行ってから数値化する
+    # (全角ハイフンと空欄は 0、数値にならない行は除外)
+    flat = _TAGS.sub("", _SEP.join(v for row in cells for v in row))
+    flat = flat.replace(",", "").replace("－", "0").split(_SEP)
+    tokens = np.array([t.strip() or "0" for t in flat], dtype=object)
+    values = pd.to_numeric(tokens, errors="coerce").astype(np.float64)
+    values = values.reshape(len(cells), len(HISTORY_COLUMNS) - 1)
+
+    # 日付: 26/02/27 -> 2026-02-27 ("/" を含まない行は除外)
+    date_strs = []
+    for d_str in _TAGS.sub("", _SEP.join(dates)).split(_SEP):
+        parts = d_str.strip().split("/")
+        if len(parts) < 3:
+            date_strs.append("")
+            continue
+        year = "20" + parts[0] if len(parts[0]) == 2 else parts[0]
+        date_strs.append(f"{year}-{parts[1]}-{parts[2]}")
+    date_vals = pd.to_datetime(date_strs, errors="coerce", format="%Y-%m-%d")
+
+    valid = ~np.isnan(values).any(axis=1) & ~date_vals.isna()
+    df = pd.DataFrame(
+        values[valid],
+        index=pd.DatetimeIndex(date_vals[valid], name="Date"),
+        columns=HISTORY_COLUMNS[1:],
+    )
+    return df.sort_index()
+
+
+def parse_kabuka_page(html):
+    """株探の時系列ページ1枚から (決算日, 日足履歴DataFrame) をまとめて抽出する"""
+    try:
+        earnings_date = parse_earnings_date(html)[0]
+    except Exception:
+        earnings_date = None
+    try:
+        history = parse_kabuka_history(html)
+    except Exception:
+        history = pd.DataFrame()
+    return earnings_date, history
+
+
+stock_page_parser = StockPageParser()
+
+
+def parse_stock_page(html):
+    """個別銘柄ページから名称・現在値・出来高・時価総額・PER/PBR・四本値・発行済株式数・決算日を抽出する"""
+    return stock_page_parser.parse(html)
@@ -0,0 +1,195 @@
+"""
+分析結果の保持
+
+1銘柄分の結果は __slots__ 付きの AnalysisRecord、セッション全体は列ごとに
+配列で持つ ResultTable に入れる。数値列は NumPy 配列、文字列などはリストで持ち、
+並べ替え・絞り込み・表示は ResultTable の列を直接読む。
+全銘柄スキャンで数千銘柄を溜めても、1銘柄あたりは数値列の数十バイトと
+文字列への参照だけで済む。
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+# 数値列と型 (価格・指標は float64、点数・回数は整数、フラグは bool)
+NUMERIC_FIELDS = {
+    "price": np.float64,
+    "cap_val": np.float64,
+    "rsi": np.float64,
+    "rci": np.float64,
+    "vol_ratio": np.float64,
+    "avg_volume_5d": np.float64,
+    "score": np.int16,
+    "score_diff": np.int16,
+    "buy": np.float64,
+    "oshime_price": np.float64,
+    "p_half": np.float64,
+    "p_full": np.float64,
+    "max_dd_pct": np.float64,
+    "sl_pct": np.float64,
+    "sl_ma": np.float64,
+    "risk_reward": np.float64,
+    "atr_smoothed": np.float64,
+    "win_rate_pct": np.float64,
+    "bt_win_count": np.int32,
+    "bt_loss_count": np.int32,
+    "update_count": np.int32,
+    "batch_order": np.int32,
+    "is_aoteng": np.bool_,
+    "is_updated_in_this_run": np.bool_,
+    "is_earnings_soon": np.bool_,
+}
+
+# 配列にしない列 (文字列・日付・加減点の内訳など)
+OBJECT_FIELDS = [
+    "code",
+    "name",
+    "per",
+    "pbr",
+    "strategy",
+    "score_factors",  # ((要因, 点), ...) のタプル
+    "atr_comment",
+    "momentum",
+    "backtest",
+    "earnings_date",
+    "earnings_day_count",  # 決算まで日数 (決算情報なしは None)
+    "earnings_disp_str",
+    "comment",
+]
+
+RECORD_FIELDS = OBJECT_FIELDS + list(NUMERIC_FIELDS)
+
+# 同じ文字列が銘柄をまたいで繰り返される列 (intern して1つを共有する)
+_INTERNED_FIELDS = ("strategy", "atr_comment", "momentum", "earnings_disp_str")
+
+_DEFAULTS = {"update_count": 1, "comment": "", "score_factors": ()}
+
+
+class AnalysisRecord:
+    """get_stock_data が返す1銘柄分の結果"""
+
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, **values):
+        for name in RECORD_FIELDS:
+            if name in values:
+                value = values.pop(name)
+            elif name in _DEFAULTS:
+                value = _DEFAULTS[name]
+            else:
+                dtype = NUMERIC_FIELDS.get(name)
+                value = None if dtype is None else dtype(0).item()
+            setattr(self, name, value)
+        if values:
+            raise TypeError(f"未定義の項目: {', '.join(values)}")
+
+    def __repr__(self):
+        return f"AnalysisRecord(code={self.code!r}, score={self.score!r})"
+
+
+def _missing_value(dtype):
+    """None の代わりに書く値 (float は NaN、整数・フラグは AnalysisRecord の既定値)"""
+    return np.nan if dtype.kind == "f" else dtype.type(0)
+
+
+def compact_factors(factors):
+    """加減点の dict を ((要因, 点), ...) のタプルにする (要因名は scoring の定数を共有)"""
+    return tuple(factors.items())
+
+
+class ResultTable:
+    """
+    セッション内の分析結果 (銘柄コードごとに1行)。
+    行の追加は容量を倍々で確保するので、溜まるほど再確保は稀になる。
+    """
+
+    def __init__(self):
+        self._rows = {}  # コード -> 行番号
+        self._size = 0
+        self._numeric = {
+            name: np.zeros(0, dtype=dtype) for name, dtype in NUMERIC_FIELDS.items()
+        }
+        self._objects = {name: [] for name in OBJECT_FIELDS}
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, code):
+        return code in self._rows
+
+    def __iter__(self):
+        return (self.record(code) for code in self._rows)
+
+    @property
+    def codes(self):
+        """行順 (初回登録順) の銘柄コード"""
+        return list(self._rows)
+
+    def column(self, name):
+        """1列分 (数値列は NumPy 配列のビュー、それ以外はリスト)"""
+        if name in self._numeric:
+            return self._numeric[name][: self._size]
+        return self._objects[name]
+
+    def record(self, code):
+        i = self._rows[code]
+        values = {name: col[i].item() for name, col in self._numeric.items()}
+        values.update({name: col[i] for name, col in self._objects.items()})
+        return AnalysisRecord(**values)
+
+    def _reserve(self, size):
+        capacity = len(self._numeric["score"])
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2, 64)
+        for name, col in self._numeric.items():
+            grown = np.zeros(capacity, dtype=col.dtype)
+            grown[: self._size] = col[: self._size]
+            self._numeric[name] = grown
+
+    def _write(self, i, record):
+        for name, col in self._numeric.items():
+            value = getattr(record, name)
+            col[i] = _missing_value(col.dtype) if value is None else value
+        for name, col in self._objects.items():
+            value = getattr(record, name)
+            if name in _INTERNED_FIELDS and isinstance(value, str):
+                value = sys.intern(value)
+            if i == len(col):
+                col.append(value)
+            else:
+                col[i] = value
+
+    def upsert(self, records):
+        """
+        今回の結果を反映する。既存銘柄は行を上書きして更新回数を1増やし、
+        今回更新した行だけ is_updated_in_this_run を立てる。
+        """
+        records = list(records)
+        self._numeric["is_updated_in_this_run"][: self._size] = False
+        self._reserve(self._size + len(records))
+        update_count = self._numeric["update_count"]
+        for record in records:
+            i = self._rows.get(record.code)
+            if i is None:
+                i = self._rows[record.code] = self._size
+                self._size += 1
+                record.update_count = 1
+            else:
+                record.update_count = int(update_count[i]) + 1
+            record.is_updated_in_this_run = True
+            self._write(i, record)
+
+    def to_frame(self, mask=None):
+        """表示用の DataFrame (mask は行ごとの bool 配列、None なら全行)"""
+        idx = np.arange(self._size) if mask is None else np.flatnonzero(mask)
+        data = {}
+        for name in RECORD_FIELDS:
+            if name in self._numeric:
+                data[name] = self._numeric[name][idx]
+            else:
+                col = self._objects[name]
+                data[name] = [col[i] for i in idx]
+        return pd.DataFrame(data, columns=RECORD_FIELDS)
@@ -0,0 +1,265 @@
+"""
+全銘柄スキャンのスケジューラ
+
+固定の件数・待ち時間でバッチを区切る代わりに、取得元ごとのリクエスト予算
+(http_client.HOST_BUDGETS) の範囲で、各取得元を休ませずに回す。
+- Yahoo: YF_CHUNK_SIZE 件ずつ先回りして日足を取得する (1本)。
+  yf.download は銘柄ごとにリクエストを送るため、予算は銘柄数分消費する
+- 株探: 銘柄ごとに analyze_ticker (個別ページ + 時系列ページ)。
+  同時接続数の枠が空かないよう、枠の数より多いスレッドで順番待ちさせる
+- Gemini: 入力順に AI_BATCH_SIZE 件ずつまとめてコメントを付ける (1本)
+待ち時間の調整は http_client のペーサーに任せ、ここでは sleep しない。
+進捗・処理速度・残り時間は UniverseScan.snapshot() で読む。
+リクエスト数は実際に送った分だけを数える (http_client.count_requests)。
+共有キャッシュなどでリクエストを送らずに済んだ銘柄は処理速度の実測から除く。
+checkpoint (checkpoint.ScanCheckpoint) を渡すと1銘柄ごとに結果を保存し、
+保存済みの銘柄は取得せずに読み戻す。全件を終えると checkpoint を完了扱いにする
+(finish_checkpoint=False なら呼び出し側で結果を保存してから finish() する)。
+"""
+
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from analysis import (
+    YF_CHUNK_SIZE,
+    analyze_ticker,
+    get_kabutan_info,
+    prefetch_yahoo_history,
+)
+from background import BatchResult, Job
+from http_client import DEFAULT_BUDGET, HOST_BUDGETS, count_requests, host_key
+
+AI_BATCH_SIZE = 10  # Gemini 1回あたりの銘柄数
+KABUTAN_REQUESTS = 2  # 1銘柄あたりの株探へのリクエスト数 (個別ページ + 時系列ページ)
+KABUTAN_WORKERS_PER_SLOT = 2  # 株探の同時接続1枠あたりのスレッド数
+YAHOO_REQUESTS = 1  # 1銘柄あたりの Yahoo へのリクエスト数 (yf.download の内部で1回)
+
+SOURCE_HOSTS = {
+    "kabutan": "kabutan.jp",
+    "yahoo": "finance.yahoo.com",
+    "gemini": "generativelanguage.googleapis.com",
+}
+SOURCE_LABELS = {"kabutan": "株探", "yahoo": "Yahoo", "gemini": "Gemini"}
+
+
+def source_budget(source):
+    """取得元の (毎秒の補充トークン数, バースト上限, 同時接続数)"""
+    return HOST_BUDGETS.get(host_key(SOURCE_HOSTS[source]), DEFAULT_BUDGET)
+
+
+def source_rates(annotate=True):
+    """取得元ごとに、予算の範囲で1秒あたり何銘柄を処理できるか"""
+    per_ticker = {"kabutan": KABUTAN_REQUESTS, "yahoo": YAHOO_REQUESTS}
+    if annotate:
+        per_ticker["gemini"] = 1 / AI_BATCH_SIZE
+    return {
+        source: source_budget(source)[0] / requests
+        for source, requests in per_ticker.items()
+    }
+
+
+def estimate_seconds(count, annotate=True):
+    """count 銘柄のスキャンに掛かる見込み秒数 (最も遅い取得元で決まる)"""
+    return count / min(source_rates(annotate).values())
+
+
+class UniverseScan(Job):
+    """
+    銘柄リスト全体を1本のジョブとして分析する。
+    結果は入力順に AI_BATCH_SIZE 件ずつ BatchResult(value=(結果, 独り言, エラー)) で渡す。
+    get_info: (コード, on_error) -> 株探の個別情報 (省略時はキャッシュなしで取得)
+    annotate: (結果のリスト, on_error) -> ({コード: コメント}, 独り言)。None ならコメントなし
+    中止した場合も、入力順の先頭から分析を終えた分までは結果を渡す。
+    checkpoint から読み戻した銘柄のコードは restored に入る。
+    """
+
+    def __init__(
+        self,
+        tickers,
+        get_info=None,
+        annotate=None,
+        offset=0,
+        checkpoint=None,
+        finish_checkpoint=True,
+    ):
+        super().__init__()
+        self.tickers = list(tickers)
+        self.get_info = get_info or get_kabutan_info
+        self.annotate = annotate
+        self.offset = offset  # tickers[0] の入力リスト全体での位置
+        self.checkpoint = checkpoint
+        self.finish_checkpoint = finish_checkpoint
+        self.restored = set()
+        self.processed = 0  # 分析を終えた銘柄数 (完了順)
+        self.cached = 0  # リクエストを送らずに済んだ銘柄数 (共有キャッシュなど)
+        self.emitted = 0  # 結果を渡し終えた銘柄数 (入力順の先頭から)
+        self.requests = dict.fromkeys(SOURCE_HOSTS, 0)
+        self._sources = {host_key(host): s for s, host in SOURCE_HOSTS.items()}
+        self.started_at = None
+        self.kabutan_workers = source_budget("kabutan")[2] * KABUTAN_WORKERS_PER_SLOT
+
+    def snapshot(self):
+        """
+        進捗・処理速度 (銘柄/分)・残り時間 (秒) と律速している取得元。
+        速度は取得した銘柄の実測値、まだ1件も取得していなければ予算からの見込み値。
+        """
+        with self._lock:
+            total = len(self.tickers)
+            elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+            rates = source_rates(self.annotate is not None)
+            bottleneck = min(rates, key=rates.get)
+            fetched = self.processed - len(self.restored) - self.cached
+            per_sec = (
+                fetched / elapsed if fetched and elapsed > 0 else rates[bottleneck]
+            )
+            return {
+                "state": self.state,
+                "error": self.error,
+                "processed": self.processed,
+                "emitted": self.emitted,
+                "restored": len(self.restored),
+                "cached": self.cached,
+                "total": total,
+                "elapsed": elapsed,
+                "rate_per_min": per_sec * 60,
+                "eta_seconds": (total - self.processed) / per_sec,
+                "bottleneck": SOURCE_LABELS[bottleneck],
+                "requests": dict(self.requests),
+            }
+
+    def _count(self, host, n):
+        """http_client.count_requests から、実際に送ったリクエストを受け取る"""
+        source = self._sources.get(host)
+        if source is not None:
+            with self._lock:
+                self.requests[source] += n
+
+    def _prefetch(self, chunk):
+        if self.is_cancelled:
+            return {}
+        with count_requests(self._count):
+            return prefetch_yahoo_history(chunk)
+
+    def _analyze(self, i, yahoo_batch, errors):
+        """(結果, 分析したか) を返す。中止後に順番が来た銘柄は分析しない"""
+        if self.is_cancelled:
+            return None, False
+        sent = []
+
+        def on_request(host, n):
+            sent.append(n)
+            self._count(host, n)
+
+        try:
+            with count_requests(on_request):
+                record = analyze_ticker(
+                    self.tickers[i],
+                    lambda code: self.get_info(code, errors.append),
+                    yahoo_batch=yahoo_batch,
+                    on_error=errors.append,
+                )
+            if record is not None and self.checkpoint is not None:
+                self.checkpoint.save([(i, record)])
+            return record, True
+        finally:
+            with self._lock:
+                self.processed += 1
+                if not sent:
+                    self.cached += 1
+
+    def _finish_group(self, start, end, items, errors):
+        """items: [(入力リスト上の位置, 結果), ...]。コメントの無い結果だけ Gemini に回す"""
+        monologue = ""
+        pending = [(i, d) for i, d in items if not d.comment]
+        if self.annotate is not None and pending:
+            with count_requests(self._count):
+                comments, monologue = self.annotate(
+                    [d for _, d in pending], on_error=errors.append
+                )
+            for _, d in pending:
+                d.comment = comments.get(d.code, "コメント生成失敗")
+            if self.checkpoint is not None:
+                self.checkpoint.save(pending)
+        records = [d for _, d in items]
+        with self._lock:
+            self.emitted = end
+        self._emit(
+            BatchResult(
+                start // AI_BATCH_SIZE + 1,
+                self.offset + start,
+                self.offset + end,
+                (records, monologue, errors),
+            )
+        )
+
+    def _restore(self):
+        """checkpoint から読み戻した銘柄を、完了済みの Future として並べる"""
+        restored = self.checkpoint.load() if self.checkpoint is not None else {}
+        futures = {}
+        for i, record in restored.items():
+            futures[i] = Future()
+            futures[i].set_result((record, True))
+        with self._lock:
+            self.restored = {record.code for record in restored.values()}
+            self.processed = len(restored)
+        return futures
+
+    def _run(self):
+        self.started_at = time.monotonic()
+        n = len(self.tickers)
+        errors = [[] for _ in range(n)]
+        futures = self._restore()
+        pending = [i for i in range(n) if i not in futures]
+        yahoo = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scan-yahoo")
+        kabutan = ThreadPoolExecutor(
+            max_workers=self.kabutan_workers, thread_name_prefix="scan-kabutan"
+        )
+        gemini = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scan-gemini")
+        try:
+            chunks = [
+                yahoo.submit(
+                    self._prefetch,
+                    [self.tickers[i] for i in pending[k : k + YF_CHUNK_SIZE]],
+                )
+                for k in range(0, len(pending), YF_CHUNK_SIZE)
+            ]
+            for k, i in enumerate(pending):
+                futures[i] = kabutan.submit(
+                    self._analyze, i, chunks[k // YF_CHUNK_SIZE], errors[i]
+                )
+
+            # 入力順に AI_BATCH_SIZE 件揃うたびに Gemini 側へ回す
+            groups = []
+            for start in range(0, n, AI_BATCH_SIZE):
+                items, group_errors, end = [], [], start
+                for i in range(start, min(n, start + AI_BATCH_SIZE)):
+                    try:
+                        record, analyzed = futures[i].result()
+                    except Exception as e:
+                        record, analyzed = None, True
+                        errors[i].append(f"取得エラー ({self.tickers[i]}): {e}")
+                    if not analyzed:
+                        break
+                    if record is not None:
+                        record.batch_order = self.offset + i + 1
+                        items.append((i, record))
+                    group_errors.extend(errors[i])
+                    end = i + 1
+                if end > start:
+                    groups.append(
+                        gemini.submit(
+                            self._finish_group, start, end, items, group_errors
+                        )
+                    )
+                if end < min(n, start + AI_BATCH_SIZE):
+                    break
+            for group in groups:
+                group.result()
+        finally:
+            for executor in (yahoo, kabutan, gemini):
+                executor.shutdown(wait=True, cancel_futures=True)
+        if self.emitted < n:
+            return False
+        if self.checkpoint is not None and self.finish_checkpoint:
+            self.checkpoint.finish()
+        return True
@@ -0,0 +1,132 @@
+"""
+銘柄リストの一括スコアリング (Streamlit なし)
+
+銘柄コードを1行1件で並べたファイル (CSV なら先頭列) を読み、
+app_free.py と同じスケジューラ (scheduler.UniverseScan) で分析して CSV / Parquet に
+書き出す。引け後に cron から回す用途を想定している。AI コメントは付けない。
+途中で止まっても、同じ銘柄リスト・同じ出力先・同じ市場フェーズで再実行すれば続きから分析する。
+
+例: python score_universe.py universe.txt --out scores.parquet
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import threading
+
+from analysis import market_phase_id
+from checkpoint import ScanCheckpoint
+from results import ResultTable
+from scheduler import UniverseScan, estimate_seconds
+
+PROGRESS_INTERVAL = 60  # 進捗を表示する間隔 (秒)
+PARQUET_ENGINES = ("pyarrow", "fastparquet")  # DataFrame.to_parquet が使うライブラリ
+
+HEADER_NAMES = ("code", "コード", "銘柄コード")
+
+
+def read_universe(path):
+    """銘柄リストを読む (空行・# 始まり・見出し行は無視、重複は最初の1件だけ)"""
+    codes = []
+    with open(path, encoding="utf-8-sig") as f:
+        for line in f:
+            code = line.split(",", 1)[0].strip().strip('"').upper()
+            if not code or code.startswith("#") or code.lower() in HEADER_NAMES:
+                continue
+            codes.append(code)
+    return list(dict.fromkeys(codes))
+
+
+def score_universe(codes, on_error=None, on_progress=None, checkpoint=None):
+    """
+    codes を分析し、取得できた銘柄を入力順に ResultTable で返す。
+    on_progress には PROGRESS_INTERVAL 秒ごとに UniverseScan.snapshot() を渡す。
+    checkpoint (ScanCheckpoint) を渡すと1銘柄ごとに途中経過を保存し、前回止まった
+    ところから続ける。完了扱いにはしないので、結果を保存した後に finish() すること。
+    """
+    table = ResultTable()
+    scan = UniverseScan(codes, checkpoint=checkpoint, finish_checkpoint=False)
+    worker = threading.Thread(target=scan.run, name="score-universe", daemon=True)
+    worker.start()
+    while worker.is_alive():
+        worker.join(PROGRESS_INTERVAL)
+        if on_progress and worker.is_alive():
+            on_progress(scan.snapshot())
+    records = []
+    for batch in scan.take_results():
+        batch_records, _, errors = batch.value
+        records.extend(batch_records)
+        if on_error:
+            for message in errors:
+                on_error(message)
+    if scan.state == "failed":
+        raise RuntimeError(scan.error)
+    table.upsert(records)
+    return table
+
+
+def print_progress(p):
+    print(
+        f"{p['processed']}/{p['total']} 銘柄 ({p['rate_per_min']:.1f}銘柄/分, "
+        f"残り約{p['eta_seconds'] / 60:.0f}分, 律速: {p['bottleneck']})",
+        file=sys.stderr,
+    )
+
+
+def to_output_frame(table):
+    """書き出し用の DataFrame (加減点の内訳は '要因:点' の文字列にする)"""
+    df = table.to_frame()
+    df["score_factors"] = [
+        " / ".join(f"{k}:{v:+g}" for k, v in factors) for factors in df["score_factors"]
+    ]
+    return df.drop(columns=["update_count", "is_updated_in_this_run", "comment"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="銘柄リストを分析して保存する")
+    parser.add_argument("universe", help="銘柄コードのファイル (1行1銘柄 / CSV)")
+    parser.add_argument("--out", required=True, help="出力先 (.csv / .parquet)")
+    parser.add_argument(
+        "--no-resume", action="store_true", help="途中経過を使わず最初から分析する"
+    )
+    args = parser.parse_args(argv)
+    to_parquet = args.out.lower().endswith(".parquet")
+    # 書き出しの失敗で長いスキャンを無駄にしないよう、始める前に確かめる
+    if to_parquet and not any(importlib.util.find_spec(m) for m in PARQUET_ENGINES):
+        parser.error("Parquet で保存するには pyarrow (または fastparquet) が必要です")
+
+    codes = read_universe(args.universe)
+    print(
+        f"{len(codes)} 銘柄 (見込み 約{estimate_seconds(len(codes), False) / 60:.0f}分)",
+        file=sys.stderr,
+    )
+    errors = []
+    checkpoint = None
+    if not args.no_resume:
+        # 出力先ごとに途中経過を分け、別の出力先への実行とは共有しない
+        owner = f"score_universe:{os.path.abspath(args.out)}"
+        checkpoint = ScanCheckpoint(codes, market_phase_id()[0], owner)
+    table = score_universe(
+        codes,
+        on_error=errors.append,
+        on_progress=print_progress,
+        checkpoint=checkpoint,
+    )
+    df = to_output_frame(table)
+    if to_parquet:
+        df.to_parquet(args.out, index=False)
+    else:
+        df.to_csv(args.out, index=False, encoding="utf-8-sig")
+    # 途中経過は書き出しに成功してから消す (失敗時は再実行で読み戻せる)
+    if checkpoint is not None:
+        checkpoint.finish()
+
+    for message in errors:
+        print(message, file=sys.stderr)
+    print(f"{len(table)}/{len(codes)} 銘柄を {args.out} に保存しました", file=sys.stderr)
+    return 0 if len(table) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,565 @@
+"""
+スコアリング (銘柄横断・配列版)
+
+評価日 (銘柄ごとの最終日、または1銘柄の直近数日) を行とする配列で、
+鉄の掟・順/逆ロジ・戦略判定・各加減点をまとめて判定する。
+1銘柄の評価も、多数銘柄の一括評価も同じ処理を通る。
+
+入力は build_features / build_panel_features の指標列付き日足。
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from indicators import build_panel_features, ensure_features
+
+MIN_ROWS = 80  # スコアを出すのに必要な日足の本数
+WINDOW = 80  # 評価日から遡って参照する行数 (含損率75日・ダイバージェンス40日)
+
+
+class ScoreResult(NamedTuple):
+    """1評価日分のスコアと価格水準"""
+
+    score: int
+    factors: dict  # {要因: 点}
+    strategy: str
+    buy: float
+    p_half: float
+    p_full: float
+    sl_ma: float
+    is_aoteng: bool
+    sl_pct: float
+    rsi: float
+    atr_smoothed: float
+    atr_comment: str
+    momentum: str
+    rci: float
+    oshime_price: float
+    max_dd_pct: float
+
+
+SCORE_FIELDS = list(ScoreResult._fields)
+
+SCORE_NO_DATA = ScoreResult(
+    50, {}, "様子見", 0, 0, 0, 0, False, 0, 50, 0, "通常レンジ", "0%", 0, 0, 0
+)
+
+# 時価総額区分 (億円) と区分ごとの利確目標 (半分利確, 全利確)
+CAP_CATEGORIES = ["超大型", "大型", "中型", "小型", "超小型"]
+CAP_THRESHOLDS = [10000, 3000, 500, 100]
+HALF_TARGET_PCT = [0.015, 0.020, 0.025, 0.030, 0.040]
+FULL_TARGET_PCT = [0.025, 0.035, 0.040, 0.050, 0.070]
+
+# 戦略の分岐 (evaluate の戻り値)
+WAIT, BULL, BEAR, TREND, TREND_AOTENG, BOTTOM, CONTRARIAN = range(7)
+STRATEGY_NAMES = {
+    WAIT: "様子見",
+    BULL: "🚀順ロジ",
+    BEAR: "🚀逆ロジ",
+    TREND: "🔥順張り",
+    TREND_AOTENG: "🔥順張り",
+    BOTTOM: "💎底打反転",
+    CONTRARIAN: "🌊逆張り",
+}
+
+
+def get_market_cap_category(market_cap):
+    for category, threshold in zip(CAP_CATEGORIES, CAP_THRESHOLDS):
+        if market_cap >= threshold:
+            return category
+    return CAP_CATEGORIES[-1]
+
+
+def get_target_pct_new(category, is_half):
+    i = CAP_CATEGORIES.index(category) if category in CAP_CATEGORIES else -1
+    return HALF_TARGET_PCT[i] if is_half else FULL_TARGET_PCT[i]
+
+
+def _category_index(caps):
+    """時価総額の配列を CAP_CATEGORIES の位置に変換する"""
+    thresholds = -np.asarray(CAP_THRESHOLDS, dtype=np.float64)
+    return np.searchsorted(thresholds, -caps, side="left")
+
+
+def _first_argmin(values):
+    """行ごとの最小値の位置 (欠損は無視、同値は先頭)"""
+    return np.where(np.isnan(values), np.inf, values).argmin(axis=1)
+
+
+def _evaluate(a):
+    """
+    評価日ごとの戦略判定。順ロジ → 逆ロジ → 順張り → 底打反転 → 逆張り の順に採用する。
+    戻り値: (分岐コード, 買値, 半分利確, 全利確, 損切り) の配列
+    """
+    close, open_, high, low = a["close"], a["open"], a["high"], a["low"]
+    prev_close, ma5, ma25, ma75 = a["prev_close"], a["ma5"], a["ma25"], a["ma75"]
+    rsi, vr, curr = a["rsi"], a["vol_ratio"], a["curr"]
+    cat = a["category"]
+    half_pct = np.take(HALF_TARGET_PCT, cat)
+    full_pct = np.take(FULL_TARGET_PCT, cat)
+
+    body = np.abs(close - open_)
+    lower_wick = np.minimum(close, open_) - low
+    safe_body = np.where(body > 0, body, 1.0)
+    long_wick = (body > 0) & (lower_wick / safe_body >= 0.3)
+    vol_quality = (a["vol_sma5"] > 0) & (a["vol_sma3"] >= a["vol_sma5"] * 1.05)
+    nonzero = (ma5 != 0) & (close != 0) & (open_ != 0) & (high != 0) & (low != 0)
+
+    # 順ロジ: 5日線への押し目で、下ヒゲ/陽線 + 出来高増
+    bull = (
+        nonzero
+        & (prev_close != 0)
+        & ~((close < ma5) | ((close < prev_close) & (vr >= 1.5)))
+        & ~(
+            (open_ > prev_close * 1.01)
+            | (high >= ma5 * 1.01)
+            | (close > ma5 * 1.01)
+            | (close < prev_close * 0.995)
+        )
+        & vol_quality
+        & (np.abs((close - ma5) / ma5) <= 0.005)
+        & ((close > open_) | long_wick | ((body == 0) & (lower_wick > 0)))
+        & (vr >= np.select([cat >= 3, cat == 2], [1.7, 1.5], 1.3))
+        & (30 <= rsi)
+        & (rsi <= 60)
+        & (((close / ma5 - 1) * 100) <= 0.5)
+    )
+    # 逆ロジ: 売られ過ぎからの反発 (5日線の下)
+    bear = (
+        nonzero
+        & (ma25 != 0)
+        & ~(open_ < prev_close * 0.99)
+        & ((rsi <= 30) | (close < ma25 * 0.9))
+        & ((close > open_) | long_wick)
+        & (vr >= 1.3)
+        & vol_quality
+        & ~(close >= ma5)
+    )
+    trend = (ma5 > ma25) & (ma25 > ma75) & (curr > ma75)
+    bottom = (rsi <= 30) | a["is_div"] | (a["is_rci_rev"] & (rsi <= 45))
+    contrarian = (ma25 != 0) & (curr < ma25 * 0.9)
+
+    branch = np.select(
+        [bull, bear, trend & a["is_aoteng"], trend, bottom, contrarian],
+        [BULL, BEAR, TREND_AOTENG, TREND, BOTTOM, CONTRARIAN],
+        WAIT,
+    )
+
+    with np.errstate(invalid="ignore"):
+        ma5_int = np.where(ma5 > 0, np.trunc(ma5), 0)
+        to_ma5 = np.where(ma5 != 0, np.floor(ma5 - 1), 0)
+        to_ma25 = np.where(ma25 != 0, np.floor(ma25 - 1), 0)
+        trailing = np.floor(np.maximum(0, high - (a["atr"] * 2.5)))
+        stop_3pct = np.floor(close * (1 - 0.03))
+
+    buy = np.select(
+        [branch == BULL, branch == BEAR, (branch == TREND) | (branch == TREND_AOTENG)],
+        [np.floor(close), np.floor(close), ma5_int],
+        np.where((branch == BOTTOM) | (branch == CONTRARIAN), np.trunc(curr), ma5_int),
+    )
+    p_half = np.select(
+        [branch == BULL, branch == BEAR, branch == TREND, branch >= BOTTOM],
+        [
+            np.floor(close * (1 + half_pct)),
+            to_ma5,
+            np.floor(ma5_int * (1 + half_pct)),
+            to_ma5,
+        ],
+        0,
+    )
+    p_full = np.select(
+        [
+            branch == BULL,
+            branch == BEAR,
+            branch == TREND,
+            branch == TREND_AOTENG,
+            branch >= BOTTOM,
+        ],
+        [
+            np.floor(close * (1 + full_pct)),
+            to_ma25,
+            np.floor(ma5_int * (1 + full_pct)),
+            trailing,
+            to_ma25,
+        ],
+        0,
+    )
+    sl = np.select(
+        [(branch == BULL) | (branch == BEAR), branch == TREND_AOTENG],
+        [stop_3pct, trailing],
+        curr * 0.95,
+    )
+    return branch, buy, p_half, p_full, sl
+
+
+def score_rows(features, ends, row_counts, caps, vol_ratios, market_ratio=100.0):
+    """
+    features (指標列付きの日足。銘柄ごとに日付昇順で連結) の行位置 ends を評価日として
+    スコアを計算し、ScoreResult のリストで返す。
+    row_counts は評価日までのその銘柄の行数で、MIN_ROWS 以上であること。
+    caps / vol_ratios は評価日ごとの時価総額 (億円) と出来高倍率。
+    """
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(ends) == 0:
+        return []
+    caps = np.asarray(caps, dtype=np.float64)
+    vol_ratios = np.asarray(vol_ratios, dtype=np.float64)
+
+    def col(name):
+        return features[name].to_numpy(dtype=np.float64)
+
+    prev = ends - 1
+    close_all, high_all, low_all, rsi_all = (
+        col("Close"),
+        col("High"),
+        col("Low"),
+        col("RSI"),
+    )
+    close = close_all[ends]
+    a = {
+        "close": close,
+        "open": col("Open")[ends],
+        "high": high_all[ends],
+        "low": low_all[ends],
+        "prev_close": close_all[prev],
+        "ma5": col("SMA5")[ends],
+        "ma25": col("SMA25")[ends],
+        "ma75": col("SMA75")[ends],
+        "vol_sma3": col("Vol_SMA3")[ends],
+        "vol_sma5": col("Vol_SMA5")[ends],
+        "rsi": rsi_all[ends],
+        "atr": col("STD14")[ends],
+        "vol_ratio": vol_ratios,
+        "category": _category_index(caps),
+        # 判定・表示に使う現在値は小数1桁に丸める
+        "curr": np.array([round(float(c), 1) for c in close]),
+    }
+    rci, prev_rci = col("RCI")[ends], col("RCI")[prev]
+    curr, rsi, vr, ma5 = a["curr"], a["rsi"], vol_ratios, a["ma5"]
+
+    # 評価日から遡る WINDOW 行 (終値・安値・RSI・日付)
+    window_rows = ends[:, None] + np.arange(-WINDOW + 1, 1)
+    w_close = close_all[window_rows]
+    w_low = low_all[window_rows]
+    w_rsi = rsi_all[window_rows]
+    rows = np.arange(len(ends))
+
+    # モメンタム（直近5日の陽線確率）
+    up_days = (np.diff(w_close[:, -6:], axis=1) > 0).sum(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # --- 1. 鉄の掟 (Gatekeeper) 強制除外判定 ---
+        is_trend_dead = curr < a["ma75"]
+        is_supply_dead = (curr < a["prev_close"]) & (vr >= 1.5)
+        is_short_trend_dead = curr < ma5 * 0.98
+        is_illiquid = a["vol_sma5"] < 1000
+
+        # --- 2. ダイバージェンス & RCI好転 & 青天井 判定 ---
+        recent_low, past_low = w_low[:, -8:], w_low[:, -40:-8]
+        i_recent, i_past = _first_argmin(recent_low), _first_argmin(past_low)
+        rsi_recent = w_rsi[:, -8:][rows, i_recent]
+        rsi_past = w_rsi[:, -40:-8][rows, i_past]
+        a["is_div"] = (
+            (recent_low[rows, i_recent] < past_low[rows, i_past] * 0.99)
+            & (rsi_recent > rsi_past + 5)
+            & (rsi_past < 40)
+        )
+        a["is_rci_rev"] = ((prev_rci < -80) & (rci > prev_rci) & (rci > -80)) | (
+            (prev_rci < -70) & (rci > prev_rci + 10)
+        )
+        high_250d = col("High_250d")[prev]
+        a["is_aoteng"] = (high_250d > 0) & (curr > high_250d) & (rsi < 80) & (vr >= 1.5)
+
+        # --- 3. フラグ判定 ---
+        # 週足の判定は指標列の13週平均を読むだけ (欠損は False)
+        is_weekly_up = close >= col("Weekly_SMA13")[ends]
+        is_squeeze = (np.asarray(row_counts) >= 120) & (
+            col("BB_Width")[ends] <= col("BB_Width_Min120")[ends] * 1.1
+        )
+        lookback_75_high = col("High_75d")[prev]
+        is_breakout = curr > lookback_75_high
+
+        # 最大含損率(MDD)と急落判定
+        c75 = w_close[:, -75:]
+        max_1d_drop = np.fmin.reduce(c75[:, 1:] / c75[:, :-1] - 1, axis=1)
+        max_3d_drop = np.fmin.reduce(c75[:, 3:] / c75[:, :-3] - 1, axis=1)
+        is_large = caps >= 3000
+        is_plunge = (is_large & ((max_1d_drop <= -0.04) | (max_3d_drop <= -0.08))) | (
+            ~is_large & ((max_1d_drop <= -0.07) | (max_3d_drop <= -0.12))
+        )
+        dd_abs_val = (
+            np.fmin.reduce(c75 / np.fmax.accumulate(c75, axis=1) - 1, axis=1) * 100
+        )
+
+        # --- 4. 戦略評価 ---
+        branch, buy, p_half, p_full, sl = _evaluate(a)
+
+    rsi_penalty_threshold = np.where(a["category"] <= 1, 80, 70)
+    results = []
+    for i in range(len(ends)):
+        momentum_str = f"{(up_days[i] / 5) * 100:.0f}%"
+        if (
+            is_trend_dead[i]
+            or is_supply_dead[i]
+            or is_short_trend_dead[i]
+            or is_illiquid[i]
+        ):
+            reasons = [
+                label
+                for flag, label in (
+                    (is_trend_dead[i], "長期トレンド崩壊"),
+                    (is_supply_dead[i], "需給悪化"),
+                    (is_short_trend_dead[i], "短期トレンド喪失"),
+                    (is_illiquid[i], "流動性欠如"),
+                )
+                if flag
+            ]
+            results.append(
+                ScoreResult(
+                    0,
+                    {"鉄の掟（除外）": -50},
+                    "⛔対象外",
+                    0,
+                    0,
+                    0,
+                    0,
+                    False,
+                    0,
+                    rsi[i],
+                    a["atr"][i],
+                    " | ".join(reasons),
+                    momentum_str,
+                    rci[i],
+                    0,
+                    0,
+                )
+            )
+            continue
+        results.append(
+            _finish_row(
+                i,
+                a,
+                branch[i],
+                buy[i],
+                p_half[i],
+                p_full[i],
+                sl[i],
+                is_breakout[i],
+                lookback_75_high[i],
+                is_weekly_up[i],
+                is_squeeze[i],
+                dd_abs_val[i],
+                is_plunge[i],
+                up_days[i],
+                rsi_penalty_threshold[i],
+                rci[i],
+                momentum_str,
+                market_ratio,
+            )
+        )
+    return results
+
+
+def _finish_row(
+    i,
+    a,
+    branch,
+    buy,
+    p_half,
+    p_full,
+    sl,
+    is_breakout,
+    lookback_75_high,
+    is_weekly_up,
+    is_squeeze,
+    dd_abs_val,
+    is_plunge,
+    up_days,
+    rsi_penalty_threshold,
+    rci_val,
+    momentum_str,
+    market_ratio,
+):
+    """1評価日分の価格の確定 (ブレイク時の上書き) と加減点の集計"""
+    # 現在値は Python の float (丸め・価格計算を従来の1銘柄版と同じ型で行う)
+    curr, rsi_val, vol_ratio = float(a["curr"][i]), a["rsi"][i], a["vol_ratio"][i]
+    atr_smoothed, is_aoteng = a["atr"][i], a["is_aoteng"][i]
+    is_div, is_rci_rev = a["is_div"][i], a["is_rci_rev"][i]
+
+    strategy = STRATEGY_NAMES[branch]
+    buy_target, p_half, p_full = int(buy), int(p_half), int(p_full)
+    sl_ma = int(sl) if branch in (BULL, BEAR, TREND_AOTENG) else float(sl)
+    sl_pct = ((curr / sl_ma) - 1) * 100 if curr > 0 and sl_ma > 0 else 0.0
+
+    oshime_price = 0
+    if is_breakout:
+        strategy = "🚀ブレイク"
+        ma5 = a["ma5"][i]
+        oshime_price = round(max(lookback_75_high, ma5), 1)
+        buy_target = curr
+        atr_sl_calc = round(curr - max(atr_smoothed * 1.5, curr * 0.01), 1)
+
+        if is_aoteng:
+            max_high_today = a["high"][i]
+            sl_ma = round(max(0, max_high_today - (atr_smoothed * 2.5)), 1)
+            p_full = sl_ma
+            p_half = 0
+        else:
+            p_half = round(buy_target * 1.05, 1)
+            p_full = round(buy_target * 1.10, 1)
+            sl_ma = round(max(atr_sl_calc, buy_target * 0.96), 1)
+        sl_pct = ((curr / sl_ma) - 1) * 100 if sl_ma > 0 else 0.0
+
+    # --- 5. スコアリング ---
+    score = 50
+    factors = {"基礎点": 50}
+    trend_sum = 0
+
+    if is_weekly_up:
+        factors["週足上昇"] = 5
+        trend_sum += 5
+    else:
+        score -= 20
+        factors["週足下落"] = -20
+
+    for flag, label, point in (
+        (is_breakout, "新高値ブレイク", 15),
+        (is_squeeze, "スクイーズ", 10),
+        ("🚀" in strategy, "戦略優位性", 15),
+        (is_div, "RSIダイバー", 15),
+        (is_rci_rev, "RCI好転", 10),
+        (is_aoteng, "青天井", 15),
+    ):
+        if flag:
+            factors[label] = point
+            trend_sum += point
+
+    score += trend_sum
+
+    if market_ratio >= 125.0:
+        score -= 10
+        factors["市場過熱"] = -10
+
+    # R/R比判定
+    if is_breakout and oshime_price > 0 and not is_aoteng:
+        risk = oshime_price - sl_ma
+        target_avg = (p_half + p_full) / 2 if p_half > 0 else p_full
+        reward = target_avg - oshime_price
+        if risk > 0 and reward > 0:
+            rr_ratio = reward / risk
+            if rr_ratio >= 2.0:
+                factors["高R/R比"] = 20
+                score += 20
+            elif rr_ratio < 0.8:
+                factors["低R/R比"] = -25
+                score -= 25
+
+    if dd_abs_val > -1.0:
+        factors["低含損率"] = 5
+        score += 5
+    elif dd_abs_val < -15.0 or is_plunge:
+        factors["高含損リスク"] = -15
+        score -= 15
+
+    if 55 <= rsi_val <= 65:
+        score += 5
+        factors["RSI適正"] = 5
+
+    if rsi_val >= rsi_penalty_threshold and not is_aoteng:
+        score -= 15
+        factors["RSIペナルティ"] = -15
+
+    if vol_ratio > 1.5:
+        score += 10
+        factors["出来高急増"] = 10
+
+    if up_days >= 4:
+        score += 5
+        factors["直近勢い"] = 5
+
+    return ScoreResult(
+        score,
+        factors,
+        strategy,
+        buy_target,
+        p_half,
+        p_full,
+        sl_ma,
+        is_aoteng,
+        sl_pct,
+        rsi_val,
+        atr_smoothed,
+        "通常レンジ",
+        momentum_str,
+        rci_val,
+        oshime_price,
+        dd_abs_val,
+    )
+
+
+def score_frame(df, cap, vol_ratios, market_ratio=100.0):
+    """
+    1銘柄の日足の直近 len(vol_ratios) 日分のスコアを古い順のリストで返す。
+    vol_ratios は各日に適用する出来高倍率 (古い順)。履歴が MIN_ROWS 行に
+    満たない日は SCORE_NO_DATA。
+    """
+    df = ensure_features(df)
+    n = len(df)
+    ends = np.arange(n - len(vol_ratios), n)
+    ok = ends + 1 >= MIN_ROWS
+    scored = iter(
+        score_rows(
+            df,
+            ends[ok],
+            ends[ok] + 1,
+            np.full(ok.sum(), cap, dtype=np.float64),
+            np.asarray(vol_ratios, dtype=np.float64)[ok],
+            market_ratio,
+        )
+    )
+    return [next(scored) if k else SCORE_NO_DATA for k in ok]
+
+
+def score_panel(panel, caps, vol_ratios=None, market_ratio=100.0, features=None):
+    """
+    複数銘柄の日足 (indicators.to_panel が受け付ける形式) を一括で評価し、
+    銘柄ごとの最終日のスコアを code インデックス・SCORE_FIELDS 列の DataFrame で返す。
+    caps / vol_ratios は {コード: 値} (または Series)。出来高倍率の既定は 1.0。
+    features に build_panel_features の結果を渡せば指標計算を省略する。
+    """
+    if features is None:
+        features = build_panel_features(panel)
+    codes = features.index.get_level_values(0)
+    n = len(features)
+    if n == 0:
+        return pd.DataFrame(columns=SCORE_FIELDS)
+    is_last = np.ones(n, dtype=bool)
+    is_last[:-1] = codes[1:] != codes[:-1]
+    ends = np.flatnonzero(is_last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    end_codes = codes[ends]
+
+    caps = pd.Series(caps, dtype=np.float64).reindex(end_codes).fillna(0).to_numpy()
+    if vol_ratios is None:
+        vol_ratios = np.ones(len(ends))
+    else:
+        vol_ratios = (
+            pd.Series(vol_ratios, dtype=np.float64)
+            .reindex(end_codes)
+            .fillna(1.0)
+            .to_numpy()
+        )
+
+    row_counts = ends - starts + 1
+    ok = row_counts >= MIN_ROWS
+    scored = iter(
+        score_rows(
+            features, ends[ok], row_counts[ok], caps[ok], vol_ratios[ok], market_ratio
+        )
+    )
+    rows = [next(scored) if k else SCORE_NO_DATA for k in ok]
+    return pd.DataFrame(
+        rows, index=pd.Index(end_codes, name="code"), columns=SCORE_FIELDS
+    )
@@ -0,0 +1,280 @@
+"""
+ローカル永続ストア (SQLite)
+
+Streamlit の再起動後も残るよう、日足などの取得済みデータを
+CACHE_DIR (既定: アプリと同じ階層の .cache/) に保存する。
+週足の判定 (indicators の Weekly_SMA13) は評価日ごとに日足から求めるため、上位足は保存しない。
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import closing
+
+import pandas as pd
+
+CACHE_DIR = os.environ.get(
+    "STOCK_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"),
+)
+BARS_DB = "bars.sqlite3"
+BAR_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+OBSOLETE_TABLES = ("weekly_bars", "monthly_bars")
+
+
+def connect(db_name):
+    """
+    CACHE_DIR 配下の SQLite に接続する。
+    複数セッション・複数プロセスからの同時アクセスに備えて WAL を使う。
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(CACHE_DIR, db_name), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class BarStore:
+    """
+    銘柄ごとの日足を保持するストア。
+    物理的には1テーブルだが、(code, date) を主キーにして銘柄単位で読み書きする。
+    """
+
+    def __init__(self, db_name=BARS_DB):
+        self.db_name = db_name
+        with closing(connect(self.db_name)) as conn, conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS daily_bars (
+                    code TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    open REAL, high REAL, low REAL, close REAL, volume REAL,
+                    PRIMARY KEY (code, date)
+                ) WITHOUT ROWID
+                """
+            )
+            # 以前の版が作っていた週足・月足のテーブル (どこからも読まれない)
+            for table in OBSOLETE_TABLES:
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS intraday_volume (
+                    code TEXT NOT NULL,
+                    ts TEXT NOT NULL,
+                    volume REAL,
+                    PRIMARY KEY (code, ts)
+                ) WITHOUT ROWID
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS market_caps (
+                    code TEXT PRIMARY KEY,
+                    cap REAL NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS volume_profile (
+                    bucket TEXT NOT NULL,
+                    minute INTEGER NOT NULL,
+                    weight REAL NOT NULL,
+                    PRIMARY KEY (bucket, minute)
+                ) WITHOUT ROWID
+                """
+            )
+
+    def codes(self):
+        """日足を保存済みの銘柄コード (昇順)"""
+        with closing(connect(self.db_name)) as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT code FROM daily_bars ORDER BY code"
+            ).fetchall()
+        return [code for (code,) in rows]
+
+    def date_range(self, codes=None):
+        """保存済みの日足の (最初の日, 最後の日)。codes で銘柄を絞れる"""
+        sql = "SELECT MIN(date), MAX(date) FROM daily_bars"
+        params = list(codes or [])
+        if params:
+            sql += f" WHERE code IN ({','.join('?' * len(params))})"
+        with closing(connect(self.db_name)) as conn:
+            first, last = conn.execute(sql, params).fetchone()
+        if first is None:
+            return None, None
+        return pd.Timestamp(first), pd.Timestamp(last)
+
+    def first_dates(self, codes):
+        """{コード: 最初の保存日(Timestamp)} を返す。未保存の銘柄は含まない"""
+        return self._dates(codes, "MIN")
+
+    def last_dates(self, codes):
+        """{コード: 最終保存日(Timestamp)} を返す。未保存の銘柄は含まない"""
+        return self._dates(codes, "MAX")
+
+    def _dates(self, codes, func):
+        codes = list(codes)
+        if not codes:
+            return {}
+        placeholders = ",".join("?" * len(codes))
+        with closing(connect(self.db_name)) as conn:
+            rows = conn.execute(
+                f"SELECT code, {func}(date) FROM daily_bars "
+                f"WHERE code IN ({placeholders}) GROUP BY code",
+                codes,
+            ).fetchall()
+        return {code: pd.Timestamp(d) for code, d in rows if d}
+
+    def load(self, code, start=None):
+        """保存済みの日足を Date インデックスの DataFrame で返す"""
+        with closing(connect(self.db_name)) as conn:
+            return _load_daily(conn, code, start)
+
+    def upsert(self, code, df):
+        """
+        日足を追記する。同じ日付の行は上書き (場中の未確定足の更新を含む)。
+        """
+        if df is None or df.empty:
+            return 0
+        with closing(connect(self.db_name)) as conn, conn:
+            return _insert_daily(conn, code, df)
+
+    def replace(self, code, df):
+        """
+        銘柄の日足を df で置き換える (株式分割などで過去の価格が調整された場合)。
+        """
+        with closing(connect(self.db_name)) as conn, conn:
+            conn.execute("DELETE FROM daily_bars WHERE code = ?", (code,))
+            return _insert_daily(conn, code, df)
+
+    def upsert_intraday(self, code, df):
+        """1分足の出来高 (DatetimeIndex は JST、Volume 列) を追記する"""
+        if df is None or df.empty:
+            return 0
+        volume = df["Volume"].dropna()
+        rows = [
+            (code, pd.Timestamp(idx).strftime("%Y-%m-%d %H:%M"), float(v))
+            for idx, v in zip(volume.index, volume.to_numpy())
+        ]
+        with closing(connect(self.db_name)) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO intraday_volume (code, ts, volume) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def load_intraday(self, start=None):
+        """保存済みの1分足の出来高を、ts インデックス・code / Volume 列で返す"""
+        sql = "SELECT ts, code, volume FROM intraday_volume"
+        params = []
+        if start is not None:
+            sql += " WHERE ts >= ?"
+            params.append(pd.Timestamp(start).strftime("%Y-%m-%d"))
+        with closing(connect(self.db_name)) as conn:
+            rows = conn.execute(sql, params).fetchall()
+        df = pd.DataFrame(rows, columns=["ts", "code", "Volume"])
+        df["ts"] = pd.to_datetime(df["ts"])
+        return df.set_index("ts")
+
+    def intraday_codes(self, start=None):
+        """1分足の出来高を保存済みの銘柄コード"""
+        sql = "SELECT DISTINCT code FROM intraday_volume"
+        params = []
+        if start is not None:
+            sql += " WHERE ts >= ?"
+            params.append(pd.Timestamp(start).strftime("%Y-%m-%d"))
+        with closing(connect(self.db_name)) as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [code for (code,) in rows]
+
+    def delete_intraday(self, before):
+        """before より前の1分足の出来高を消す"""
+        with closing(connect(self.db_name)) as conn, conn:
+            conn.execute(
+                "DELETE FROM intraday_volume WHERE ts < ?",
+                (pd.Timestamp(before).strftime("%Y-%m-%d"),),
+            )
+
+    def save_caps(self, caps):
+        """{コード: 時価総額(億円)} を保存する (同じ銘柄は上書き)"""
+        today = pd.Timestamp.now().strftime("%Y-%m-%d")
+        rows = [(code, float(cap), today) for code, cap in caps.items() if cap]
+        if not rows:
+            return
+        with closing(connect(self.db_name)) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO market_caps (code, cap, updated_at) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+
+    def load_caps(self):
+        """保存済みの時価総額を {コード: 億円} で返す (分析した銘柄の直近値)"""
+        with closing(connect(self.db_name)) as conn:
+            rows = conn.execute("SELECT code, cap FROM market_caps").fetchall()
+        return dict(rows)
+
+    def save_volume_profile(self, weights):
+        """校正した累積出来高比率 {区分: 1分刻みの配列 (09:00 起点)} を保存する"""
+        with closing(connect(self.db_name)) as conn, conn:
+            for bucket, curve in weights.items():
+                conn.execute("DELETE FROM volume_profile WHERE bucket = ?", (bucket,))
+                conn.executemany(
+                    "INSERT INTO volume_profile (bucket, minute, weight) "
+                    "VALUES (?, ?, ?)",
+                    [(bucket, i, float(w)) for i, w in enumerate(curve)],
+                )
+
+    def load_volume_profile(self):
+        """保存済みの累積出来高比率を {区分: 配列} で返す (未保存なら空)"""
+        with closing(connect(self.db_name)) as conn:
+            rows = conn.execute(
+                "SELECT bucket, weight FROM volume_profile ORDER BY bucket, minute"
+            ).fetchall()
+        weights = {}
+        for bucket, w in rows:
+            weights.setdefault(bucket, []).append(w)
+        return weights
+
+
+def _insert_daily(conn, code, df):
+    bars = df[BAR_COLUMNS].dropna(subset=["Close"])
+    rows = [
+        (code, pd.Timestamp(idx).strftime("%Y-%m-%d"), *map(float, vals))
+        for idx, vals in zip(bars.index, bars.to_numpy())
+    ]
+    conn.executemany(
+        "INSERT OR REPLACE INTO daily_bars "
+        "(code, date, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    return len(rows)
+
+
+def _load_daily(conn, code, start=None):
+    sql = "SELECT date, open, high, low, close, volume FROM daily_bars WHERE code = ?"
+    params = [code]
+    if start is not None:
+        sql += " AND date >= ?"
+        params.append(pd.Timestamp(start).strftime("%Y-%m-%d"))
+    sql += " ORDER BY date"
+    rows = conn.execute(sql, params).fetchall()
+    df = pd.DataFrame(rows, columns=["Date"] + BAR_COLUMNS)
+    df["Date"] = pd.to_datetime(df["Date"])
+    return df.set_index("Date")
+
+
+_bar_store = None
+_bar_store_lock = threading.Lock()
+
+
+def get_bar_store():
+    """プロセス内で共有する BarStore を返す"""
+    global _bar_store
+    with _bar_store_lock:
+        if _bar_store is None:
+            _bar_store = BarStore()
+        return _bar_store
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def random_bars():
+    """乱数の種から決まる日足 (Open/High/Low/Close/Volume) を作る関数"""
+
+    def make(seed, n=160, drift=0.0, vol=0.02):
+        rng = np.random.default_rng(seed)
+        close = 1000.0 * np.exp(np.cumsum(rng.normal(drift, vol, n)))
+        open_ = close * (1 + rng.normal(0, 0.005, n))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, n)))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, n)))
+        volume = rng.integers(20_000, 200_000, n).astype(float)
+        return pd.DataFrame(
+            {
+                "Open": open_.round(1),
+                "High": high.round(1),
+                "Low": low.round(1),
+                "Close": close.round(1),
+                "Volume": volume,
+            },
+            index=pd.bdate_range("2025-03-03", periods=n),
+        )
+
+    return make
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+import analysis_cache
+import storage
+from analysis_cache import AnalysisCache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(analysis_cache, "ARCHIVE_MODE", False)
+    monkeypatch.setattr(analysis_cache, "LEASE_POLL", 0.02)
+
+
+def run_together(caches, compute):
+    """各 cache から同じキーを同時に求め、結果の一覧を返す"""
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda c=c: results.append(
+                c.get_or_compute("info", "7203", "closed:2026-10-16", compute)
+            )
+        )
+        for c in caches
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def counting(seconds):
+    calls = []
+
+    def compute():
+        calls.append(threading.get_ident())
+        time.sleep(seconds)
+        return {"price": 2500.0, "call": len(calls)}
+
+    return compute, calls
+
+
+def test_threads_compute_once():
+    cache = AnalysisCache()
+    compute, calls = counting(0.2)
+    results = run_together([cache] * 6, compute)
+    assert len(calls) == 1
+    assert results == [{"price": 2500.0, "call": 1}] * 6
+    assert cache._key_locks == {}
+
+
+def test_processes_compute_once_beyond_lease(monkeypatch):
+    # 別インスタンス = 別プロセス。計算がリースの期限より長くても延長で引き継がれない
+    monkeypatch.setattr(analysis_cache, "LEASE_SECONDS", 0.3)
+    compute, calls = counting(1.0)
+    results = run_together([AnalysisCache() for _ in range(3)], compute)
+    assert len(calls) == 1
+    assert results == [{"price": 2500.0, "call": 1}] * 3
+
+
+def test_failed_result_is_not_saved():
+    cache = AnalysisCache()
+    assert cache.get_or_compute("info", "7203", "s", lambda: None) is None
+    assert cache.get("info", "7203", "s") is None
+    assert cache.get_or_compute("info", "7203", "s", lambda: 1) == 1
+
+
+def test_expired_lease_is_taken_over(monkeypatch):
+    crashed = AnalysisCache()
+    monkeypatch.setattr(analysis_cache, "LEASE_SECONDS", 0.1)
+    assert crashed._claim("info", "7203", "s")  # 解放せずに落ちた
+    other = AnalysisCache()
+    assert not other._claim("info", "7203", "s")
+    time.sleep(0.15)
+    assert other.get_or_compute("info", "7203", "s", lambda: 1) == 1
+
+
+def test_put_prunes_old_entries_and_leases(monkeypatch):
+    cache = AnalysisCache()
+    cache.put("info", "7203", "old", 1)
+    with cache._conn() as conn:
+        conn.execute("UPDATE entries SET saved_at = 0")
+        conn.execute("INSERT INTO leases VALUES ('info', '6758', 's', 'dead', 0)")
+    cache.put("info", "7203", "new", 2)
+    assert cache.get("info", "7203", "old") == 1  # PRUNE_INTERVAL 内は消さない
+
+    monkeypatch.setattr(analysis_cache, "PRUNE_INTERVAL", 0)
+    cache.put("info", "7203", "newer", 3)
+    assert cache.get("info", "7203", "old") is None
+    assert cache.get("info", "7203", "new") == 2
+    assert cache._conn().execute("SELECT COUNT(*) FROM leases").fetchone() == (0,)
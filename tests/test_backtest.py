@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest import simulate_trades, summarize_trades
+from indicators import build_features
+
+
+def loop_trades(features, target_pct, hold_days=10):
+    """配列化する前の run_backtest_precise (iloc の行ループ) と同じ判定"""
+    n = len(features)
+    trades = []
+    i = 1
+    while i < n - hold_days:
+        prev, curr = features.iloc[i - 1], features.iloc[i]
+        if (
+            pd.isna(prev["Low"])
+            or pd.isna(prev["SMA5"])
+            or pd.isna(prev["SMA25"])
+            or prev["SMA5"] == 0
+            or prev["SMA25"] == 0
+        ):
+            i += 1
+            continue
+        is_ma5 = (
+            prev["SMA5"] > prev["SMA25"]
+            and prev["Low"] <= prev["SMA5"] * 1.005
+            and not curr["Open"] < prev["Close"] * 0.99
+            and (curr["Close"] > curr["Open"] or curr["High"] >= prev["High"])
+        )
+        is_aoteng = (
+            curr["High"] >= curr["High_250d"] > 0
+            and curr["Volume"] >= curr["Vol_SMA5"] * 1.5
+        )
+        if not (is_ma5 or is_aoteng):
+            i += 1
+            continue
+        entry = prev["SMA5"] if is_ma5 and not is_aoteng else curr["Close"]
+        if is_aoteng:
+            target, stop = entry * 1.5, entry - curr["ATR"] * 2.5
+        else:
+            target, stop = entry * (1 + target_pct), entry * 0.97
+        win, held, min_low = False, 0, entry
+        for j in range(1, hold_days + 1):
+            future = features.iloc[i + j]
+            held = j
+            min_low = min(min_low, future["Low"])
+            if future["High"] >= target and not is_aoteng:
+                win = True
+                break
+            if future["Low"] <= stop:
+                break
+        if is_aoteng and held == hold_days and min_low > stop:
+            win = True
+        drawdown = (min_low / entry - 1) * 100 if min_low < entry else 0.0
+        trades.append((features.index[i], win, drawdown))
+        i += max(1, held) + 1
+    return trades
+
+
+@pytest.mark.parametrize("seed", range(12))
+@pytest.mark.parametrize("drift", [0.003, 0.0, -0.002])
+@pytest.mark.parametrize("lookback", [75, None])
+def test_simulate_trades_matches_row_loop(random_bars, seed, drift, lookback):
+    features = build_features(random_bars(seed, n=300, drift=drift))
+    expected = loop_trades(
+        features if lookback is None else features.tail(lookback), 0.04
+    )
+    trades = simulate_trades(features, 0.04, lookback=lookback)
+    assert list(trades["date"]) == [t[0] for t in expected]
+    assert list(trades["win"]) == [t[1] for t in expected]
+    np.testing.assert_allclose(
+        trades["drawdown_pct"].astype(float), [t[2] for t in expected]
+    )
+
+
+def test_summarize_trades(random_bars):
+    features = build_features(random_bars(3, n=300, drift=0.003))
+    trades = simulate_trades(features, 0.04, lookback=None)
+    wins, losses, worst = summarize_trades(trades)
+    assert wins + losses == len(trades) > 0
+    assert wins == int(trades["win"].sum())
+    assert worst == min(0.0, trades["drawdown_pct"].min())
+
+
+def test_short_history_has_no_trades(random_bars):
+    features = build_features(random_bars(0, n=11))
+    assert simulate_trades(features, 0.04).empty
@@ -0,0 +1,77 @@
+import pytest
+
+import checkpoint
+import storage
+from checkpoint import ScanCheckpoint
+from results import AnalysisRecord
+
+CODES = ["7203", "6758", "9984", "8306"]
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "CACHE_DIR", str(tmp_path))
+
+
+def record(code):
+    return AnalysisRecord(code=code, price=float(code))
+
+
+def test_resume_restores_saved_records():
+    first = ScanCheckpoint(CODES, "closed:2026-10-16", "tab-a")
+    first.save([(0, record("7203")), (2, record("9984"))])
+
+    resumed = ScanCheckpoint(CODES, "closed:2026-10-16", "tab-a")
+    restored = resumed.load()
+    assert sorted(restored) == [0, 2]
+    assert restored[2].code == "9984" and restored[2].price == 9984.0
+
+
+def test_changed_input_or_phase_starts_over():
+    ScanCheckpoint(CODES, "closed:2026-10-16", "tab-a").save([(0, record("7203"))])
+    # 並びが変われば別の入力
+    assert ScanCheckpoint(CODES[::-1], "closed:2026-10-16", "tab-a").load() == {}
+    assert ScanCheckpoint(CODES, "closed:2026-10-19", "tab-a").load() == {}
+    # フェーズが変わった時点で以前の途中経過は消えている
+    assert ScanCheckpoint(CODES, "closed:2026-10-16", "tab-a").load() == {}
+
+
+def test_finished_scan_starts_over():
+    scan = ScanCheckpoint(CODES, "closed:2026-10-16", "tab-a")
+    scan.save([(0, record("7203"))])
+    scan.finish()
+    assert ScanCheckpoint(CODES, "closed:2026-10-16", "tab-a").load() == {}
+
+
+def test_owners_do_not_share_or_clear_each_other():
+    a = ScanCheckpoint(CODES, "closed:2026-10-16", "tab-a")
+    b = ScanCheckpoint(CODES, "closed:2026-10-16", "tab-b")
+    a.save([(0, record("7203"))])
+    b.save([(1, record("6758"))])
+    assert list(a.load()) == [0]
+    assert list(b.load()) == [1]
+
+    b.finish()
+    assert list(ScanCheckpoint(CODES, "closed:2026-10-16", "tab-a").load()) == [0]
+
+
+def test_live_phase_drops_old_records(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(checkpoint.time, "time", lambda: now[0])
+    scan = ScanCheckpoint(CODES, "live:2026-10-19", "tab-a")
+    scan.save([(0, record("7203"))])
+    now[0] += checkpoint.LIVE_RECORD_MAX_AGE - 1
+    scan.save([(1, record("6758"))])
+    assert sorted(scan.load()) == [0, 1]
+
+    now[0] += 2
+    assert list(scan.load()) == [1]
+
+
+def test_closed_phase_keeps_old_records(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(checkpoint.time, "time", lambda: now[0])
+    scan = ScanCheckpoint(CODES, "closed:2026-10-16", "tab-a")
+    scan.save([(0, record("7203"))])
+    now[0] += 24 * 3600
+    assert list(scan.load()) == [0]
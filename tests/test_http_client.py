@@ -0,0 +1,35 @@
+import threading
+
+from http_client import count_requests, host_slot
+
+
+def _take_slot():
+    with host_slot("kabutan.jp"):
+        pass
+
+
+def test_count_requests_reports_slots_in_this_thread():
+    seen = []
+    with count_requests(lambda host, n: seen.append((host, n))):
+        with host_slot("https://kabutan.jp/stock/?code=7203"):
+            pass
+        with host_slot("finance.yahoo.com", tokens=3):
+            pass
+        # 別スレッドの取得は数えない
+        worker = threading.Thread(target=_take_slot)
+        worker.start()
+        worker.join()
+    with host_slot("kabutan.jp"):
+        pass
+    assert seen == [("kabutan.jp", 1), ("finance.yahoo.com", 3)]
+
+
+def test_count_requests_restores_outer_callback():
+    outer, inner = [], []
+    with count_requests(lambda host, n: outer.append(n)):
+        with count_requests(lambda host, n: inner.append(n)):
+            with host_slot("finance.yahoo.com", tokens=2):
+                pass
+        with host_slot("finance.yahoo.com"):
+            pass
+    assert inner == [2] and outer == [1]
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicators import IndicatorState, build_features
+
+
+def live_bar(df, seed):
+    """最終日の足を場中の値動きに見立てて置き換える"""
+    rng = np.random.default_rng(seed)
+    last = df.iloc[-1]
+    close = round(last["Close"] * (1 + rng.normal(0, 0.02)), 1)
+    return {
+        "Open": last["Open"],
+        "High": max(last["High"], close),
+        "Low": min(last["Low"], close),
+        "Close": close,
+        "Volume": last["Volume"] * rng.uniform(0.2, 1.5),
+    }
+
+
+def with_last(df, bar):
+    df = df.copy()
+    df.iloc[-1] = [bar[c] for c in df.columns]
+    return df
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("n", [30, 160, 300])
+def test_update_last_matches_build_features(random_bars, seed, n):
+    df = random_bars(seed, n=n)
+    state = IndicatorState(build_features(df))
+    for step in range(3):
+        bar = live_bar(df, seed * 10 + step)
+        values = state.update_last(bar)
+        expected = build_features(with_last(df, bar)).iloc[-1]
+        got = pd.Series(values)[expected.index]
+        np.testing.assert_allclose(got, expected, rtol=1e-9, atol=1e-9)
+    pd.testing.assert_frame_equal(
+        state.frame,
+        build_features(with_last(df, bar))[IndicatorState.COLUMNS],
+        rtol=1e-9,
+        atol=1e-9,
+    )
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_append_matches_build_features(random_bars, seed):
+    # 週をまたぐ日を含めて、確定した足を翌日の足で延ばしていく
+    full = random_bars(seed, n=200)
+    state = IndicatorState(build_features(full.iloc[:190]))
+    for i in range(190, 200):
+        bar = full.iloc[i]
+        values = state.append(full.index[i], bar)
+        expected = build_features(full.iloc[: i + 1]).iloc[-1]
+        got = pd.Series(values)[expected.index]
+        np.testing.assert_allclose(got, expected, rtol=1e-9, atol=1e-9)
@@ -0,0 +1,23 @@
+import math
+
+from results import AnalysisRecord, ResultTable
+
+
+def test_none_is_written_per_dtype():
+    table = ResultTable()
+    table.upsert(
+        [AnalysisRecord(code="7203", rsi=None, bt_win_count=None, is_aoteng=None)]
+    )
+    record = table.record("7203")
+    assert math.isnan(record.rsi)
+    assert record.bt_win_count == 0
+    assert record.is_aoteng is False
+
+
+def test_upsert_counts_updates():
+    table = ResultTable()
+    table.upsert([AnalysisRecord(code="7203", score=60)])
+    table.upsert([AnalysisRecord(code="7203", score=70), AnalysisRecord(code="6758")])
+    assert table.codes == ["7203", "6758"]
+    assert table.record("7203").score == 70
+    assert list(table.column("update_count")) == [2, 1]
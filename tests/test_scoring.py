@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scoring import (
+    CAP_CATEGORIES,
+    ScoreResult,
+    _category_index,
+    get_market_cap_category,
+    score_frame,
+)
+
+
+def make_bars(closes, volume=50_000.0):
+    closes = np.asarray(closes, dtype=float)
+    index = pd.bdate_range("2026-01-05", periods=len(closes))
+    return pd.DataFrame(
+        {
+            "Open": closes,
+            "High": closes * 1.01,
+            "Low": closes * 0.99,
+            "Close": closes,
+            "Volume": volume,
+        },
+        index=index,
+    )
+
+
+def test_gated_days_return_score_result():
+    # 下落が続き MA75 を割っている銘柄は前日・当日とも鉄の掟で除外される
+    df = make_bars(np.linspace(2000, 1000, 150))
+    prev_score, today_score = score_frame(df, 500, [1.0, 1.0])
+    for result in (prev_score, today_score):
+        assert isinstance(result, ScoreResult)
+        assert result.score == 0
+        assert result.strategy == "⛔対象外"
+        assert "長期トレンド崩壊" in result.atr_comment
+    assert today_score.score - prev_score.score == 0
+
+
+def test_gated_and_scored_days_share_result_type():
+    # 上昇基調の銘柄を、当日だけ出来高の無い状態 (流動性欠如) にする
+    df = make_bars(np.linspace(1000, 2000, 150))
+    scored = score_frame(df, 500, [1.0])[-1]
+    df.iloc[-5:, df.columns.get_loc("Volume")] = 0.0
+    gated = score_frame(df, 500, [1.0])[-1]
+    assert isinstance(scored, ScoreResult) and scored.strategy != "⛔対象外"
+    assert isinstance(gated, ScoreResult) and gated.strategy == "⛔対象外"
+    assert "流動性欠如" in gated.atr_comment
+
+
+def test_category_index_matches_scalar_thresholds():
+    # 閾値ちょうどの時価総額 (500億など) は上の区分に入る
+    caps = np.array([0, 99.9, 100, 499, 500, 2999, 3000, 9999, 10000, 20000.0])
+    expected = [get_market_cap_category(cap) for cap in caps]
+    assert [CAP_CATEGORIES[i] for i in _category_index(caps)] == expected
+
+
+# 配列化する前の calculate_score_and_logic (行ごとの pandas 版) の出力。
+# (種, ドリフト, 時価総額, 当日の出来高倍率) ->
+#     (前日の点, 当日の点, 戦略, (買値, 半分利確, 全利確, 損切り))
+LEGACY_SCORES = {
+    (0, 0.003, 500, 1.0): (55, 0, "⛔対象外", (0.0, 0.0, 0.0, 0.0)),
+    (2, 0.003, 500, 1.0): (60, 65, "🔥順張り", (1643.0, 1684.0, 1708.0, 1592.01)),
+    (2, 0.0, 500, 1.0): (65, 55, "様子見", (1023.0, 0.0, 0.0, 985.055)),
+    (4, 0.0, 500, 1.0): (65, 65, "🔥順張り", (1119.0, 1146.0, 1163.0, 1056.4)),
+    (13, 0.003, 500, 1.0): (45, 95, "🚀ブレイク", (2460.2, 2583.2, 2706.2, 2361.8)),
+    (32, 0.003, 5000, 1.8): (55, 110, "🚀ブレイク", (1826.7, 0.0, 1619.8, 1619.8)),
+    (47, 0.0, 500, 1.0): (0, 40, "様子見", (1036.0, 0.0, 0.0, 987.05)),
+    (30, 0.0, 500, 1.0): (55, 25, "様子見", (1276.0, 0.0, 0.0, 1209.255)),
+    (50, 0.0, 50, 0.7): (60, 115, "🚀ブレイク", (1031.3, 1082.9, 1134.4, 990.0)),
+}
+
+# 同じ評価での加減点の要因 (空白区切り、記載順)
+LEGACY_FACTORS = {
+    (0, 0.003, 500, 1.0): "鉄の掟（除外）",
+    (2, 0.003, 500, 1.0): "基礎点 週足上昇 RSI適正 直近勢い",
+    (2, 0.0, 500, 1.0): "基礎点 週足上昇",
+    (4, 0.0, 500, 1.0): "基礎点 週足上昇 スクイーズ",
+    (13, 0.003, 500, 1.0): "基礎点 週足上昇 新高値ブレイク 戦略優位性 高R/R比 "
+    "RSIペナルティ 直近勢い",
+    (32, 0.003, 5000, 1.8): "基礎点 週足上昇 新高値ブレイク 戦略優位性 青天井 "
+    "出来高急増",
+    (47, 0.0, 500, 1.0): "基礎点 週足下落 スクイーズ",
+    (30, 0.0, 500, 1.0): "基礎点 週足上昇 高含損リスク RSIペナルティ",
+    (50, 0.0, 50, 0.7): "基礎点 週足上昇 新高値ブレイク 戦略優位性 高R/R比 "
+    "RSI適正 直近勢い",
+}
+
+
+@pytest.mark.parametrize("case", list(LEGACY_SCORES))
+def test_score_frame_matches_legacy_scoring(random_bars, case):
+    seed, drift, cap, vol_ratio = case
+    prev, score, strategy, levels = LEGACY_SCORES[case]
+    df = random_bars(seed, drift=drift)
+    prev_result, today = score_frame(df, cap, [1.0, vol_ratio])
+    assert prev_result.score == prev
+    assert today.score == score
+    assert today.strategy == strategy
+    assert list(today.factors) == LEGACY_FACTORS[case].split()
+    if strategy != "⛔対象外":
+        assert sum(today.factors.values()) == score
+    got = (today.buy, today.p_half, today.p_full, today.sl_ma)
+    assert got == pytest.approx(levels, abs=1e-3)
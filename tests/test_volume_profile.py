@@ -0,0 +1,93 @@
+import datetime
+
+import pytest
+
+from volume_profile import VolumeProfile
+
+# 1分刻みの表にする前の get_volume_weight が使っていた折れ線
+LEGACY_MODELS = {
+    "large": {
+        540: 0.00,
+        570: 0.25,
+        600: 0.30,
+        690: 0.50,
+        750: 0.525,
+        780: 0.60,
+        900: 0.70,
+        925: 0.85,
+        930: 1.00,
+    },
+    "mid": {
+        540: 0.00,
+        570: 0.30,
+        600: 0.35,
+        690: 0.55,
+        750: 0.575,
+        780: 0.675,
+        900: 0.75,
+        925: 0.90,
+        930: 1.00,
+    },
+    "small": {
+        540: 0.00,
+        570: 0.40,
+        600: 0.45,
+        690: 0.65,
+        750: 0.675,
+        780: 0.75,
+        900: 0.88,
+        925: 0.95,
+        930: 1.00,
+    },
+}
+CAPS = {"large": 20000, "mid": 1000, "small": 100}
+
+
+def legacy_weight(current_dt, market_cap):
+    """場中の時刻について、以前の get_volume_weight と同じ補間をする"""
+    current_minutes = current_dt.hour * 60 + current_dt.minute
+    if current_dt.hour < 9 or current_minutes > 15 * 60:
+        return 1.0
+    if market_cap >= 5000:
+        weights = LEGACY_MODELS["large"]
+    elif market_cap >= 500:
+        weights = LEGACY_MODELS["mid"]
+    else:
+        weights = LEGACY_MODELS["small"]
+    last_weight, last_minutes = 0.0, 9 * 60
+    for end_minutes, weight in weights.items():
+        if current_minutes <= end_minutes:
+            if end_minutes == last_minutes:
+                return weight
+            progress = (current_minutes - last_minutes) / (end_minutes - last_minutes)
+            return max(0.01, last_weight + progress * (weight - last_weight))
+        last_weight, last_minutes = weight, end_minutes
+    return 1.0
+
+
+def at(hour, minute):
+    return datetime.datetime(2026, 10, 19, hour, minute)
+
+
+@pytest.mark.parametrize("bucket", list(CAPS))
+@pytest.mark.parametrize(
+    "hour, minute", [(9, 0), (9, 1), (10, 15), (12, 0), (15, 0), (15, 1), (15, 30)]
+)
+def test_default_table_matches_legacy_interpolation(bucket, hour, minute):
+    cap = CAPS[bucket]
+    expected = legacy_weight(at(hour, minute), cap)
+    assert VolumeProfile().weight(at(hour, minute), cap) == pytest.approx(expected)
+
+
+def test_session_open_has_no_estimate():
+    # 寄り付きの1分は 0 (呼び出し側で出来高倍率 1.0 に倒す)
+    profile = VolumeProfile()
+    assert all(profile.weight(at(9, 0), cap) == 0.0 for cap in CAPS.values())
+
+
+def test_every_session_minute_matches_legacy():
+    profile = VolumeProfile()
+    for minute in range(8 * 60 + 50, 15 * 60 + 40):
+        dt = at(minute // 60, minute % 60)
+        for cap in CAPS.values():
+            assert profile.weight(dt, cap) == pytest.approx(legacy_weight(dt, cap))
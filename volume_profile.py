@@ -0,0 +1,181 @@
+"""
+場中の出来高進捗 (時刻ごとの1日の出来高に対する累積比率)
+
+時価総額の区分ごとに 09:00〜15:30 (昼休みを含む) の1分刻みの配列を持ち、
+現在時刻の比率は配列を1回引くだけで求める。
+配列は既定の折れ線 (DEFAULT_BREAKPOINTS) から作るか、
+ローカルに保存した1分足の出来高から calibrate で推定する。
+1分足の取得と校正は calibrate_volume.py から行う。
+"""
+
+import numpy as np
+import pandas as pd
+
+SESSION_OPEN = 9 * 60  # 分 (0:00 起点)
+SESSION_CLOSE = 15 * 60 + 30
+MINUTES = SESSION_CLOSE - SESSION_OPEN + 1  # 配列の長さ (両端を含む)
+MIN_WEIGHT = 0.01  # 0 除算を避けるための下限 (寄り付きの1分を除く)
+
+# 時価総額 (億円) の区分
+CAP_BUCKETS = ("large", "mid", "small")
+CAP_BUCKET_THRESHOLDS = (5000, 500)
+
+# 手で決めた折れ線 (分: 累積比率)。校正データが無い区分はこれを使う
+# 15:00 を過ぎたら 1.0 (引けの板寄せ分は見込まない。実際の配分は校正で反映する)
+DEFAULT_BREAKPOINTS = {
+    "large": {
+        (9 * 60): 0.00,
+        (9 * 60 + 30): 0.25,
+        (10 * 60): 0.30,
+        (11 * 60 + 30): 0.50,
+        (12 * 60 + 30): 0.525,
+        (13 * 60): 0.60,
+        (15 * 60): 0.70,
+        (15 * 60 + 1): 1.00,
+        (15 * 60 + 30): 1.00,
+    },
+    "mid": {
+        (9 * 60): 0.00,
+        (9 * 60 + 30): 0.30,
+        (10 * 60): 0.35,
+        (11 * 60 + 30): 0.55,
+        (12 * 60 + 30): 0.575,
+        (13 * 60): 0.675,
+        (15 * 60): 0.75,
+        (15 * 60 + 1): 1.00,
+        (15 * 60 + 30): 1.00,
+    },
+    "small": {
+        (9 * 60): 0.00,
+        (9 * 60 + 30): 0.40,
+        (10 * 60): 0.45,
+        (11 * 60 + 30): 0.65,
+        (12 * 60 + 30): 0.675,
+        (13 * 60): 0.75,
+        (15 * 60): 0.88,
+        (15 * 60 + 1): 1.00,
+        (15 * 60 + 30): 1.00,
+    },
+}
+
+MIN_CALIBRATION_DAYS = 20  # 区分ごとに必要な (銘柄, 日) の数
+MIN_BARS_PER_DAY = 100  # これより1分足の少ない日は欠損が多いとみなして使わない
+
+
+def cap_bucket(market_cap):
+    if market_cap >= CAP_BUCKET_THRESHOLDS[0]:
+        return "large"
+    if market_cap >= CAP_BUCKET_THRESHOLDS[1]:
+        return "mid"
+    return "small"
+
+
+def weights_from_breakpoints(breakpoints):
+    """
+    折れ線 {分: 比率} を1分刻みの配列にする (線形補間)。
+    寄り付き (09:00) は折れ線の値のまま下限を掛けない。既定の 0 は「推定なし」で、
+    呼び出し側は出来高倍率を 1.0 とする。
+    """
+    minutes = np.arange(SESSION_OPEN, SESSION_CLOSE + 1)
+    xs = np.fromiter(breakpoints.keys(), dtype=np.float64)
+    ys = np.fromiter(breakpoints.values(), dtype=np.float64)
+    curve = np.interp(minutes, xs, ys)
+    weights = np.maximum(MIN_WEIGHT, curve)
+    weights[0] = curve[0]
+    return weights
+
+
+class VolumeProfile:
+    """区分ごとの1分刻みの累積出来高比率"""
+
+    def __init__(self, weights=None):
+        """weights: {区分: 長さ MINUTES の配列}。無い区分は既定の折れ線"""
+        weights = weights or {}
+        self.weights = {
+            bucket: (
+                np.asarray(weights[bucket], dtype=np.float64)
+                if bucket in weights
+                else weights_from_breakpoints(DEFAULT_BREAKPOINTS[bucket])
+            )
+            for bucket in CAP_BUCKETS
+        }
+        self.calibrated = sorted(set(weights) & set(CAP_BUCKETS))
+
+    def weight(self, current_dt, market_cap):
+        """current_dt (JST) 時点の累積比率。取引時間外は 1.0"""
+        minute = current_dt.hour * 60 + current_dt.minute
+        if minute < SESSION_OPEN or minute > SESSION_CLOSE:
+            return 1.0
+        return float(self.weights[cap_bucket(market_cap)][minute - SESSION_OPEN])
+
+    @classmethod
+    def calibrate(cls, intraday, caps, min_days=MIN_CALIBRATION_DAYS):
+        """
+        1分足の出来高から区分ごとの累積比率を推定する。
+        intraday: DatetimeIndex (JST) と code / Volume 列を持つ DataFrame
+        caps: {コード: 時価総額(億円)}。(銘柄, 日) ごとの累積比率の中央値を取り、
+        単調増加・終値で 1.0 になるよう整える。日数が min_days に満たない区分は既定値。
+        """
+        weights = {}
+        if intraday is None or intraday.empty:
+            return cls(weights)
+        stamps = pd.DatetimeIndex(intraday.index)
+        minute = stamps.hour * 60 + stamps.minute
+        in_session = (minute >= SESSION_OPEN) & (minute <= SESSION_CLOSE)
+        frame = pd.DataFrame(
+            {
+                "code": intraday["code"].to_numpy()[in_session],
+                "day": stamps.normalize()[in_session],
+                "slot": (minute[in_session] - SESSION_OPEN).to_numpy(),
+                "volume": intraday["Volume"].to_numpy(dtype=np.float64)[in_session],
+            }
+        )
+        day_key, days = pd.factorize(pd.MultiIndex.from_frame(frame[["code", "day"]]))
+        if len(days) == 0:
+            return cls(weights)
+
+        # (銘柄, 日) x 分 の出来高行列から累積比率を求める
+        volume = np.bincount(
+            day_key * MINUTES + frame["slot"].to_numpy(),
+            weights=np.nan_to_num(frame["volume"].to_numpy()),
+            minlength=len(days) * MINUTES,
+        ).reshape(len(days), MINUTES)
+        bar_count = np.bincount(day_key, minlength=len(days))
+        total = volume.sum(axis=1)
+        usable = (total > 0) & (bar_count >= MIN_BARS_PER_DAY)
+        cumulative = volume.cumsum(axis=1) / np.where(total > 0, total, 1)[:, None]
+
+        day_buckets = np.array(
+            [cap_bucket(caps.get(code, 0)) for code in days.get_level_values(0)]
+        )
+        for bucket in CAP_BUCKETS:
+            rows = usable & (day_buckets == bucket)
+            if rows.sum() < min_days:
+                continue
+            curve = np.median(cumulative[rows], axis=0)
+            curve = np.maximum.accumulate(np.clip(curve, MIN_WEIGHT, 1.0))
+            curve[-1] = 1.0
+            weights[bucket] = curve
+        return cls(weights)
+
+
+def calibrate_from_store(store, caps, start=None):
+    """
+    store (storage.BarStore) に保存した1分足から校正し、校正できた区分を
+    store に保存して VolumeProfile を返す。
+    """
+    profile = VolumeProfile.calibrate(store.load_intraday(start), caps)
+    store.save_volume_profile(
+        {bucket: profile.weights[bucket] for bucket in profile.calibrated}
+    )
+    return profile
+
+
+def load_profile(store):
+    """store に保存済みの校正結果 (無い区分は既定の折れ線) で VolumeProfile を作る"""
+    weights = {
+        bucket: curve
+        for bucket, curve in store.load_volume_profile().items()
+        if len(curve) == MINUTES
+    }
+    return VolumeProfile(weights)